@@ -0,0 +1,101 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+# decisionTable.py
+# (c) 2020 Patrick Harvey (see LICENSE.txt)
+
+# Precompiled decision tables: the class for every combination of input profile
+# colors, computed once so that classifying a map is a single table lookup per pixel.
+
+import sys, os
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.errors import SKCCError
+from ioHandling.rasterHandler import checkUnknownColors, getNorthernMask
+from classifiers.koppenArray import koppenClasses, classifyKoppen, zeroPrecipMessage
+from classifiers.holdridgeArray import holdridgeClasses, classifyHoldridge
+
+# Largest number of table entries that will be compiled (one byte each).
+maxTableEntries = 1 << 26
+
+# Number of table entries classified at once while compiling a table.
+tableChunkEntries = 1 << 18
+
+# Class ids marking table entries that are errors if any pixel uses them.
+unknownId = 255
+invalidId = 254
+
+# Raised when the input profiles have too many color combinations to compile a decision table.
+class DecisionTableTooLargeError(SKCCError):
+    pass
+
+# A table of class ids indexed by the compiled profile entries of the
+# (summer/extreme 1 temperature, winter/extreme 2 temperature, summer/extreme 1 precipitation,
+# winter/extreme 2 precipitation) inputs. In Köppen mode southern-hemisphere pixels
+# are looked up with their summer and winter inputs swapped, so one table serves both hemispheres.
+# The table does not depend on the output profile, so it can be reused with any of them.
+class DecisionTable:
+    def __init__(self, tempProfile, precProfile, mode):
+        self.mode = mode
+        self.tempLookup = tempProfile.compile()
+        self.precLookup = precProfile.compile()
+        tempEntries = len(self.tempLookup.values)
+        precEntries = len(self.precLookup.values)
+        shape = (tempEntries, tempEntries, precEntries, precEntries)
+        if (int(np.prod(shape, dtype=np.int64)) > maxTableEntries):
+            raise DecisionTableTooLargeError('Input profiles have too many colors to compile a decision table.')
+        if (mode == 'koppen'):
+            self.classNames = koppenClasses
+        elif (mode == 'holdridge'):
+            self.classNames = holdridgeClasses
+        else:
+            raise SKCCError('Invalid mode specified: ' + mode)
+
+        # Built a chunk of entries at a time, as the classifiers' temporaries for the whole table
+        # would take many times the memory of the table itself
+        classTable = np.empty(int(np.prod(shape, dtype=np.int64)), dtype=np.uint8)
+        for chunkStart in range(0, classTable.size, tableChunkEntries):
+            chunkEnd = min(chunkStart + tableChunkEntries, classTable.size)
+            classTable[chunkStart:chunkEnd] = self.classifyEntries(np.unravel_index(np.arange(chunkStart, chunkEnd), shape))
+        self.classTable = classTable.reshape(shape)
+
+    # Returns the class ids of the table entries with the given (temperature 1, temperature 2,
+    # precipitation 1, precipitation 2) compiled profile entry indices.
+    def classifyEntries(self, indices):
+        idx1, idx2, idx3, idx4 = indices
+        ignored = self.tempLookup.ignored[idx1] | self.tempLookup.ignored[idx2] | self.precLookup.ignored[idx3] | self.precLookup.ignored[idx4]
+        unknown = (self.tempLookup.unknown[idx1] | self.tempLookup.unknown[idx2] | self.precLookup.unknown[idx3] | self.precLookup.unknown[idx4]) & ~ignored
+        temp1 = self.tempLookup.values[idx1]
+        temp2 = self.tempLookup.values[idx2]
+        prec1 = self.precLookup.values[idx3]
+        prec2 = self.precLookup.values[idx4]
+        if (self.mode == 'koppen'):
+            classIds = classifyKoppen(temp1, temp2, prec1, prec2, ignored | unknown, invalidId)
+        else:
+            classIds = classifyHoldridge(temp1, temp2, prec1, prec2, ignored | unknown)
+        classIds[unknown] = unknownId
+        return classIds
+
+    # Returns the class-id array for the four input RGB arrays. isNorthernHemis is a mask of
+    # northern-hemisphere pixels, by default that for the arrays being the whole map.
+    def classify(self, rgbArrays, isNorthernHemis=None):
+        idx1 = self.tempLookup.lookupIndices(rgbArrays[0])
+        idx2 = self.tempLookup.lookupIndices(rgbArrays[1])
+        idx3 = self.precLookup.lookupIndices(rgbArrays[2])
+        idx4 = self.precLookup.lookupIndices(rgbArrays[3])
+        if (self.mode == 'koppen'):
+            if isNorthernHemis is None:
+                isNorthernHemis = getNorthernMask(idx1.shape[0], idx1.shape[1])
+            classIds = self.classTable[np.where(isNorthernHemis, idx1, idx2), np.where(isNorthernHemis, idx2, idx1),
+                                       np.where(isNorthernHemis, idx3, idx4), np.where(isNorthernHemis, idx4, idx3)]
+        else:
+            classIds = self.classTable[idx1, idx2, idx3, idx4]
+        if (classIds.size > 0) and (classIds.max() >= invalidId):
+            if (classIds == unknownId).any():
+                ignored = self.tempLookup.ignored[idx1] | self.tempLookup.ignored[idx2] | self.precLookup.ignored[idx3] | self.precLookup.ignored[idx4]
+                checkUnknownColors(rgbArrays, (self.tempLookup.unknown[idx1], self.tempLookup.unknown[idx2],
+                                               self.precLookup.unknown[idx3], self.precLookup.unknown[idx4]), ignored)
+            raise SKCCError(zeroPrecipMessage)
+        return classIds
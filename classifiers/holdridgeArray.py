@@ -0,0 +1,103 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+# holdridgeArray.py
+# (c) 2020 Patrick Harvey (see LICENSE.txt)
+
+# Whole-array Holdridge life zone classifier. Computes biotemperature for the
+# whole raster at once and maps (biotemperature band, precipitation band) pairs
+# to life zones with a table lookup, matching lookupLifeZoneColor in skcc.py.
+
+import numpy as np
+
+# Holdridge life zones in class-id order; class id 0 is reserved for ignored pixels
+# and class id i corresponds to holdridgeClasses[i-1].
+holdridgeClasses = ('Ice', 'Polar desert',
+                    'Subpolar dry tundra', 'Subpolar moist tundra', 'Subpolar wet tundra', 'Subpolar rain tundra',
+                    'Boreal desert', 'Boreal dry scrub', 'Boreal moist forest', 'Boreal wet forest', 'Boreal rain forest',
+                    'Cool temperate desert', 'Cool temperate desert scrub', 'Cool temperate steppe',
+                    'Cool temperate moist forest', 'Cool temperate wet forest', 'Cool temperate rain forest',
+                    'Warm temperate desert', 'Warm temperate desert scrub', 'Warm temperate thorn scrub',
+                    'Warm temperate dry forest', 'Warm temperate moist forest', 'Warm temperate wet forest',
+                    'Warm temperate rain forest',
+                    'Subtropical desert', 'Subtropical desert scrub', 'Subtropical thorn woodland',
+                    'Subtropical dry forest', 'Subtropical moist forest', 'Subtropical wet forest',
+                    'Subtropical rain forest',
+                    'Tropical desert', 'Tropical desert scrub', 'Tropical thorn woodland', 'Tropical very dry forest',
+                    'Tropical dry forest', 'Tropical moist forest', 'Tropical wet forest', 'Tropical rain forest')
+
+# Upper (exclusive) biotemperature bounds of the bands above Ice, which is biotemperature <= 0.
+# 17 degrees C is the 'critical temperature line' between warm temperate and subtropical.
+bioTempEdges = np.array([1.5, 3, 6, 12, 17, 24], dtype=np.float64)
+
+# Upper (exclusive) annual precipitation bounds of the precipitation bands.
+precEdges = np.array([125, 250, 500, 1000, 2000, 4000, 8000], dtype=np.float64)
+
+# Life zones for each biotemperature band, from driest to wettest. Bands with fewer
+# zones than precipitation bands use their wettest zone for the remaining bands.
+bandZones = (('Ice',),
+             ('Polar desert',),
+             ('Subpolar dry tundra', 'Subpolar moist tundra', 'Subpolar wet tundra', 'Subpolar rain tundra'),
+             ('Boreal desert', 'Boreal dry scrub', 'Boreal moist forest', 'Boreal wet forest', 'Boreal rain forest'),
+             ('Cool temperate desert', 'Cool temperate desert scrub', 'Cool temperate steppe',
+              'Cool temperate moist forest', 'Cool temperate wet forest', 'Cool temperate rain forest'),
+             ('Warm temperate desert', 'Warm temperate desert scrub', 'Warm temperate thorn scrub',
+              'Warm temperate dry forest', 'Warm temperate moist forest', 'Warm temperate wet forest',
+              'Warm temperate rain forest'),
+             ('Subtropical desert', 'Subtropical desert scrub', 'Subtropical thorn woodland', 'Subtropical dry forest',
+              'Subtropical moist forest', 'Subtropical wet forest', 'Subtropical rain forest'),
+             ('Tropical desert', 'Tropical desert scrub', 'Tropical thorn woodland', 'Tropical very dry forest',
+              'Tropical dry forest', 'Tropical moist forest', 'Tropical wet forest', 'Tropical rain forest'))
+
+# Builds the (biotemperature band, precipitation band) -> class id table.
+def buildZoneTable():
+    table = np.zeros((len(bandZones), len(precEdges) + 1), dtype=np.uint8)
+    for tBand, zones in enumerate(bandZones):
+        for pBand in range(len(precEdges) + 1):
+            table[tBand, pBand] = holdridgeClasses.index(zones[min(pBand, len(zones) - 1)]) + 1
+    return table
+
+zoneTable = buildZoneTable()
+
+# Returns an array of average biotemperatures given arrays of the two extreme month
+# temperatures. Matches getBiotemperature in skcc.py term-by-term.
+def getBiotemperatures(temp1, temp2):
+    tempTotal = np.clip(temp1, 0, 30)
+    tempTotal = tempTotal + (2 * np.clip((temp1 * 0.9330127) + (temp2 * 0.0669873), 0, 30))
+    tempTotal = tempTotal + (2 * np.clip((temp1 * 0.75) + (temp2 * 0.25), 0, 30))
+    tempTotal = tempTotal + (2 * np.clip((temp1 * 0.5) + (temp2 * 0.5), 0, 30))
+    tempTotal = tempTotal + (2 * np.clip((temp1 * 0.25) + (temp2 * 0.75), 0, 30))
+    tempTotal = tempTotal + (2 * np.clip((temp1 * 0.0669873) + (temp2 * 0.9330127), 0, 30))
+    tempTotal = tempTotal + np.clip(temp2, 0, 30)
+    return tempTotal / 12
+
+# Returns the biotemperature band (a row of zoneTable) for arrays of the two extreme month temperatures.
+def getBioTempBands(temp1, temp2):
+    bioTemp = getBiotemperatures(temp1, temp2)
+    tBand = np.searchsorted(bioTempEdges, bioTemp, side='right') + 1
+    tBand[bioTemp <= 0] = 0
+    return tBand
+
+# Returns the precipitation band (a column of zoneTable) for arrays of the two extreme month precipitations.
+def getPrecBands(prec1, prec2):
+    return np.searchsorted(precEdges, (prec1 * 6) + (prec2 * 6), side='right')
+
+# Returns an array of Holdridge life zone class ids (see holdridgeClasses) given arrays of
+# the two temperatures and two precipitations and a mask of ignored pixels, which are given class id 0.
+def classifyHoldridge(temp1, temp2, prec1, prec2, ignored):
+    classIds = zoneTable[getBioTempBands(temp1, temp2), getPrecBands(prec1, prec2)]
+    classIds[ignored] = 0
+    return classIds
+
+# Equivalent of classifyHoldridge for arrays of indices into tempValues and precValues, the values
+# of the entries of compiled input profiles. The biotemperature band depends only on the two
+# temperatures and the precipitation band only on the two precipitations, so the bands are worked
+# out once for every pair of entries and each pixel's zone is then looked up from its entries.
+def classifyHoldridgeEntries(tempIndices1, tempIndices2, precIndices1, precIndices2, tempValues, precValues, ignored):
+    tBands = getBioTempBands(tempValues.reshape(-1, 1), tempValues.reshape(1, -1)).astype(np.uint8)
+    pBands = getPrecBands(precValues.reshape(-1, 1), precValues.reshape(1, -1)).astype(np.uint8)
+    # Each (biotemperature band, precipitation band) pair as a single index into the flattened zone table
+    tBands *= zoneTable.shape[1]
+    classIds = zoneTable.ravel()[tBands[tempIndices1, tempIndices2] + pBands[precIndices1, precIndices2]]
+    classIds[ignored] = 0
+    return classIds
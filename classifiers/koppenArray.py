@@ -0,0 +1,123 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+# koppenArray.py
+# (c) 2020 Patrick Harvey (see LICENSE.txt)
+
+# Whole-array Köppen-Geiger classifier. Applies the same thresholds as the
+# per-pixel classifier in skcc.py (getClimateColor) as boolean masks over NumPy arrays.
+
+import sys, os
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.errors import SKCCError
+
+# Köppen-Geiger classes in class-id order; class id 0 is reserved for ignored pixels
+# and class id i corresponds to koppenClasses[i-1].
+koppenClasses = ('Af', 'As', 'Aw', 'Am', 'Cfa', 'Csa', 'Cwa', 'Cfb', 'Csb', 'Cwb', 'Cfc', 'Csc', 'Cwc',
+                 'Dfa', 'Dsa', 'Dwa', 'Dfb', 'Dsb', 'Dwb', 'Dfc', 'Dsc', 'Dwc', 'Dfd', 'Dsd', 'Dwd',
+                 'ET', 'EF', 'BSh', 'BSk', 'BWh', 'BWk')
+
+# Letter codes for each part of a climate class, indexed by position in the string.
+tLetters = 'ABCDE'
+pLetters = 'fmswSWTF'
+sLetters = 'xhkabcd'
+
+# Builds the (temperature type, precipitation pattern, seasonal pattern) -> class id table.
+def buildClassTable():
+    table = np.zeros((len(tLetters), len(pLetters), len(sLetters)), dtype=np.uint8)
+    for idx, climate in enumerate(koppenClasses):
+        sLetter = climate[2] if len(climate) > 2 else 'x'
+        table[tLetters.index(climate[0]), pLetters.index(climate[1]), sLetters.index(sLetter)] = idx + 1
+    return table
+
+classTable = buildClassTable()
+
+zeroPrecipMessage = 'Annual precipitation estimate of zero for a non-polar climate; cannot estimate aridity.'
+
+def tCode(letter):
+    return tLetters.index(letter)
+
+def pCode(letter):
+    return pLetters.index(letter)
+
+def sCode(letter):
+    return sLetters.index(letter)
+
+# Returns an array of Köppen-Geiger class ids (see koppenClasses) given arrays of
+# summer/winter temperatures and precipitations (already swapped for the hemisphere)
+# and a mask of ignored pixels, which are given class id 0.
+# Pixels whose aridity cannot be estimated (zero annual precipitation outside polar climates)
+# raise an error, or are given class id invalidId if one is passed.
+def classifyKoppen(tempS, tempW, precS, precW, ignored, invalidId=None):
+    maxTemp = np.maximum(tempS, tempW)
+    minTemp = np.minimum(tempS, tempW)
+
+    # Temperature type, assigned in reverse order of precedence (see getTemperatureType)
+    tType = np.full(tempS.shape, tCode('D'), dtype=np.uint8)
+    tType[minTemp >= 0] = tCode('C')
+    tType[maxTemp < 10] = tCode('E')
+    tType[minTemp > 18] = tCode('A')
+
+    # Aridity check (see getEvaEstimate); polar climates are exempted
+    tAnn = (tempS + tempW) / 2.0
+    summerEst = precS * 6.0
+    winterEst = precW * 6.0
+    annualEst = summerEst + winterEst
+    notPolar = (tType != tCode('E')) & ~ignored
+    invalid = notPolar & (annualEst == 0)
+    if (invalidId is None) and invalid.any():
+        raise SKCCError(zeroPrecipMessage)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        summerPrecipPercent = (summerEst / annualEst) * 100.0
+    evaporation = np.where(summerPrecipPercent > 66.667, 10.0 * ((2.0 * tAnn) + 28.0),
+                           np.where(summerPrecipPercent < 33.333, 10.0 * (2.0 * tAnn), 10.0 * ((2.0 * tAnn) + 14.0)))
+    desert = notPolar & (annualEst < (evaporation / 2.0))
+    steppe = notPolar & ~desert & (annualEst < evaporation)
+    tType[desert | steppe] = tCode('B')
+
+    # Precipitation pattern (see getPrecipitationPattern)
+    pType = np.full(tempS.shape, pCode('f'), dtype=np.uint8)
+    pType[steppe] = pCode('S')
+    pType[desert] = pCode('W')
+
+    isA = tType == tCode('A')
+    wThresh = 100 - (annualEst / 25.0)
+    dryPrecip = np.minimum(precS, precW)
+    aPattern = np.where(precW < 60, pCode('w'), pCode('s'))
+    aPattern = np.where(dryPrecip >= wThresh, pCode('m'), aPattern)
+    aPattern = np.where((precS > 60) & (precW > 60), pCode('f'), aPattern)
+    pType = np.where(isA, aPattern, pType)
+
+    isCD = (tType == tCode('C')) | (tType == tCode('D'))
+    cdPattern = np.where((precS < (precW * 0.33)) & (precS < 40), pCode('s'), pCode('f'))
+    cdPattern = np.where(precW < (precS * 0.1), pCode('w'), cdPattern)
+    pType = np.where(isCD, cdPattern, pType)
+
+    isE = tType == tCode('E')
+    pType = np.where(isE, np.where(maxTemp < 0, pCode('F'), pCode('T')), pType)
+
+    # Seasonal pattern (see getSeasonalPattern)
+    sType = np.full(tempS.shape, sCode('x'), dtype=np.uint8)
+    isB = tType == tCode('B')
+    sType[isB] = np.where(tAnn[isB] >= 18.0, sCode('h'), sCode('k'))
+
+    warmSummer = tempS >= 22
+    isC = tType == tCode('C')
+    cPattern = np.where((tempW < 10) & (tempS < 13), sCode('c'), sCode('b'))
+    cPattern = np.where(warmSummer, sCode('a'), cPattern)
+    sType = np.where(isC, cPattern, sType)
+
+    isD = tType == tCode('D')
+    dPattern = np.where((tempW < -10) & (tempS <= 14), sCode('c'), sCode('b'))
+    dPattern = np.where(tempW < -38, sCode('d'), dPattern)
+    dPattern = np.where(warmSummer, sCode('a'), dPattern)
+    sType = np.where(isD, dPattern, sType)
+
+    classIds = classTable[tType, pType, sType]
+    classIds[ignored] = 0
+    if not (invalidId is None):
+        classIds[invalid] = invalidId
+    return classIds
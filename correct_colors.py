@@ -5,15 +5,6 @@ import argparse
 import re
 import numpy as np # import numpy
 
-# accept command-line arguments
-parser = argparse.ArgumentParser(description='Convert non-standard colors in input image to nearest standard colors')
-parser.add_argument('input_img', metavar='i', type=str, help='input image filepath')
-parser.add_argument('output_img', metavar='o', type=str, help='output image filepath')
-parser.add_argument('colors', metavar='c', type=str, help='color profile filepath')
-parser.add_argument('--wrap', metavar='w', type=str, help='longitude axis (x or y)')
-
-args = parser.parse_args()
-
 # parse input text file
 def readInputProfile(fname):
     fp = open(fname, 'r')
@@ -40,76 +31,139 @@ def readInputProfile(fname):
         fp.close()
     return profTable
 
-img_name = args.input_img # input image filepath
-color_file = args.colors
-colors = readInputProfile(color_file)# set valid colors
-wrap = args.wrap
-print(wrap)
+def pack_rgb(rgb): # pack RGB colors into single integers
+    # Inputs
+    #   rgb (np.array, shape=(..., 3)): RGB colors
+    # Outputs
+    #   packed (np.array, shape=(...)): r << 16 | g << 8 | b for each color
+    rgb = rgb.astype(np.int64)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
 
-# open image
-im = Image.open(img_name)
-pixels = im.load()
-print("Loaded image")
+def get_color_indices(rgb, colors): # determine which valid color (if any) each pixel has
+    # Inputs
+    #   rgb (np.array, shape=(H, W, 3)): pixel colors
+    #   colors (list): valid colors
+    # Outputs
+    #   idx (np.array, shape=(H, W)): index (in colors) of each pixel's color OR -1 if not a valid color
+    keys = pack_rgb(np.array(colors, dtype=np.int64).reshape(-1, 3))
+    order = np.argsort(keys)
+    keys = keys[order]
+    packed = pack_rgb(rgb)
+    pos = np.minimum(np.searchsorted(keys, packed), len(keys) - 1)
+    return np.where(keys[pos] == packed, order[pos], -1)
 
-# initialize pixel discriminator
-sieve = np.zeros((len(colors), im.size[0], im.size[1]))
-for i in range(0, len(colors)):
-    for j in range(0, im.size[0]):
-        for k in range(0, im.size[1]):
-            sieve[i,j,k] = pixels[j,k][0:3] == colors[i]
-print("Sieve created")
-            
-def get_pval(loc): # determine whether the color of a given pixel is valid
+def fill_nearest(idx, wrap): # give every invalid pixel the color of its nearest valid pixel
     # Inputs
-    #   loc (np.array, shape=(2)): pixel location
+    #   idx (np.array, shape=(H, W)): color index of each pixel OR -1 if not a valid color
+    #   wrap (str): longitude axis ('x' or 'y') or None
     # Outputs
-    #   val (int): index (in colors) of the input pixel's color OR None if not a valid color
-    val = None
-    for i in range(0,len(sieve)):
-        if sieve[i, loc[0], loc[1]]:
-            val = i
-    return val
+    #   idx (np.array, shape=(H, W)): color index of each pixel, with invalid pixels filled in
+    # Breadth-first flood from all valid pixels at once, so each invalid pixel is reached first
+    # from a valid pixel at the least (taxicab) distance; each pass only visits the newly reached
+    # pixels. Among equally near neighbors, those below, right, above then left of a pixel take precedence.
+    # The search wraps around the longitude axis, but never from one pole to the other.
+    height, width = idx.shape
+    flat = idx.ravel().copy()
+    frontier = np.flatnonzero(flat >= 0)
+    if frontier.size == 0:
+        raise ValueError('No pixels in the image have a valid color')
+    while frontier.size:
+        rows, cols = np.divmod(frontier, width)
+        targets = []
+        values = []
+        for dy, dx in ((-1, 0), (0, -1), (1, 0), (0, 1)): # reached pixel is above, left, below, right of the valid one
+            trows = rows + dy
+            tcols = cols + dx
+            if wrap == 'y':
+                trows %= height
+            if wrap == 'x':
+                tcols %= width
+            inside = (trows >= 0) & (trows < height) & (tcols >= 0) & (tcols < width)
+            target = trows[inside] * width + tcols[inside]
+            reached = flat[target] < 0
+            targets.append(target[reached])
+            values.append(flat[frontier[inside][reached]])
+        targets = np.concatenate(targets)
+        values = np.concatenate(values)
+        frontier, first = np.unique(targets, return_index=True)
+        flat[frontier] = values[first]
+    return flat.reshape(height, width)
 
-def correct(loc): # modify the color of a given pixel to match its nearest valid neighbor
+def snap_to_palette(rgb, colors, max_dist=None): # find the nearest valid color in RGB space for each pixel
     # Inputs
-    # loc (np.array, shape=(2)): pixel location
+    #   rgb (np.array, shape=(N, 3)): pixel colors
+    #   colors (list): valid colors
+    #   max_dist (float): largest RGB distance to snap across OR None for no limit
     # Outputs
-    # n_col (int): index (in pcolors) of the nearest valid color
-    n_col = None
-    pos = np.copy(loc)
-    i = 0
-    steps = 0
-    d = np.array([-1,1])
-    ax = np.array([0,0,1])
-    while n_col == None: # iterate through nearest pixels in an expanding pinwheel
-        if i == 4*steps: # if one rotation completed, increase radius
-            steps += 1
-            pos += np.array([-1,0])
-            i = 0
-        if i%steps == 0: # if one quarter-rotation completed, change direction
-            d = np.append(d, 0)
-            d = np.cross(d,ax)
-            d = d[0:2]
-        pos += d
-        i += 1
-        # modify position to fit coordinates, flooring x- or y-coordinate (user's choice); ensures search does not wrap around north pole to south pole or vice versa
-        if wrap == 'x':
-            pos = np.array([pos[0]%im.size[0], max(pos[1],0)%im.size[1]]) 
-        elif wrap == 'y':
-            pos = np.array([max(pos[0],0)%im.size[0], pos[1]%im.size[1]])
-        else:
-            pos = np.array([max(pos[0],0)%im.size[0], max(pos[1],0)%im.size[1]])
-        n_col = get_pval(pos)
+    #   idx (np.array, shape=(N)): index (in colors) of the nearest valid color OR -1 if none is within max_dist
+    # Each distinct pixel color is compared against the whole palette once, so the work
+    # depends on the number of distinct colors rather than the number of pixels.
+    palette = np.array(colors, dtype=np.int64).reshape(-1, 3)
+    packed, inverse = np.unique(pack_rgb(rgb), return_inverse=True)
+    unique_rgb = np.stack(((packed >> 16) & 255, (packed >> 8) & 255, packed & 255), axis=1)
+    nearest = np.empty(len(packed), dtype=np.int64)
+    for start in range(0, len(packed), 65536): # bound the size of the distance table
+        dist2 = ((unique_rgb[start:start + 65536, np.newaxis, :] - palette[np.newaxis, :, :]) ** 2).sum(axis=2)
+        best = np.argmin(dist2, axis=1)
+        if max_dist is not None:
+            best = np.where(dist2[np.arange(len(best)), best] <= max_dist ** 2, best, -1)
+        nearest[start:start + 65536] = best
+    return nearest[inverse.ravel()]
+
+def correct_colors(im, colors, wrap=None, method='neighbor', max_dist=None): # recolor invalid pixels to valid colors
+    # Inputs
+    #   im (PIL.Image): input image
+    #   colors (list): valid colors
+    #   wrap (str): longitude axis ('x' or 'y') or None
+    #   method (str): 'neighbor' to copy the nearest valid pixel, 'palette' to snap to the nearest
+    #                 valid color in RGB space, or 'both' to snap colors within max_dist of a valid
+    #                 color and copy the nearest valid pixel for the rest
+    #   max_dist (float): largest RGB distance to snap across OR None for no limit
+    # Outputs
+    #   out (PIL.Image): corrected image, keeping any alpha channel of the input
+    #   n_snapped (int): number of pixels snapped to the nearest valid color
+    #   n_filled (int): number of pixels copied from the nearest valid pixel
+    if im.mode not in ('RGB', 'RGBA'):
+        im = im.convert('RGBA' if (('A' in im.getbands()) or ('transparency' in im.info)) else 'RGB')
+    data = np.array(im)
+    idx = get_color_indices(data[:, :, 0:3], colors)
+    invalid = idx < 0
+    n_snapped = 0
+    if (method in ('palette', 'both')) and invalid.any():
+        snapped = snap_to_palette(data[invalid, 0:3], colors, max_dist if method == 'both' else None)
+        idx[invalid] = snapped
+        n_snapped = int((snapped >= 0).sum())
+    unfilled = idx < 0
+    if unfilled.any():
+        idx = fill_nearest(idx, wrap)
+    data[invalid, 0:3] = np.array(colors, dtype=np.uint8)[idx[invalid]]
+    return Image.fromarray(data, im.mode), n_snapped, int(unfilled.sum())
+
+if __name__ == '__main__':
+    # accept command-line arguments
+    parser = argparse.ArgumentParser(description='Convert non-standard colors in input image to nearest standard colors')
+    parser.add_argument('input_img', metavar='i', type=str, help='input image filepath')
+    parser.add_argument('output_img', metavar='o', type=str, help='output image filepath')
+    parser.add_argument('colors', metavar='c', type=str, help='color profile filepath')
+    parser.add_argument('--wrap', metavar='w', type=str, choices=['x', 'y'], help='longitude axis (x or y)')
+    parser.add_argument('--method', metavar='m', type=str, choices=['neighbor', 'palette', 'both'], default='neighbor',
+                        help='neighbor (copy nearest valid pixel), palette (snap to nearest valid color) or both')
+    parser.add_argument('--max-dist', metavar='d', type=float, default=32.0,
+                        help='largest RGB distance snapped to a valid color with --method both (default 32)')
+
+    args = parser.parse_args()
+
+    colors = readInputProfile(args.colors) # set valid colors
+
+    # open image
+    im = Image.open(args.input_img)
+    print("Loaded image")
 
-    print("Corrected pixel at " + str(loc[0]) + ", " + str(loc[1]) + " with " + str(pos[0]) + ", " + str(pos[1]))
-    return n_col
-    
-for i in range(0, im.size[0]): # iterate through and correct all pixels in image
-    for j in range(0, im.size[1]):
-        loc = np.array([i,j])
-        if get_pval(loc)==None:
-            n_col = correct(loc)
-            pixels[i,j] = colors[n_col]
+    new_im, n_snapped, n_filled = correct_colors(im, colors, args.wrap, args.method, args.max_dist)
+    if args.method != 'neighbor':
+        print("Snapped " + str(n_snapped) + " pixels to the nearest valid color")
+    if args.method != 'palette':
+        print("Corrected " + str(n_filled) + " pixels from the nearest valid pixel")
+    print("Changed " + str(n_snapped + n_filled) + " pixels in total")
 
-new_name = args.output_img # output filepath
-im.save(new_name) # save image
+    new_im.save(args.output_img) # save image
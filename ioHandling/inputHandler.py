@@ -7,20 +7,35 @@
 # Classes and functionality for reading in input profiles and
 # interpreting input data.
 
-import sys, re, os
+import sys, re, os, threading
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from utils.errors import SKCCError
 
+# NumPy is only needed for compiled profiles, used by the array-based engines.
+try:
+    import numpy as np
+    from ioHandling.rasterHandler import packRGB, IndexedRaster
+except ImportError:
+    np = None
+
+# Held while compiling a profile, so that threads sharing a profile compile it only once.
+compileLock = threading.Lock()
+
+# Rasters of at least this many pixels are looked up through a table indexed by every possible
+# packed RGB color, rather than by binary search of the profile's colors.
+colorTableMinPixels = 1 << 16
+
 class InputProfile:
     def __init__(self, iTable, ignoredColors, default=None):
         self.colorTable = iTable
         self.ignoreColors = ignoredColors
         self.defaultValue = default
+        self.compiledProfile = None
 
     def isIgnored(self, rgbColor):
-        if ((rgbColor in self.ignoreColors) or ((not (rgbColor in self.colorTable.keys())) and (self.defaultValue == 'X'))):
+        if ((rgbColor in self.ignoreColors) or ((not (rgbColor in self.colorTable)) and (self.defaultValue == 'X'))):
             return True
         else:
             return False
@@ -34,6 +49,79 @@ class InputProfile:
         else:
             return self.colorTable[rgbColor]
 
+    # Returns the compiled (array lookup) form of this profile, compiling it on first use.
+    # The compiled form reflects the profile's colors at the time it was first compiled.
+    def compile(self):
+        if self.compiledProfile is None:
+            with compileLock:
+                if self.compiledProfile is None:
+                    self.compiledProfile = CompiledInputProfile(self)
+        return self.compiledProfile
+
+# An input profile compiled into sorted arrays keyed by packed RGB color, for looking up
+# a whole raster at once. Each profile color is an entry; one extra entry at the end
+# describes colors that match nothing in the profile (per its default value).
+class CompiledInputProfile:
+    def __init__(self, profile):
+        colors = set(profile.colorTable) | set(profile.ignoreColors)
+        entryColors = sorted(colors, key=lambda c: (c[0] << 16) | (c[1] << 8) | c[2])
+        self.colors = entryColors
+        self.keys = np.array([(c[0] << 16) | (c[1] << 8) | c[2] for c in entryColors], dtype=np.uint32)
+        self.values = np.zeros(len(entryColors) + 1, dtype=np.float64)
+        self.ignored = np.zeros(len(entryColors) + 1, dtype=bool)
+        self.unknown = np.zeros(len(entryColors) + 1, dtype=bool)
+        for idx, rgbColor in enumerate(entryColors):
+            if profile.isIgnored(rgbColor):
+                self.ignored[idx] = True
+            else:
+                self.values[idx] = profile.colorTable[rgbColor]
+        if (profile.defaultValue == 'X'):
+            self.ignored[-1] = True
+        elif (profile.defaultValue is None):
+            self.unknown[-1] = True
+        else:
+            self.values[-1] = profile.defaultValue
+        self.missIndex = len(entryColors)
+        self.colorIndexTable = None
+
+    # The color index table is rebuilt when needed rather than stored with the profile.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['colorIndexTable'] = None
+        return state
+
+    # Returns a table of the entry index of every possible packed RGB color (16 MB, or 32 MB for
+    # profiles of more than 255 colors), built on first use, or None for profiles too large for one.
+    def getColorIndexTable(self):
+        if (self.colorIndexTable is None) and (self.missIndex < 65536):
+            table = np.full(1 << 24, self.missIndex, dtype=(np.uint8 if (self.missIndex < 256) else np.uint16))
+            table[self.keys] = np.arange(len(self.keys))
+            self.colorIndexTable = table
+        return self.colorIndexTable
+
+    # Returns an array of entry indices for an (..., 3) RGB array; colors that
+    # match no entry get the index of the final (unmatched color) entry.
+    # For an indexed-color map, only the palette is looked up. The indices of large rasters
+    # are looked up in the color index table, and are as small an integer type as it holds.
+    def lookupIndices(self, rgbArray):
+        if isinstance(rgbArray, IndexedRaster):
+            return self.lookupIndices(rgbArray.palette)[rgbArray.indices]
+        packed = packRGB(rgbArray)
+        if (packed.size >= colorTableMinPixels) and not (self.getColorIndexTable() is None):
+            return self.colorIndexTable[packed]
+        if (len(self.keys) == 0):
+            return np.full(packed.shape, self.missIndex, dtype=np.intp)
+        indices = np.searchsorted(self.keys, packed)
+        np.minimum(indices, len(self.keys) - 1, out=indices)
+        indices[self.keys[indices] != packed] = self.missIndex
+        return indices
+
+    # Returns (values, ignored, unknown) arrays for an (..., 3) RGB array.
+    # Unknown pixels are those whose colors match nothing in a profile with no default value.
+    def lookup(self, rgbArray):
+        indices = self.lookupIndices(rgbArray)
+        return self.values[indices], self.ignored[indices], self.unknown[indices]
+
 def readInputProfile(fname):
     fp = open(fname, 'r')
     profTable = {}
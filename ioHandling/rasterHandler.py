@@ -0,0 +1,230 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+# rasterHandler.py
+# (c) 2020 Patrick Harvey (see LICENSE.txt)
+
+# Functionality for reading input images into NumPy arrays and
+# interpreting them through input profiles, for the array-based classifiers.
+
+import sys, os
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.errors import SKCCError
+
+# Returns an (height, width, 3) array of the RGB channels of an image.
+# Any channels beyond RGB (e.g. alpha) are dropped.
+def getRGBArray(img):
+    bandList = img.getbands()
+    if not ('R' in bandList):
+        raise SKCCError('No red color channel in one or more input images.')
+    elif not ('G' in bandList):
+        raise SKCCError('No green color channel in one or more input images.')
+    elif not ('B' in bandList):
+        raise SKCCError('No blue color channel in one or more input images.')
+    data = np.asarray(img)
+    if (bandList == ('R', 'G', 'B')):
+        return data
+    return data[:, :, [bandList.index('R'), bandList.index('G'), bandList.index('B')]]
+
+# Raises an error unless an array is a (height, width, 3) RGB or (height, width, 4) RGBA array of uint8.
+def checkRGBArray(rgbArray, name='Input array'):
+    if (rgbArray.ndim != 3) or not (rgbArray.shape[2] in (3, 4)) or (rgbArray.dtype != np.uint8):
+        raise SKCCError(name + ' is not a (height, width, 3) RGB or (height, width, 4) RGBA array of uint8.')
+
+# PIL image modes of greyscale images holding values (rather than colors), e.g. 16-bit or float TIFFs.
+valueImageModes = ('I', 'F', 'I;16', 'I;16L', 'I;16B', 'I;16S', 'I;16LS', 'I;16BS', 'I;32', 'I;32S', 'F;32F')
+
+# Returns True if an input array is a value raster ((height, width) of numbers) rather than colors.
+def isValueArray(inputArray):
+    return (inputArray.ndim == 2)
+
+# Raises an error unless an array is a (height, width) array of numbers.
+def checkValueArray(valueArray, name='Input array'):
+    if (valueArray.ndim != 2) or not (valueArray.dtype.kind in 'fiu'):
+        raise SKCCError(name + ' is not a (height, width) array of numbers.')
+
+# Raises an error unless an array is an RGB or RGBA array of colors or a value raster.
+def checkInputArray(inputArray, name='Input array'):
+    if (inputArray.ndim == 2):
+        checkValueArray(inputArray, name)
+    else:
+        checkRGBArray(inputArray, name)
+
+# Returns the values of a value raster as floats, with NaN for ignored (or masked) pixels,
+# along with the mask of ignored pixels.
+def getValueArray(valueArray):
+    values = np.ma.getdata(valueArray).astype(np.float64)
+    ignored = np.isnan(values) | np.ma.getmaskarray(valueArray)
+    values[ignored] = np.nan
+    return values, ignored
+
+# Returns the array in a NumPy (.npy) file, memory-mapped so that only the parts used are read from disk.
+def openArrayFile(fname):
+    try:
+        return np.load(fname, mmap_mode='r', allow_pickle=False)
+    except OSError as e:
+        raise SKCCError('Could not read array file ' + fname + ': ' + str(e))
+    except ValueError:
+        raise SKCCError('Not a NumPy array file: ' + fname)
+
+# Returns an RGB (or RGBA) input map or value raster stored in a .npy file as a memory-mapped array.
+def openInputArrayFile(fname):
+    inputArray = openArrayFile(fname)
+    checkInputArray(inputArray, 'Array file ' + fname)
+    return inputArray
+
+# Returns the four input maps stored in a stack file: a .npy file holding a (4, height, width, 3)
+# uint8 array of the summer temperature, winter temperature, summer precipitation and winter
+# precipitation maps, in that order, or a (4, height, width) array of those maps as value rasters.
+# The maps are memory-mapped views of the file.
+def openInputStack(fname):
+    stack = openArrayFile(fname)
+    if (stack.ndim == 3) and (stack.shape[0] == 4) and (stack.dtype.kind in 'fiu'):
+        return [stack[idx] for idx in range(4)]
+    if (stack.ndim != 4) or (stack.shape[0] != 4) or (stack.shape[3] != 3) or (stack.dtype != np.uint8):
+        raise SKCCError('Stack file ' + fname + ' is not a (4, height, width, 3) array of uint8 or a (4, height, width) array of numbers.')
+    return [stack[idx] for idx in range(4)]
+
+# An indexed-color (mode 'P') map held as its palette indices and palette, standing in for its
+# (height, width, 3) RGB array without expanding it. Compiled input profiles look up each palette
+# entry once and gather the results by index. Indexing with a boolean mask or a single pixel gives
+# the RGB colors of those pixels; slicing gives the indexed map of the slice.
+# Anything else sees the expanded RGB array (through numpy.asarray).
+class IndexedRaster:
+    def __init__(self, indices, palette):
+        self.indices = indices
+        self.palette = palette
+
+    @property
+    def shape(self):
+        return self.indices.shape + (3,)
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def dtype(self):
+        return self.palette.dtype
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple) and (len(key) == 3):
+            # Only the RGB channels are ever selected
+            key = key[0:2]
+        isMask = isinstance(key, np.ndarray) and (key.dtype == bool)
+        subIndices = self.indices[key]
+        if isMask or (subIndices.ndim != 2):
+            return self.palette[subIndices]
+        return IndexedRaster(subIndices, self.palette)
+
+    def __array__(self, dtype=None, copy=None):
+        rgbArray = self.palette[self.indices]
+        return rgbArray if (dtype is None) else rgbArray.astype(dtype)
+
+# Returns an indexed-color (mode 'P') image as an IndexedRaster of its palette indices.
+def getIndexedRaster(img):
+    palette = np.array(img.getpalette() or [], dtype=np.uint8).reshape(-1, 3)[:, 0:3]
+    if (len(palette) < 256):
+        # Indices past the end of the palette are black, as when PIL converts the image to RGB
+        palette = np.concatenate([palette, np.zeros((256 - len(palette), 3), dtype=np.uint8)])
+    return IndexedRaster(np.asarray(img), palette)
+
+# Packs an (..., 3) RGB array into a single integer per pixel.
+def packRGB(rgbArray):
+    rgbArray = np.asarray(rgbArray)
+    packed = rgbArray[..., 0].astype(np.uint32)
+    for channel in (1, 2):
+        packed <<= 8
+        np.bitwise_or(packed, rgbArray[..., channel], out=packed, casting='unsafe')
+    return packed
+
+# Converts a packed RGB integer back into an (R, G, B) tuple.
+def unpackRGB(packed):
+    packed = int(packed)
+    return ((packed >> 16) & 255, (packed >> 8) & 255, packed & 255)
+
+# Formats an (R, G, B) color for error messages.
+def formatRGB(rgbColor):
+    return '(' + str(rgbColor[0]) + ', ' + str(rgbColor[1]) + ', ' + str(rgbColor[2]) + ')'
+
+# Raises an error listing every color that did not match its input profile, among pixels
+# that have an unknown color in some input and are not ignored in any input.
+def checkUnknownColors(rgbArrays, unknownMasks, ignoredAny):
+    badColors = set()
+    for rgbArray, unknown in zip(rgbArrays, unknownMasks):
+        badPixels = unknown & ~ignoredAny
+        if badPixels.any():
+            badColors.update(int(c) for c in np.unique(packRGB(rgbArray[badPixels])))
+    if (len(badColors) == 1):
+        raise SKCCError('Invalid color in input data (did not match input profile): ' + formatRGB(unpackRGB(badColors.pop())))
+    elif badColors:
+        raise SKCCError('Invalid colors in input data (did not match input profile): ' + ', '.join(formatRGB(unpackRGB(c)) for c in sorted(badColors)))
+
+# Adds the pixels of an RGB array (or IndexedRaster) in badPixels to found, a dictionary from packed
+# RGB colors to the count, bounding box [left, top, right, bottom] (right and bottom exclusive) and
+# first maxPixels [x, y] coordinates (in row order) of the pixels of that color. For a strip of rows,
+# rowOffset is the strip's first row. Works through all the pixels at once, so is fast on large maps.
+def addBadPixels(found, rgbArray, badPixels, rowOffset=0, maxPixels=20):
+    ys, xs = np.nonzero(badPixels)
+    if (len(ys) == 0):
+        return
+    colors, inverse, counts = np.unique(packRGB(rgbArray[badPixels]), return_inverse=True, return_counts=True)
+    order = np.argsort(inverse.reshape(-1), kind='stable')
+    xs = xs[order]
+    ys = ys[order] + rowOffset
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    lefts = np.minimum.reduceat(xs, starts)
+    rights = np.maximum.reduceat(xs, starts) + 1
+    tops = np.minimum.reduceat(ys, starts)
+    bottoms = np.maximum.reduceat(ys, starts) + 1
+    for idx, color in enumerate(colors):
+        entry = found.get(int(color))
+        if entry is None:
+            entry = {'count': 0, 'boundingBox': [int(lefts[idx]), int(tops[idx]), int(rights[idx]), int(bottoms[idx])], 'pixels': []}
+            found[int(color)] = entry
+        box = entry['boundingBox']
+        entry['count'] += int(counts[idx])
+        entry['boundingBox'] = [min(box[0], int(lefts[idx])), min(box[1], int(tops[idx])), max(box[2], int(rights[idx])), max(box[3], int(bottoms[idx]))]
+        needed = min(maxPixels - len(entry['pixels']), int(counts[idx]))
+        start = starts[idx]
+        entry['pixels'].extend([int(x), int(y)] for x, y in zip(xs[start:start + needed], ys[start:start + needed]))
+
+# Returns a boolean mask that is True for pixels treated as northern hemisphere.
+# Matches the per-pixel classifier, which treats the first half of the pixels in
+# image order as northern (so the split can fall partway along a row).
+# For a strip of rows, rowOffset is the strip's first row and totalHeight the full image height.
+def getNorthernMask(height, width, rowOffset=0, totalHeight=None):
+    if totalHeight is None:
+        totalHeight = height
+    cutoff = ((totalHeight * width) + 1) // 2
+    cutRow, cutCol = divmod(cutoff, width)
+    rows = np.arange(rowOffset, rowOffset + height).reshape(height, 1)
+    cols = np.arange(width).reshape(1, width)
+    return (rows < cutRow) | ((rows == cutRow) & (cols < cutCol))
+
+# Returns an (N+1, 3) array of output colors for a class-id raster, where id 0 is
+# the ignored color and id i is the color of classNames[i-1]. Classes missing from the
+# output profile get the unknown color and are reported by colorizeClassIds if used.
+def buildClassPalette(classNames, outProfile):
+    palette = np.zeros((len(classNames) + 1, 3), dtype=np.uint8)
+    palette[0] = outProfile.ignoredColor
+    for idx, name in enumerate(classNames):
+        palette[idx + 1] = outProfile.colorTable.get(name, outProfile.unknownColor)
+    return palette
+
+# Raises an error if a class used in a class-id raster has no color in the output profile.
+def checkClassColors(classIds, classNames, outProfile):
+    missing = [idx for idx, name in enumerate(classNames) if not (name in outProfile.colorTable)]
+    if missing:
+        counts = np.bincount(classIds.ravel(), minlength=len(classNames) + 1)
+        for idx in missing:
+            if counts[idx + 1] > 0:
+                raise SKCCError('Output profile has no color for class: ' + classNames[idx])
+
+# Converts a class-id raster into an (height, width, 3) RGB array using the output profile.
+def colorizeClassIds(classIds, classNames, outProfile):
+    checkClassColors(classIds, classNames, outProfile)
+    return buildClassPalette(classNames, outProfile)[classIds]
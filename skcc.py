@@ -4,16 +4,40 @@
 # Speculative Köppen-Geiger Climate Classifier
 # (c) 2018-2020 Patrick Harvey (see LICENSE.txt)
 
-import sys, getopt, itertools, re, time
+import sys, os, getopt, itertools, re, time, json, csv, hashlib, multiprocessing
 from PIL import Image
 from utils.errors import SKCCError
+from utils.profiling import StageProfiler
+from utils.diskCache import DiskCache, hashParts, hashFile, defaultMaxBytes
 from ioHandling.inputHandler import readInputProfile, InputProfile
 from ioHandling.outputHandler import readOutputProfile, OutputProfile
 
+# NumPy is only needed for the array-based classification engines.
+try:
+    import numpy as np
+    from multiprocessing import shared_memory
+    from ioHandling.rasterHandler import getRGBArray, checkUnknownColors, getNorthernMask, colorizeClassIds, checkClassColors, buildClassPalette
+    from ioHandling.rasterHandler import checkInputArray, openArrayFile, openInputArrayFile, openInputStack, isValueArray, getValueArray, valueImageModes
+    from ioHandling.rasterHandler import getIndexedRaster, addBadPixels, unpackRGB, packRGB, IndexedRaster
+    from classifiers.koppenArray import koppenClasses, classifyKoppen
+    from classifiers.holdridgeArray import holdridgeClasses, classifyHoldridge, classifyHoldridgeEntries
+    from classifiers.decisionTable import DecisionTable, DecisionTableTooLargeError
+    from utils.classStatistics import ClassStatistics
+except ImportError:
+    np = None
+
 versionNumber = '0.0.8'
 
 modes = {'koppen', 'holdridge'}
 
+# 'rgb' writes full color images; 'palette' paletted images; 'classes' class-id rasters with a legend.
+outputFormats = {'rgb', 'palette', 'classes'}
+
+# 'scalar' classifies pixel-by-pixel; 'numpy' classifies whole arrays at once;
+# 'memo' classifies each unique combination of input colors once with the per-pixel logic;
+# 'table' precompiles the class of every combination of input profile colors and looks pixels up in it.
+engines = {'scalar', 'numpy', 'memo', 'table'}
+
 kColorTableDefault = {'Af':(11, 36, 250), 'As':(76, 171, 247), 'Aw':(76, 171, 247), 'Am':(21, 123, 251), 
                'Cfa':(199, 253, 92), 'Csa':(255, 253, 56), 'Cwa':(153, 253, 154),
                'Cfb':(109, 253, 70), 'Csb':(198, 197, 41), 'Cwb':(103, 197, 104),
@@ -57,6 +81,9 @@ defaultOceanColor = (107, 165, 210)
 
 defaultUnknownColor = (0, 0, 0)
 
+# Color of the pixels whose class is the same in both scenarios, in change maps.
+defaultUnchangedColor = (200, 200, 200)
+
 def usage():
     print('''skcc.py : Speculative Köppen-Geiger Climate Classifier
   Converts input temperature and precipitation data into a map painted with
@@ -67,7 +94,10 @@ def usage():
     -s, --quiet   : Silences successful completion output
     -d, --debug   : Displays stack traces for runtime errors (defaults to off)
     -m, --mode    : Sets the operational mode (what to classify). Defaults to koppen mode if not given. Valid settings are
-                    'koppen' or 'holdridge'.
+                    'koppen' or 'holdridge'. Can be given more than once to produce a map for each mode in one pass,
+                    with an --outfile (and optionally an --outprof) given for each mode in the same order.
+    -e, --engine  : Sets the classification engine. Defaults to scalar if not given. Valid settings are
+                    'scalar', 'numpy', 'memo' or 'table' (all but scalar require NumPy, and are much faster on large maps).
     -o<fname>, --outfile=<fname>  : Outputs the resulting image to the filepath '<fname>', 
                                     requires two temperature and two precipitation inputs. Required.
     -t<fname>, --tempnw=<fname>   : Takes temperature input data for northern-hemisphere winter 
@@ -78,7 +108,58 @@ def usage():
     -q<fname>, --precns=<fname>   : Take precipitation input for northern-hemisphere summer from the image '<fname>'. Required.
     -v<fname>, --tempprof=<fname> : Take the input temperature color profile from the filename '<fname>'. 
     -r<fname>, --precprof=<fname> : Take the input precipitation color profile from the filename '<fname>'.
-    -k<fname>, --outprof=<fname>  : Take the output color profile from the filename '<fname>'. ''')
+    -k<fname>, --outprof=<fname>  : Take the output color profile from the filename '<fname>'.
+    --strip=<rows>                : Decode and classify the map <rows> rows at a time to limit memory use.
+                                    Requires the numpy, memo or table engine; defaults to numpy.
+    -j<n>, --jobs=<n>             : Classify the map in <n> worker processes. Requires the numpy, memo or table engine;
+                                    defaults to numpy.
+    --profile=<fname>             : Write the time taken by each stage (decoding, lookup, classification, output), pixels per
+                                    second and peak memory use as JSON to '<fname>' ('-' for standard output).
+    --cache=<dir>                 : Cache parsed profiles and compiled decision tables in the directory '<dir>', shared
+                                    between runs. Defaults to the SKCC_CACHE_DIR environment variable; off if neither is set.
+    --cache-size=<mb>             : Limit the cache to <mb> megabytes, removing the least recently used entries. Defaults to 256.
+    --cache-layers                : Also cache the input images as decoded and converted through the input profiles, so
+                                    later runs on the same images and profiles skip straight to classification. Requires
+                                    a cache directory and the numpy, memo or table engine.
+    --incremental                 : Reclassify only the tiles of the map whose inputs changed since the last incremental
+                                    render, patching the previous output (which needs a lossless format such as PNG).
+                                    Requires the numpy, memo or table engine; defaults to numpy. Cannot be used with
+                                    --strip or --jobs.
+    --watch                       : Render incrementally, then again whenever an input or profile file changes, until
+                                    interrupted with Ctrl-C.
+    --watch-interval=<seconds>    : Check for changed files every <seconds> seconds when watching. Defaults to 1.
+    --format=<format>             : Sets the output format: 'rgb' (full color image, the default), 'palette' (paletted
+                                    image, much smaller) or 'classes' (a raster of class ids, written as a .npy file or
+                                    greyscale image according to the output file name, with a .legend.json legend).
+                                    Formats other than rgb require the numpy, memo or table engine; defaults to numpy.
+    --stack=<fname>               : Take all four inputs from the stack file '<fname>' (see --write-stack) instead of
+                                    --tempnw, --tempns, --precnw and --precns. The file is read as it is classified,
+                                    without decoding. Inputs can also be given as .npy files of RGB pixels.
+    --write-stack=<fname>         : Write the four input images to the stack file '<fname>' instead of classifying them.
+                                    Requires NumPy.
+    --stats=<fname>               : Write the number of pixels of each class, and the fractions of the map and of each
+                                    hemisphere they cover (weighted by latitude, for equirectangular maps), to '<fname>',
+                                    as CSV if its name ends in .csv and otherwise as JSON ('-' for standard output).
+                                    Requires the numpy, memo or table engine; defaults to numpy.
+    --compare-tempnw=<fname>, --compare-tempns=<fname>, --compare-precnw=<fname>, --compare-precns=<fname>
+                                  : Take a second scenario of the same map from these four images, classify both
+                                    scenarios in one pass and output a change map instead of a climate map: pixels
+                                    whose class is the same in both are grey, and the others have the color of their
+                                    class in the second scenario. Allows one mode only, and requires the numpy, memo or
+                                    table engine; defaults to numpy.
+    --transitions=<fname>         : When comparing scenarios, write the number of pixels going from each class to
+                                    each other class to '<fname>', as CSV if its name ends in .csv and otherwise as
+                                    JSON. Defaults to the output file name with the extension .transitions.json.
+    --validate                    : Check the inputs against the input profiles instead of classifying them, reporting
+                                    every color that matches neither (with its pixel count, bounding box and first
+                                    pixels) and whether the inputs differ in size, as JSON. Requires NumPy.
+    --report=<fname>              : Write the validation report to '<fname>' ('-' for standard output, the default
+                                    with --validate). Without --validate, the inputs are checked before classifying.
+    --highlight=<fname>           : Write an image of the pixels reported by validation (white) to '<fname>'. Without
+                                    --validate, the inputs are checked before classifying.
+    --mask=<fname>                : Ignore (as ocean) the pixels that are nonzero in the image or .npy file '<fname>', in
+                                    inputs that are value rasters (16-bit or floating-point greyscale images or .npy arrays
+                                    of temperatures and precipitations rather than colors). ''')
     sys.exit(0)
 
 def version():
@@ -209,13 +290,13 @@ def getSeasonalPattern(tType, tempTuple):
     else:
         return 'x'
 
-# Given an input pixel from each input map, returns an output color value
-# corresponding to its climate class according to the output profile's color mapping.
-def getClimateColor(pxTuple, tempProfile, precProfile, outProfile, isNorthernHemis):
+# Given an input pixel from each input map, returns its Köppen-Geiger climate class,
+# or None if the pixel is ignored (e.g. ocean) in any input.
+def getClimateClass(pxTuple, tempProfile, precProfile, isNorthernHemis):
     # pxTuple contains a tuple of four pixels, for (temp1, temp2, precip1, precip2).
     # If this pixel in any input has the ocean color we treat this pixel as ocean and ignore it.
     if pixelTupleIsIgnored(pxTuple, tempProfile, precProfile):
-        return outProfile.ignoredColor
+        return None
     else:
         tempTuple, precTuple = convertPixelData(pxTuple, tempProfile, precProfile, isNorthernHemis)
         #Temptuple is (avg. for summer, avg. for winter)
@@ -242,11 +323,18 @@ def getClimateColor(pxTuple, tempProfile, precProfile, outProfile, isNorthernHem
         climateCode = tType + pType
         if (stType != 'x'):
             climateCode = climateCode + stType
-        if (climateCode in outProfile.colorTable):
-            return outProfile.colorTable[climateCode]
-        else:
-            raise SKCCError('Invalid Köppen-Geiger climate class (should never happen): ' + climateCode)
+        return climateCode
 
+# Given an input pixel from each input map, returns an output color value
+# corresponding to its climate class according to the output profile's color mapping.
+def getClimateColor(pxTuple, tempProfile, precProfile, outProfile, isNorthernHemis):
+    climateCode = getClimateClass(pxTuple, tempProfile, precProfile, isNorthernHemis)
+    if (climateCode is None):
+        return outProfile.ignoredColor
+    elif (climateCode in outProfile.colorTable):
+        return outProfile.colorTable[climateCode]
+    else:
+        raise SKCCError('Invalid Köppen-Geiger climate class (should never happen): ' + climateCode)
 
 # Bounds a temperature to make a biotemperature, to 30 degrees C ceiling or 0 degrees C floor.
 def boundTemperature(temp):
@@ -268,107 +356,120 @@ def getBiotemperature(tempTuple):
     tempTotal += boundTemperature(tempTuple[1])
     return tempTotal / 12
 
-# Looks up a life zone category and gets the color given a biotemperature and
-# annual precipitation estimate.
+# Looks up a life zone category given a biotemperature and annual precipitation estimate.
 # 17 degrees C is used as the 'critical temperature line' delineating the
 # definition of subtropical vs. warm temperate.
-def lookupLifeZoneColor(bioTemp, precTotal, outProfile):
+def lookupLifeZone(bioTemp, precTotal):
     if (bioTemp <= 0):
-        return outProfile.colorTable['Ice']
+        return 'Ice'
     elif (bioTemp < 1.5):
-        return outProfile.colorTable['Polar desert']
+        return 'Polar desert'
     elif (bioTemp < 3):
         if (precTotal < 125):
-            return outProfile.colorTable['Subpolar dry tundra']
+            return 'Subpolar dry tundra'
         elif (precTotal < 250):
-            return outProfile.colorTable['Subpolar moist tundra']
+            return 'Subpolar moist tundra'
         elif (precTotal < 500):
-            return outProfile.colorTable['Subpolar wet tundra']
+            return 'Subpolar wet tundra'
         else:
-            return outProfile.colorTable['Subpolar rain tundra']
+            return 'Subpolar rain tundra'
     elif (bioTemp < 6):
         if (precTotal < 125):
-            return outProfile.colorTable['Boreal desert']
+            return 'Boreal desert'
         elif (precTotal < 250):
-            return outProfile.colorTable['Boreal dry scrub']
+            return 'Boreal dry scrub'
         elif (precTotal < 500):
-            return outProfile.colorTable['Boreal moist forest']
+            return 'Boreal moist forest'
         elif (precTotal < 1000):
-            return outProfile.colorTable['Boreal wet forest']
+            return 'Boreal wet forest'
         else:
-            return outProfile.colorTable['Boreal rain forest']
+            return 'Boreal rain forest'
     elif (bioTemp < 12):
         if (precTotal < 125):
-            return outProfile.colorTable['Cool temperate desert']
+            return 'Cool temperate desert'
         elif (precTotal < 250):
-            return outProfile.colorTable['Cool temperate desert scrub']
+            return 'Cool temperate desert scrub'
         elif (precTotal < 500):
-            return outProfile.colorTable['Cool temperate steppe']
+            return 'Cool temperate steppe'
         elif (precTotal < 1000):
-            return outProfile.colorTable['Cool temperate moist forest']
+            return 'Cool temperate moist forest'
         elif (precTotal < 2000):
-            return outProfile.colorTable['Cool temperate wet forest']
+            return 'Cool temperate wet forest'
         else:
-            return outProfile.colorTable['Cool temperate rain forest']
+            return 'Cool temperate rain forest'
     elif (bioTemp < 17):
         if (precTotal < 125):
-            return outProfile.colorTable['Warm temperate desert']
+            return 'Warm temperate desert'
         elif (precTotal < 250):
-            return outProfile.colorTable['Warm temperate desert scrub']
+            return 'Warm temperate desert scrub'
         elif (precTotal < 500):
-            return outProfile.colorTable['Warm temperate thorn scrub']
+            return 'Warm temperate thorn scrub'
         elif (precTotal < 1000):
-            return outProfile.colorTable['Warm temperate dry forest']
+            return 'Warm temperate dry forest'
         elif (precTotal < 2000):
-            return outProfile.colorTable['Warm temperate moist forest']
+            return 'Warm temperate moist forest'
         elif (precTotal < 4000):
-            return outProfile.colorTable['Warm temperate wet forest']
+            return 'Warm temperate wet forest'
         else:
-            return outProfile.colorTable['Warm temperate rain forest']
+            return 'Warm temperate rain forest'
     elif (bioTemp < 24):
         if (precTotal < 125):
-            return outProfile.colorTable['Subtropical desert']
+            return 'Subtropical desert'
         elif (precTotal < 250):
-            return outProfile.colorTable['Subtropical desert scrub']
+            return 'Subtropical desert scrub'
         elif (precTotal < 500):
-            return outProfile.colorTable['Subtropical thorn woodland']
+            return 'Subtropical thorn woodland'
         elif (precTotal < 1000):
-            return outProfile.colorTable['Subtropical dry forest']
+            return 'Subtropical dry forest'
         elif (precTotal < 2000):
-            return outProfile.colorTable['Subtropical moist forest']
+            return 'Subtropical moist forest'
         elif (precTotal < 4000):
-            return outProfile.colorTable['Subtropical wet forest']
+            return 'Subtropical wet forest'
         else:
-            return outProfile.colorTable['Subtropical rain forest']
+            return 'Subtropical rain forest'
     else:
         if (precTotal < 125):
-            return outProfile.colorTable['Tropical desert']
+            return 'Tropical desert'
         elif (precTotal < 250):
-            return outProfile.colorTable['Tropical desert scrub']
+            return 'Tropical desert scrub'
         elif (precTotal < 500):
-            return outProfile.colorTable['Tropical thorn woodland']
+            return 'Tropical thorn woodland'
         elif (precTotal < 1000):
-            return outProfile.colorTable['Tropical very dry forest']
+            return 'Tropical very dry forest'
         elif (precTotal < 2000):
-            return outProfile.colorTable['Tropical dry forest']
+            return 'Tropical dry forest'
         elif (precTotal < 4000):
-            return outProfile.colorTable['Tropical moist forest']
+            return 'Tropical moist forest'
         elif (precTotal < 8000):
-            return outProfile.colorTable['Tropical wet forest']
+            return 'Tropical wet forest'
         else:
-            return outProfile.colorTable['Tropical rain forest']
+            return 'Tropical rain forest'
 
-# Given an input pixel from each input map, returns an output color value
-# corresponding to its Holdridge life zone category according to the output profile's color mapping.
-def getLifeZoneColor(pxTuple, tempProfile, precProfile, outProfile):
+# Looks up a life zone category and gets the color given a biotemperature and
+# annual precipitation estimate.
+def lookupLifeZoneColor(bioTemp, precTotal, outProfile):
+    return outProfile.colorTable[lookupLifeZone(bioTemp, precTotal)]
+
+# Given an input pixel from each input map, returns its Holdridge life zone category,
+# or None if the pixel is ignored (e.g. ocean) in any input.
+def getLifeZone(pxTuple, tempProfile, precProfile):
     if pixelTupleIsIgnored(pxTuple, tempProfile, precProfile):
-        return outProfile.ignoredColor
+        return None
     else:
         tempTuple = (getTemperatureCategory(pxTuple[0], tempProfile), getTemperatureCategory(pxTuple[1], tempProfile))
         precTuple = (getPrecipCategory(pxTuple[2], precProfile), getPrecipCategory(pxTuple[3], precProfile))
         biotemp = getBiotemperature(tempTuple)
         precTotal = ((precTuple[0]*6)+(precTuple[1]*6))
-        return lookupLifeZoneColor(biotemp, precTotal, outProfile)
+        return lookupLifeZone(biotemp, precTotal)
+
+# Given an input pixel from each input map, returns an output color value
+# corresponding to its Holdridge life zone category according to the output profile's color mapping.
+def getLifeZoneColor(pxTuple, tempProfile, precProfile, outProfile):
+    lifeZone = getLifeZone(pxTuple, tempProfile, precProfile)
+    if (lifeZone is None):
+        return outProfile.ignoredColor
+    else:
+        return outProfile.colorTable[lifeZone]
 
 # Returns a function to retrieve the RGB color values of a pixel.
 def makeRGBConversion(img1, img2, img3, img4):
@@ -399,27 +500,848 @@ def makeRGBConversion(img1, img2, img3, img4):
 
 # Builds a raw image representing the classification corresponding to the selected mode 
 # based on the input temperature and precipitation maps interpreted via the input temperature
-# and precipitation color profiles.
-def buildOutput(t1name, t2name, p1name, p2name, tempProfile, precProfile, outProfile, mode='koppen'):
-    temperature1 = Image.open(t1name)
-    temperature2 = Image.open(t2name)
-    precipitation1 = Image.open(p1name)
-    precipitation2 = Image.open(p2name)
-    temps1 = temperature1.getdata()
-    temps2 = temperature2.getdata()
-    precs1 = precipitation1.getdata()
-    precs2 = precipitation2.getdata()
-    rawData = zip(temps1, temps2, precs1, precs2)
-    getRGBs = makeRGBConversion(temperature1, temperature2, precipitation1, precipitation2)
+# and precipitation color profiles. The input maps can be file names, PIL images or RGB arrays.
+# A decision table compiled from the same input profiles and mode can be passed to the 'table'
+# engine to reuse it across maps; otherwise one is compiled for this map.
+# The array-based engines can process the map in strips of stripHeight rows to bound memory use,
+# and can split the map across jobs worker processes.
+# If a StageProfiler is passed as profiler, the time spent in each stage is recorded in it, and if a
+# ClassStatistics is passed as statistics, the array-based engines count the pixels of each class in it.
+def buildOutput(t1name, t2name, p1name, p2name, tempProfile, precProfile, outProfile, mode='koppen', engine='scalar', decisionTable=None, stripHeight=None, jobs=1, profiler=None, statistics=None):
+    return buildOutputs(t1name, t2name, p1name, p2name, tempProfile, precProfile, [outProfile], [mode], engine, [decisionTable], stripHeight, jobs, profiler, statistics)[0]
+
+# Classifies the input images in several modes in one pass, returning one output image per mode
+# (each mode with the output profile at the same position in outProfiles). The inputs are decoded
+# once for all the modes, and with the numpy engine also looked up through the input profiles once.
+# decisionTables, if given, holds a decision table (or None) per mode for the table engine.
+def buildOutputs(t1name, t2name, p1name, p2name, tempProfile, precProfile, outProfiles, modes, engine='scalar', decisionTables=None, stripHeight=None, jobs=1, profiler=None, statistics=None):
+    if (len(outProfiles) != len(modes)):
+        raise SKCCError('Each mode requires an output profile.')
+    if (decisionTables is None):
+        decisionTables = [None] * len(modes)
+    if (engine != 'scalar'):
+        return buildOutputArrays(t1name, t2name, p1name, p2name, tempProfile, precProfile, outProfiles, modes, engine, decisionTables, stripHeight, jobs, profiler, statistics)
+    elif not (statistics is None):
+        raise SKCCError('Class statistics require one of the array-based engines.')
+    elif not (stripHeight is None):
+        raise SKCCError('Processing in strips requires one of the array-based engines.')
+    elif (jobs != 1):
+        raise SKCCError('Parallel processing requires one of the array-based engines.')
+    timed = not (profiler is None)
+    if not timed:
+        profiler = StageProfiler()
+    with profiler.stage('decode'):
+        images = openInputImages(t1name, t2name, p1name, p2name)
+        if any(isValueRaster(img) for img in images):
+            raise SKCCError('Value raster inputs require one of the array-based engines.')
+        # The per-pixel classifier reads RGB pixels through PIL, so input arrays are converted to
+        # images and indexed-color images to RGB
+        images = [img if isinstance(img, Image.Image) else Image.fromarray(np.ascontiguousarray(img)) for img in images]
+        temperature1, temperature2, precipitation1, precipitation2 = [img.convert('RGB') if (img.mode == 'P') else img for img in images]
+        temps1 = temperature1.getdata()
+        temps2 = temperature2.getdata()
+        precs1 = precipitation1.getdata()
+        precs2 = precipitation2.getdata()
+    profiler.addPixels(len(temps1))
+    with profiler.stage('rgbConversion'):
+        getRGBs = makeRGBConversion(temperature1, temperature2, precipitation1, precipitation2)
+        rgbData = map(getRGBs, zip(temps1, temps2, precs1, precs2))
+        if (len(modes) > 1):
+            # Keep the converted pixels for the other modes
+            rgbData = list(rgbData)
+    if (len(modes) == 1) and timed:
+        # Otherwise the pixels are converted as they are classified, with the conversion timed on its own
+        rgbData = profiler.timeItems('rgbConversion', rgbData)
+    outputImgs = []
+    for mode, outProfile in zip(modes, outProfiles):
+        # The per-pixel classifiers look up the input profiles as they go
+        with profiler.stage('classify'):
+            if (mode == 'koppen'):
+                newPix = [getClimateColor(pxTuple, tempProfile, precProfile, outProfile, idx < (len(temps1) / 2))
+                          for idx, pxTuple in enumerate(rgbData)]
+            elif (mode == 'holdridge'):
+                newPix = [getLifeZoneColor(pxTuple, tempProfile, precProfile, outProfile)
+                          for idx, pxTuple in enumerate(rgbData)]
+        with profiler.stage('putdata'):
+            outputImg = Image.new('RGB', (temperature1.size[0], temperature1.size[1]))
+            outputImg.putdata(newPix)
+        outputImgs.append(outputImg)
+    return outputImgs
+
+# Raises an error if NumPy (needed by the array-based engines) is not installed.
+def requireNumpy(engine):
+    requireNumpyFor('The ' + engine + ' engine')
+
+# Raises an error if NumPy is not installed, naming what needs it.
+def requireNumpyFor(feature):
+    if np is None:
+        raise SKCCError(feature + ' requires NumPy to be installed (see https://numpy.org).')
+
+# Returns the class names for a mode, in the class-id order used by the array-based engines.
+def getClassNames(mode):
+    if (mode == 'koppen'):
+        return koppenClasses
+    elif (mode == 'holdridge'):
+        return holdridgeClasses
+
+# Returns an input map given as an image file name, a PIL image, a (height, width, 3) RGB
+# (or (height, width, 4) RGBA) uint8 array, or a value raster. Arrays are used as they are and
+# NumPy (.npy) files are memory-mapped, so their pixels are read from disk only as they are
+# classified and need no decoding; other files are opened as PIL images.
+# Value rasters hold temperatures or precipitations directly rather than colors, as (height, width)
+# arrays of numbers (or 16-bit or floating-point greyscale images); NaN or masked values are ignored.
+def openInputImage(source):
+    if isinstance(source, (str, bytes, os.PathLike)):
+        if os.fsdecode(source).lower().endswith('.npy'):
+            requireNumpyFor('Reading .npy input files')
+            return openInputArrayFile(source)
+        source = Image.open(source)
+    if isinstance(source, Image.Image):
+        if (source.mode in valueImageModes) and not (np is None):
+            return np.asarray(source)
+        return source
+    elif not (np is None) and isinstance(source, IndexedRaster):
+        return source
+    elif hasattr(source, '__array_interface__'):
+        requireNumpyFor('Array input')
+        source = np.asanyarray(source)
+        checkInputArray(source)
+        return source
+    else:
+        raise SKCCError('Invalid input map: ' + repr(source))
+
+# Returns the input maps with the value rasters among them masked by a mask (a file name, image or
+# array the size of the maps, whose nonzero pixels are ignored). Maps of colors are returned as given.
+def maskValueRasters(inputMaps, maskSource):
+    requireNumpyFor('Masking input maps')
+    if isinstance(maskSource, (str, bytes, os.PathLike)):
+        if os.fsdecode(maskSource).lower().endswith('.npy'):
+            mask = openArrayFile(maskSource)
+        else:
+            mask = np.asarray(Image.open(maskSource))
+    else:
+        mask = np.asarray(maskSource)
+    if (mask.ndim == 3):
+        mask = mask.any(axis=2)
+    images = [openInputImage(source) for source in inputMaps]
+    if not any(isValueRaster(img) for img in images):
+        raise SKCCError('A mask can only be used with value raster inputs.')
+    if (mask.shape != (getInputSize(images[0])[1], getInputSize(images[0])[0])):
+        raise SKCCError('Mask does not have the same dimensions as the input maps.')
+    mask = mask != 0
+    return [np.ma.masked_array(img, mask=(np.ma.getmaskarray(img) | mask)) if isValueRaster(img) else source for source, img in zip(inputMaps, images)]
+
+# Returns True if an input map opened by openInputImage is a value raster rather than a map of colors.
+def isValueRaster(img):
+    return not isinstance(img, Image.Image) and isValueArray(img)
+
+# Returns the (width, height) of an input map opened by openInputImage.
+def getInputSize(img):
+    if isinstance(img, Image.Image):
+        return img.size
+    return (img.shape[1], img.shape[0])
+
+# Opens the four input maps (file names, PIL images or arrays), checking they all have the same dimensions.
+def openInputImages(t1name, t2name, p1name, p2name):
+    images = [openInputImage(source) for source in (t1name, t2name, p1name, p2name)]
+    if any(getInputSize(img) != getInputSize(images[0]) for img in images[1:]):
+        raise SKCCError('Input images do not all have the same dimensions.')
+    return images
+
+# Decodes the rows [rowStart, rowEnd) of each input map into RGB arrays. Rows of input arrays
+# (including memory-mapped ones) are returned as views, without copying. Indexed-color (mode 'P')
+# images are kept as their palette indices (see IndexedRaster), a third of the size of RGB arrays.
+def readInputStrip(images, rowStart, rowEnd):
+    width, height = getInputSize(images[0])
+    rgbArrays = []
+    for img in images:
+        if not isinstance(img, Image.Image):
+            rgbArrays.append(img[rowStart:rowEnd] if isValueArray(img) else img[rowStart:rowEnd, :, 0:3])
+            continue
+        if not ((rowStart == 0) and (rowEnd == height)):
+            img = img.crop((0, rowStart, width, rowEnd))
+        if (img.mode == 'P'):
+            rgbArrays.append(getIndexedRaster(img))
+        else:
+            rgbArrays.append(getRGBArray(img))
+    return rgbArrays
+
+# Writes the four input maps (file names, PIL images or arrays) to a stack file, as read by
+# openInputStack: a single .npy file that later runs can memory-map instead of decoding images.
+# The maps must be all maps of colors or all value rasters (stored as float32, with NaN for ignored pixels).
+# The maps are decoded and written stripHeight rows at a time, to limit memory use.
+def writeInputStack(fname, t1name, t2name, p1name, p2name, stripHeight=1024):
+    requireNumpyFor('Writing stack files')
+    images = openInputImages(t1name, t2name, p1name, p2name)
+    width, height = getInputSize(images[0])
+    valueLayers = [isValueRaster(img) for img in images]
+    if any(valueLayers) and not all(valueLayers):
+        raise SKCCError('A stack file must hold either four maps of colors or four value rasters.')
+    try:
+        if all(valueLayers):
+            stack = np.lib.format.open_memmap(fname, mode='w+', dtype=np.float32, shape=(4, height, width))
+        else:
+            stack = np.lib.format.open_memmap(fname, mode='w+', dtype=np.uint8, shape=(4, height, width, 3))
+    except OSError:
+        raise SKCCError('Could not write to file ' + fname)
+    try:
+        for rowStart in range(0, height, stripHeight):
+            rowEnd = min(rowStart + stripHeight, height)
+            for idx, rgbArray in enumerate(readInputStrip(images, rowStart, rowEnd)):
+                stack[idx, rowStart:rowEnd] = getValueArray(rgbArray)[0] if valueLayers[idx] else rgbArray
+        stack.flush()
+    finally:
+        del stack
+
+# Looks up the four input RGB arrays through the input profiles. Returns the
+# (temp1, temp2, prec1, prec2) value arrays and a mask of pixels ignored in any input.
+# Inputs that are value rasters are used as they are, with NaN or masked values ignored.
+def lookupInputValues(rgbArrays, tempProfile, precProfile):
+    values = []
+    ignored = None
+    unknownMasks = []
+    for rgbArray, profile in zip(rgbArrays, (tempProfile, tempProfile, precProfile, precProfile)):
+        if isValueArray(rgbArray):
+            layerValues, layerIgnored = getValueArray(rgbArray)
+            layerValues[layerIgnored] = 0.0
+            layerUnknown = np.zeros(layerIgnored.shape, dtype=bool)
+        else:
+            layerValues, layerIgnored, layerUnknown = profile.compile().lookup(rgbArray)
+        values.append(layerValues)
+        ignored = layerIgnored if (ignored is None) else (ignored | layerIgnored)
+        unknownMasks.append(layerUnknown)
+    checkUnknownColors(rgbArrays, unknownMasks, ignored)
+    return tuple(values), ignored
+
+# Looks up the four input RGB arrays (none of them value rasters) through the input profiles. Returns
+# the arrays of compiled profile entry indices of the (temp1, temp2, prec1, prec2) inputs and a mask of
+# pixels ignored in any input.
+def lookupInputIndices(rgbArrays, tempProfile, precProfile):
+    indices = []
+    ignored = None
+    unknownFound = False
+    for rgbArray, profile in zip(rgbArrays, (tempProfile, tempProfile, precProfile, precProfile)):
+        compiled = profile.compile()
+        layerIndices = compiled.lookupIndices(rgbArray)
+        indices.append(layerIndices)
+        layerIgnored = compiled.ignored[layerIndices]
+        ignored = layerIgnored if (ignored is None) else (ignored | layerIgnored)
+        # Only colors matching nothing in the profile can be unknown
+        unknownFound = unknownFound or (compiled.unknown[-1] and (layerIndices == compiled.missIndex).any())
+    if unknownFound:
+        checkUnknownColors(rgbArrays, [profile.compile().unknown[layerIndices] for layerIndices, profile in
+                                       zip(indices, (tempProfile, tempProfile, precProfile, precProfile))], ignored)
+    return tuple(indices), ignored
+
+# Classifies the arrays of compiled profile entry indices of the four inputs (from lookupInputIndices)
+# with the array classifier for the mode. Returns the class-id array and the class names the ids refer to.
+def classifyInputIndices(indices, ignored, mode, tempProfile, precProfile, isNorthernHemis=None):
+    tempValues = tempProfile.compile().values
+    precValues = precProfile.compile().values
+    if (mode == 'holdridge'):
+        return classifyHoldridgeEntries(indices[0], indices[1], indices[2], indices[3], tempValues, precValues, ignored), holdridgeClasses
+    values = (tempValues[indices[0]], tempValues[indices[1]], precValues[indices[2]], precValues[indices[3]])
+    return classifyInputValues(values, ignored, mode, isNorthernHemis)
+
+# Checks the four input maps (file names, PIL images or arrays) against the input profiles without
+# classifying them, looking up all four a strip of stripHeight rows at a time. Returns a report (a
+# dictionary that can be written as JSON) listing, for each input, every color that matched neither
+# its profile nor its ignored colors, with the number of pixels, bounding box and first pixel
+# coordinates of each, and whether the inputs differ in size. As when classifying, pixels ignored
+# in another input are not reported, unless the inputs differ in size, when each is checked alone.
+# If highlight is True, also returns a boolean mask of the reported pixels (None if the sizes differ).
+def validateInputs(t1name, t2name, p1name, p2name, tempProfile, precProfile, stripHeight=None, highlight=False):
+    requireNumpyFor('Validating input maps')
+    sources = (t1name, t2name, p1name, p2name)
+    profiles = (tempProfile, tempProfile, precProfile, precProfile)
+    images = [openInputImage(source) for source in sources]
+    sizes = [getInputSize(img) for img in images]
+    sameSize = all(size == sizes[0] for size in sizes[1:])
+    found = [{} for img in images]
+    highlightMask = None
+    if highlight and sameSize:
+        highlightMask = np.zeros((sizes[0][1], sizes[0][0]), dtype=bool)
+
+    # Looks up a strip of some of the inputs, returning their unknown and ignored pixel masks
+    def lookupStrip(layerIds, rowStart, rowEnd):
+        rgbArrays = readInputStrip([images[idx] for idx in layerIds], rowStart, rowEnd)
+        unknownMasks = []
+        ignored = None
+        for idx, rgbArray in zip(layerIds, rgbArrays):
+            if isValueArray(rgbArray):
+                layerIgnored = getValueArray(rgbArray)[1]
+                layerUnknown = np.zeros(layerIgnored.shape, dtype=bool)
+            else:
+                layerIgnored, layerUnknown = profiles[idx].compile().lookup(rgbArray)[1:]
+            unknownMasks.append(layerUnknown)
+            ignored = layerIgnored if (ignored is None) else (ignored | layerIgnored)
+        return rgbArrays, unknownMasks, ignored
+
+    if sameSize:
+        layerGroups = [[0, 1, 2, 3]]
+    else:
+        layerGroups = [[0], [1], [2], [3]]
+    for layerIds in layerGroups:
+        height = sizes[layerIds[0]][1]
+        rows = height if (stripHeight is None) else stripHeight
+        for rowStart in range(0, height, rows):
+            rowEnd = min(rowStart + rows, height)
+            rgbArrays, unknownMasks, ignored = lookupStrip(layerIds, rowStart, rowEnd)
+            for idx, rgbArray, unknown in zip(layerIds, rgbArrays, unknownMasks):
+                badPixels = unknown & ~ignored
+                addBadPixels(found[idx], rgbArray, badPixels, rowStart, maxReportedPixels)
+                if not (highlightMask is None):
+                    highlightMask[rowStart:rowEnd] |= badPixels
+
+    report = {'valid': True, 'errors': [], 'sameSize': sameSize, 'inputs': []}
+    badPixelCount = 0
+    badColorCount = 0
+    for name, source, size, layerFound in zip(inputMapNames, sources, sizes, found):
+        layerReport = {'name': name}
+        if isinstance(source, (str, bytes, os.PathLike)):
+            layerReport['file'] = os.fsdecode(source)
+        layerReport['size'] = list(size)
+        layerReport['unknownColors'] = []
+        for color, entry in sorted(layerFound.items(), key=lambda item: (-item[1]['count'], item[0])):
+            colorReport = {'color': list(unpackRGB(color))}
+            colorReport.update(entry)
+            layerReport['unknownColors'].append(colorReport)
+            badPixelCount += entry['count']
+        badColorCount += len(layerFound)
+        report['inputs'].append(layerReport)
+    if not sameSize:
+        report['errors'].append('Input images do not all have the same dimensions: ' + ', '.join(name + ' ' + str(size[0]) + 'x' + str(size[1]) for name, size in zip(inputMapNames, sizes)))
+    if badColorCount:
+        report['errors'].append(str(badColorCount) + ' color' + ('' if (badColorCount == 1) else 's') + ' did not match the input profiles, in ' +
+                                str(badPixelCount) + ' pixel' + ('' if (badPixelCount == 1) else 's'))
+    report['valid'] = not report['errors']
+    if highlight:
+        return report, highlightMask
+    return report
+
+# Writes a validation report as JSON to the file fname ('-' for standard output).
+def writeValidationReport(fname, report):
+    text = json.dumps(report, indent=2)
+    if (fname == '-'):
+        print(text)
+        return
+    try:
+        fp = open(fname, 'w')
+    except OSError:
+        raise SKCCError('Could not write to file ' + fname)
+    try:
+        fp.write(text + '\n')
+    finally:
+        fp.close()
+
+# Validates the four input maps as validateInputs does, writing the report to reportFileName and an
+# image that is white at the pixels reported (and black elsewhere) to highlightFileName, if given.
+# Raises an error summing up the problems found if the inputs are not valid.
+def runValidation(inputMaps, tempProfile, precProfile, reportFileName='', highlightFileName='', stripHeight=None):
+    report, highlightMask = validateInputs(inputMaps[0], inputMaps[1], inputMaps[2], inputMaps[3], tempProfile, precProfile, stripHeight, True)
+    if reportFileName:
+        writeValidationReport(reportFileName, report)
+    if highlightFileName and not (highlightMask is None):
+        outputToFile(highlightFileName, Image.fromarray(highlightMask.astype(np.uint8) * 255, 'L'))
+    if not report['valid']:
+        raise SKCCError('Input data did not pass validation: ' + '; '.join(report['errors']) + '.')
+    return report
+
+# Classifies the (temp1, temp2, prec1, prec2) value arrays with the array classifier for the mode.
+# isNorthernHemis is a mask of northern-hemisphere pixels, by default that for the arrays being the whole map.
+# Returns the class-id array and the class names the ids refer to.
+def classifyInputValues(values, ignored, mode, isNorthernHemis=None):
+    temp1, temp2, prec1, prec2 = values
     if (mode == 'koppen'):
-        newPix = [getClimateColor(getRGBs(pxTuple), tempProfile, precProfile, outProfile, idx < (len(temps1) / 2)) 
-                  for idx, pxTuple in enumerate(rawData)]
+        if isNorthernHemis is None:
+            isNorthernHemis = getNorthernMask(ignored.shape[0], ignored.shape[1])
+        tempS = np.where(isNorthernHemis, temp1, temp2)
+        tempW = np.where(isNorthernHemis, temp2, temp1)
+        precS = np.where(isNorthernHemis, prec1, prec2)
+        precW = np.where(isNorthernHemis, prec2, prec1)
+        return classifyKoppen(tempS, tempW, precS, precW, ignored), koppenClasses
     elif (mode == 'holdridge'):
-        newPix = [getLifeZoneColor(getRGBs(pxTuple), tempProfile, precProfile, outProfile)
-                  for idx, pxTuple in enumerate(rawData)]
-    outputImg = Image.new('RGB', (temperature1.size[0], temperature1.size[1]))
-    outputImg.putdata(newPix)
-    return outputImg
+        return classifyHoldridge(temp1, temp2, prec1, prec2, ignored), holdridgeClasses
+
+# Classifies the four input RGB arrays by finding each unique combination of input colors
+# (and hemisphere, in Köppen mode), classifying each combination once with the per-pixel
+# classifier functions, and scattering the results back over the map.
+# isNorthernHemis is a mask of northern-hemisphere pixels, by default that for the arrays being the whole map.
+# Returns the class-id array and the class names the ids refer to.
+def classifyUniqueCombinations(rgbArrays, tempProfile, precProfile, mode, isNorthernHemis=None):
+    height, width = rgbArrays[0].shape[0:2]
+    classNames = getClassNames(mode)
+    classIdLookup = dict((name, idx + 1) for idx, name in enumerate(classNames))
+
+    # Reduce each input to indices of the profile colors it matched. All colors matching
+    # nothing in a profile behave the same, so any one of them can stand in for the rest.
+    entryIndices = []
+    entryColors = []
+    ignored = np.zeros((height, width), dtype=bool)
+    unknownMasks = []
+    for rgbArray, profile in zip(rgbArrays, (tempProfile, tempProfile, precProfile, precProfile)):
+        compiled = profile.compile()
+        indices = compiled.lookupIndices(rgbArray)
+        missed = indices == compiled.missIndex
+        colors = list(compiled.colors)
+        if missed.any():
+            colors.append(tuple(int(c) for c in rgbArray[np.unravel_index(np.argmax(missed), missed.shape)]))
+        else:
+            colors.append(None)
+        entryIndices.append(indices)
+        entryColors.append(colors)
+        ignored |= compiled.ignored[indices]
+        unknownMasks.append(missed & compiled.unknown[-1])
+    checkUnknownColors(rgbArrays, unknownMasks, ignored)
+
+    # Pack each pixel's combination into a single integer key.
+    keys = np.zeros((height, width), dtype=np.int64)
+    keySpace = 1
+    for indices, colors in zip(entryIndices, entryColors):
+        keys = (keys * len(colors)) + indices
+        keySpace *= len(colors)
+    if (mode == 'koppen'):
+        if isNorthernHemis is None:
+            isNorthernHemis = getNorthernMask(height, width)
+        keys = (keys * 2) + isNorthernHemis
+        keySpace *= 2
+    if (keySpace <= (1 << 24)):
+        present = np.zeros(keySpace, dtype=bool)
+        present[keys] = True
+        uniqueKeys = np.flatnonzero(present)
+        inverse = (np.cumsum(present) - 1)[keys]
+    else:
+        uniqueKeys, inverse = np.unique(keys, return_inverse=True)
+
+    comboIds = np.zeros(len(uniqueKeys), dtype=np.uint8)
+    for comboIdx, key in enumerate(uniqueKeys):
+        key = int(key)
+        isNorthernHemis = True
+        if (mode == 'koppen'):
+            key, isNorthernHemis = divmod(key, 2)
+        pxColors = []
+        for colors in reversed(entryColors):
+            key, entryIdx = divmod(key, len(colors))
+            pxColors.insert(0, colors[entryIdx])
+        pxTuple = tuple(pxColors)
+        if (mode == 'koppen'):
+            climate = getClimateClass(pxTuple, tempProfile, precProfile, bool(isNorthernHemis))
+        elif (mode == 'holdridge'):
+            climate = getLifeZone(pxTuple, tempProfile, precProfile)
+        if not (climate is None):
+            comboIds[comboIdx] = classIdLookup[climate]
+    return comboIds[inverse].reshape(height, width), classNames
+
+# Stands in for a decision table when the input profiles have too many color combinations to
+# compile one, classifying each map with the memo engine instead.
+class MemoDecisionTable:
+    def __init__(self, tempProfile, precProfile, mode):
+        self.mode = mode
+        self.classNames = getClassNames(mode)
+        self.tempProfile = tempProfile
+        self.precProfile = precProfile
+
+    def classify(self, rgbArrays, isNorthernHemis=None):
+        return classifyUniqueCombinations(rgbArrays, self.tempProfile, self.precProfile, self.mode, isNorthernHemis)[0]
+
+# Compiles the class of every combination of input profile colors for a mode into a
+# decision table, which can be reused for any maps using the same input profiles.
+# If there are too many combinations, warns and returns a MemoDecisionTable instead.
+def compileDecisionTable(tempProfile, precProfile, mode='koppen'):
+    requireNumpy('table')
+    try:
+        return DecisionTable(tempProfile, precProfile, mode)
+    except DecisionTableTooLargeError:
+        print('Warning: Input profiles have too many colors to compile a ' + mode + ' decision table, so the memo engine is used instead.')
+        return MemoDecisionTable(tempProfile, precProfile, mode)
+
+# Classifies the four input RGB arrays with the given array-based engine.
+# isNorthernHemis is a mask of northern-hemisphere pixels, by default that for the arrays being the whole map.
+# Returns the class-id array and the class names the ids refer to.
+def classifyRGBArrays(rgbArrays, tempProfile, precProfile, mode, engine, decisionTable=None, isNorthernHemis=None):
+    if (engine == 'memo'):
+        return classifyUniqueCombinations(rgbArrays, tempProfile, precProfile, mode, isNorthernHemis)
+    elif (engine == 'table'):
+        return decisionTable.classify(rgbArrays, isNorthernHemis), decisionTable.classNames
+    elif not any(isValueArray(rgbArray) for rgbArray in rgbArrays):
+        indices, ignored = lookupInputIndices(rgbArrays, tempProfile, precProfile)
+        return classifyInputIndices(indices, ignored, mode, tempProfile, precProfile, isNorthernHemis)
+    else:
+        values, ignored = lookupInputValues(rgbArrays, tempProfile, precProfile)
+        return classifyInputValues(values, ignored, mode, isNorthernHemis)
+
+# Classifies the four input RGB arrays in each of several modes with the given array-based engine.
+# With the numpy engine the inputs are looked up through the input profiles once for all the modes.
+# Value rasters have no colors for the memo and table engines to work with, so inputs including
+# any are always classified by the numpy engine.
+# Returns a (class-id array, class names) pair per mode.
+def classifyRGBArraysForModes(rgbArrays, tempProfile, precProfile, modes, engine, decisionTables, isNorthernHemis=None, profiler=None):
+    if profiler is None:
+        profiler = StageProfiler()
+    if (engine == 'numpy') and not any(isValueArray(rgbArray) for rgbArray in rgbArrays):
+        with profiler.stage('lookup'):
+            indices, ignored = lookupInputIndices(rgbArrays, tempProfile, precProfile)
+        with profiler.stage('classify'):
+            return [classifyInputIndices(indices, ignored, mode, tempProfile, precProfile, isNorthernHemis) for mode in modes]
+    elif (engine == 'numpy') or any(isValueArray(rgbArray) for rgbArray in rgbArrays):
+        with profiler.stage('lookup'):
+            values, ignored = lookupInputValues(rgbArrays, tempProfile, precProfile)
+        with profiler.stage('classify'):
+            return [classifyInputValues(values, ignored, mode, isNorthernHemis) for mode in modes]
+    # The memo and table engines look up the input profiles as part of classifying
+    with profiler.stage('classify'):
+        return [classifyRGBArrays(rgbArrays, tempProfile, precProfile, mode, engine, decisionTable, isNorthernHemis)
+                for mode, decisionTable in zip(modes, decisionTables)]
+
+# Returns the decision table to use for each mode: for the table engine, those given (checked
+# against their modes) or newly compiled ones; for other engines, None for each mode.
+def prepareDecisionTables(tempProfile, precProfile, modes, engine, decisionTables, profiler):
+    if (decisionTables is None):
+        decisionTables = [None] * len(modes)
+    if (engine == 'table'):
+        decisionTables = list(decisionTables)
+        for idx, mode in enumerate(modes):
+            if (decisionTables[idx] is None):
+                with profiler.stage('compile'):
+                    decisionTables[idx] = compileDecisionTable(tempProfile, precProfile, mode)
+            elif (decisionTables[idx].mode != mode):
+                raise SKCCError('Decision table was compiled for mode ' + decisionTables[idx].mode + ', not ' + mode)
+    return decisionTables
+
+# Array-based equivalent of buildOutputs: decodes the four input images into arrays and
+# classifies them in each mode with the given array-based engine, returning one image per mode.
+def buildOutputArrays(t1name, t2name, p1name, p2name, tempProfile, precProfile, outProfiles, modes, engine='numpy', decisionTables=None, stripHeight=None, jobs=1, profiler=None, statistics=None):
+    if profiler is None:
+        profiler = StageProfiler()
+    results = buildClassIdMaps(t1name, t2name, p1name, p2name, tempProfile, precProfile, modes, engine, decisionTables, stripHeight, jobs, profiler, statistics)
+    with profiler.stage('putdata'):
+        return [classIdsToImage(classIds, classNames, outProfile) for outProfile, (classIds, classNames) in zip(outProfiles, results)]
+
+# Decodes the four input images into arrays and classifies them in each mode with the given
+# array-based engine, returning a (class-id array, class names) pair per mode.
+# If stripHeight is given, the map is decoded and classified that many rows at a time, keeping
+# intermediate arrays to the size of a strip. If jobs is more than one, bands of rows are
+# classified in that many worker processes. If a ClassStatistics is passed as statistics, the pixels
+# of each class are counted in it as each strip is classified.
+def buildClassIdMaps(t1name, t2name, p1name, p2name, tempProfile, precProfile, modes, engine='numpy', decisionTables=None, stripHeight=None, jobs=1, profiler=None, statistics=None):
+    requireNumpy(engine)
+    if profiler is None:
+        profiler = StageProfiler()
+    decisionTables = prepareDecisionTables(tempProfile, precProfile, modes, engine, decisionTables, profiler)
+    if (jobs < 1):
+        raise SKCCError('Number of jobs must be at least one.')
+    if not (stripHeight is None) and (stripHeight < 1):
+        raise SKCCError('Strip height must be at least one row.')
+    with profiler.stage('decode'):
+        images = openInputImages(t1name, t2name, p1name, p2name)
+    profiler.addPixels(getInputSize(images[0])[0] * getInputSize(images[0])[1])
+    if (jobs > 1):
+        results = buildClassIdMapsParallel(images, tempProfile, precProfile, modes, engine, decisionTables, stripHeight, jobs, profiler)
+        if not (statistics is None):
+            with profiler.stage('statistics'):
+                for mode, (classIds, classNames) in zip(modes, results):
+                    statistics.addClassIds(mode, classIds, classNames)
+        return results
+    width, height = getInputSize(images[0])
+    if (stripHeight is None) or (stripHeight > height):
+        stripHeight = height
+    outputs = [np.zeros((height, width), dtype=np.uint8) for mode in modes]
+    for rowStart in range(0, height, stripHeight):
+        rowEnd = min(rowStart + stripHeight, height)
+        with profiler.stage('decode'):
+            rgbArrays = readInputStrip(images, rowStart, rowEnd)
+        isNorthernHemis = getNorthernMask(rowEnd - rowStart, width, rowStart, height)
+        results = classifyRGBArraysForModes(rgbArrays, tempProfile, precProfile, modes, engine, decisionTables, isNorthernHemis, profiler)
+        for output, (classIds, classNames) in zip(outputs, results):
+            output[rowStart:rowEnd] = classIds
+        if not (statistics is None):
+            with profiler.stage('statistics'):
+                for mode, (classIds, classNames) in zip(modes, results):
+                    statistics.addClassIds(mode, classIds, classNames, rowStart, height)
+    return [(output, getClassNames(mode)) for output, mode in zip(outputs, modes)]
+
+# Classifies four input maps (file names, PIL images or RGB arrays) with an array-based engine,
+# without writing anything to disk. Profiles not given are new copies of the defaults.
+# Returns the (height, width) class-id array, where id 0 marks ignored pixels and id i the class
+# classNames[i-1], and the class names. Profiles and decision tables can be shared between threads.
+def classifyMaps(t1, t2, p1, p2, tempProfile=None, precProfile=None, mode='koppen', engine='numpy', decisionTable=None, profiler=None):
+    if (engine == 'scalar'):
+        raise SKCCError('Classifying into class ids requires one of the array-based engines.')
+    requireNumpy(engine)
+    mode = validateMode(mode)
+    if tempProfile is None:
+        tempProfile = getDefaultInputProfile('temp')
+    if precProfile is None:
+        precProfile = getDefaultInputProfile('prec')
+    if profiler is None:
+        profiler = StageProfiler()
+    decisionTables = prepareDecisionTables(tempProfile, precProfile, [mode], engine, [decisionTable], profiler)
+    with profiler.stage('decode'):
+        images = openInputImages(t1, t2, p1, p2)
+        rgbArrays = readInputStrip(images, 0, getInputSize(images[0])[1])
+    profiler.addPixels(getInputSize(images[0])[0] * getInputSize(images[0])[1])
+    return classifyRGBArraysForModes(rgbArrays, tempProfile, precProfile, [mode], engine, decisionTables, profiler=profiler)[0]
+
+# Returns the image of a class-id array (as returned by classifyMaps) colored by an output profile.
+def classIdsToImage(classIds, classNames, outProfile):
+    return Image.fromarray(colorizeClassIds(classIds, classNames, outProfile), 'RGB')
+
+# Returns a paletted (mode 'P') image of a class-id array, whose palette holds the output profile's
+# color for each class id. Much smaller and faster to encode than the RGB image.
+def classIdsToPalettedImage(classIds, classNames, outProfile):
+    checkClassColors(classIds, classNames, outProfile)
+    img = Image.fromarray(np.ascontiguousarray(classIds, dtype=np.uint8), 'P')
+    img.putpalette(buildClassPalette(classNames, outProfile).ravel().tolist())
+    return img
+
+# Returns the legend of a class-id raster: the class name (None for ignored pixels) and output
+# profile color of each class id, for writing alongside the raster as JSON.
+def getClassLegend(classNames, outProfile, mode):
+    classes = [{'id': 0, 'name': None, 'color': [int(c) for c in outProfile.ignoredColor]}]
+    for idx, name in enumerate(classNames):
+        classes.append({'id': idx + 1, 'name': name, 'color': [int(c) for c in outProfile.colorTable.get(name, outProfile.unknownColor)]})
+    return {'mode': mode, 'version': versionNumber, 'classes': classes}
+
+# Returns the name of the legend file written alongside a class-id raster.
+def getLegendFileName(fname):
+    return os.path.splitext(fname)[0] + '.legend.json'
+
+# Writes a class-id raster to a file, as a NumPy array if the file name ends in .npy or otherwise
+# as a greyscale image (e.g. .tif or .png), along with its legend as JSON.
+def writeClassIdOutput(fname, classIds, classNames, outProfile, mode):
+    if fname.lower().endswith('.npy'):
+        try:
+            np.save(fname, classIds)
+        except OSError:
+            raise SKCCError('Could not write to file ' + fname)
+    else:
+        outputToFile(fname, Image.fromarray(np.ascontiguousarray(classIds, dtype=np.uint8), 'L'))
+    legendName = getLegendFileName(fname)
+    try:
+        fp = open(legendName, 'w')
+    except OSError:
+        raise SKCCError('Could not write to file ' + legendName)
+    try:
+        json.dump(getClassLegend(classNames, outProfile, mode), fp, indent=2)
+    finally:
+        fp.close()
+
+# Writes a classified map in the given output format: 'rgb' (a full color image), 'palette'
+# (a paletted image) or 'classes' (a class-id raster with a JSON legend).
+def writeClassIdMap(fname, classIds, classNames, outProfile, mode, outputFormat='rgb'):
+    if (outputFormat == 'palette'):
+        outputToFile(fname, classIdsToPalettedImage(classIds, classNames, outProfile))
+    elif (outputFormat == 'classes'):
+        writeClassIdOutput(fname, classIds, classNames, outProfile, mode)
+    else:
+        outputToFile(fname, classIdsToImage(classIds, classNames, outProfile))
+
+# Classifies two scenarios of the same map (each four input maps, as taken by buildOutput: file
+# names, PIL images or arrays) in one mode with an array-based engine, sharing the compiled profiles
+# and decision table between them and working through both a strip of stripHeight rows at a time.
+# Returns the class-id arrays of both scenarios, the class names the ids refer to, and the transition
+# matrix: a (K, K) array (for K ids, counting id 0 for ignored pixels) whose entry [i, j] is the
+# number of pixels of class id i in the first scenario and of class id j in the second.
+def compareScenarios(inputs1, inputs2, tempProfile, precProfile, mode='koppen', engine='numpy', decisionTable=None, stripHeight=None, profiler=None):
+    if (engine == 'scalar'):
+        raise SKCCError('Comparing scenarios requires one of the array-based engines.')
+    requireNumpy(engine)
+    if profiler is None:
+        profiler = StageProfiler()
+    decisionTables = prepareDecisionTables(tempProfile, precProfile, [mode], engine, [decisionTable], profiler)
+    if not (stripHeight is None) and (stripHeight < 1):
+        raise SKCCError('Strip height must be at least one row.')
+    with profiler.stage('decode'):
+        images = openInputImages(*inputs1) + openInputImages(*inputs2)
+    if (getInputSize(images[4]) != getInputSize(images[0])):
+        raise SKCCError('The input images of the two scenarios do not have the same dimensions.')
+    width, height = getInputSize(images[0])
+    profiler.addPixels(2 * width * height)
+    if (stripHeight is None) or (stripHeight > height):
+        stripHeight = height
+    classNames = getClassNames(mode)
+    classCount = len(classNames) + 1
+    outputs = [np.zeros((height, width), dtype=np.uint8), np.zeros((height, width), dtype=np.uint8)]
+    transitions = np.zeros((classCount, classCount), dtype=np.int64)
+    for rowStart in range(0, height, stripHeight):
+        rowEnd = min(rowStart + stripHeight, height)
+        isNorthernHemis = getNorthernMask(rowEnd - rowStart, width, rowStart, height)
+        for output, scenarioImages in zip(outputs, (images[:4], images[4:])):
+            with profiler.stage('decode'):
+                rgbArrays = readInputStrip(scenarioImages, rowStart, rowEnd)
+            output[rowStart:rowEnd] = classifyRGBArraysForModes(rgbArrays, tempProfile, precProfile, [mode], engine, decisionTables, isNorthernHemis, profiler)[0][0]
+        with profiler.stage('transitions'):
+            pairs = (outputs[0][rowStart:rowEnd].astype(np.intp) * classCount) + outputs[1][rowStart:rowEnd]
+            transitions += np.bincount(pairs.ravel(), minlength=classCount * classCount).reshape(classCount, classCount)
+    return outputs[0], outputs[1], classNames, transitions
+
+# Returns the change map of two class-id arrays (as returned by compareScenarios): pixels whose class
+# is the same in both are unchangedColor (or the ignored color, if ignored in both), and the others
+# have the output profile color of their class in the second scenario.
+def getChangeMapImage(classIds1, classIds2, classNames, outProfile, unchangedColor=defaultUnchangedColor):
+    checkClassColors(classIds2, classNames, outProfile)
+    palette = np.concatenate((buildClassPalette(classNames, outProfile), np.array([unchangedColor], dtype=np.uint8)))
+    changeIds = np.where((classIds1 == classIds2) & (classIds2 != 0), len(classNames) + 1, classIds2)
+    return Image.fromarray(palette[changeIds], 'RGB')
+
+# Returns a transition matrix (as returned by compareScenarios) as a dictionary suitable for writing
+# out as JSON, with the class names labelling its rows (first scenario) and columns (second scenario).
+def getTransitionReport(transitions, classNames, mode):
+    changed = int(transitions.sum() - np.trace(transitions))
+    return {'mode': mode, 'classes': ['Ignored'] + list(classNames), 'matrix': transitions.tolist(),
+            'pixels': int(transitions.sum()), 'changedPixels': changed, 'unchangedPixels': int(np.trace(transitions))}
+
+# Returns the name of the transition matrix file written alongside a change map by default.
+def getTransitionsFileName(fname):
+    return os.path.splitext(fname)[0] + '.transitions.json'
+
+# Writes a transition matrix to the file fname: as CSV (a row per class of the first scenario and a
+# column per class of the second) if its name ends in .csv, and otherwise as JSON.
+def writeTransitions(fname, transitions, classNames, mode):
+    report = getTransitionReport(transitions, classNames, mode)
+    try:
+        fp = open(fname, 'w', newline='')
+    except OSError:
+        raise SKCCError('Could not write to file ' + fname)
+    try:
+        if fname.lower().endswith('.csv'):
+            writer = csv.writer(fp)
+            writer.writerow(['from\\to'] + report['classes'])
+            for name, row in zip(report['classes'], report['matrix']):
+                writer.writerow([name] + row)
+        else:
+            fp.write(json.dumps(report, indent=2) + '\n')
+    finally:
+        fp.close()
+
+# State for a parallel classification worker process, set up once per process by initParallelWorker.
+parallelWorkerState = {}
+
+# Returns where a C-contiguous array memory-mapped from a .npy file (or a view of one, such as a
+# layer of a stack file) lies in that file's array, as a ('npy', file name, byte offset, dtype, shape)
+# tuple, or None for other arrays.
+def getNpySource(inputArray):
+    if not (isinstance(inputArray, np.memmap) and inputArray.filename and inputArray.flags['C_CONTIGUOUS']):
+        return None
+    fileArray = inputArray
+    while isinstance(fileArray.base, np.memmap):
+        fileArray = fileArray.base
+    if not fileArray.flags['C_CONTIGUOUS']:
+        return None
+    return ('npy', fileArray.filename, inputArray.ctypes.data - fileArray.ctypes.data, inputArray.dtype, inputArray.shape)
+
+# Returns how a parallel classification worker can memory-map an input map (as opened by
+# openInputImage) for itself: .npy files, layers of stack files and cached input layers.
+# Returns None for maps that must be decoded into shared memory for the workers.
+def getParallelInputSource(img):
+    if isinstance(img, IndexedRaster):
+        indicesSource = getNpySource(img.indices)
+        return None if (indicesSource is None) else ('indexed', indicesSource, img.palette)
+    elif isinstance(img, Image.Image):
+        return None
+    return getNpySource(img)
+
+# Decodes an input map into shared memory for the parallel workers, a strip of rows at a time, and
+# returns its ('shared', name, shape, dtype) source. Indexed-color maps share only their palette
+# indices, with the palette sent along in an ('indexed', source, palette) source, and value rasters
+# are shared as floats, with NaN for ignored pixels.
+def shareParallelInput(img, stripHeight, segments, profiler):
+    width, height = getInputSize(img)
+    if isinstance(img, IndexedRaster):
+        shape, dtype = (height, width), img.indices.dtype
+    elif isinstance(img, Image.Image) and (img.mode == 'P'):
+        shape, dtype = (height, width), np.uint8
+    elif isValueRaster(img):
+        shape, dtype = (height, width), np.float64
+    else:
+        shape, dtype = (height, width, 3), np.uint8
+    segment = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+    segments.append(segment)
+    sharedArray = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+    palette = None
+    with profiler.stage('decode'):
+        for rowStart in range(0, height, stripHeight):
+            rowEnd = min(rowStart + stripHeight, height)
+            strip = readInputStrip([img], rowStart, rowEnd)[0]
+            if isinstance(strip, IndexedRaster):
+                sharedArray[rowStart:rowEnd] = strip.indices
+                palette = strip.palette
+            elif (len(shape) == 2):
+                sharedArray[rowStart:rowEnd] = getValueArray(strip)[0]
+            else:
+                sharedArray[rowStart:rowEnd] = strip
+    del sharedArray
+    sharedSource = ('shared', segment.name, shape, dtype)
+    return sharedSource if (palette is None) else ('indexed', sharedSource, palette)
+
+# Opens an input map in a parallel classification worker from its source (see getParallelInputSource
+# and shareParallelInput).
+def openParallelInput(inputSource):
+    if (inputSource[0] == 'npy'):
+        fname, offset, dtype, shape = inputSource[1:]
+        fileBytes = openArrayFile(fname).reshape(-1).view(np.uint8)
+        return fileBytes[offset:offset + (int(np.prod(shape)) * np.dtype(dtype).itemsize)].view(dtype).reshape(shape)
+    elif (inputSource[0] == 'indexed'):
+        return IndexedRaster(openParallelInput(inputSource[1]), inputSource[2])
+    name, shape, dtype = inputSource[1:]
+    segment = shared_memory.SharedMemory(name=name)
+    parallelWorkerState['segments'].append(segment)
+    return np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+
+# Sets up a parallel classification worker: attaches to the shared inputs and outputs (and
+# memory-maps the inputs that are not shared) and keeps the profiles, which are sent to each worker only once.
+def initParallelWorker(inputSources, outputNames, size, tempProfile, precProfile, modes, engine, decisionTables):
+    width, height = size
+    outSegments = [shared_memory.SharedMemory(name=name) for name in outputNames]
+    parallelWorkerState['segments'] = outSegments
+    parallelWorkerState['inputs'] = [openParallelInput(inputSource) for inputSource in inputSources]
+    parallelWorkerState['outputs'] = [np.ndarray((height, width), dtype=np.uint8, buffer=seg.buf) for seg in outSegments]
+    parallelWorkerState['size'] = size
+    parallelWorkerState['settings'] = (tempProfile, precProfile, modes, engine, decisionTables)
+
+# Classifies the rows [rowStart, rowEnd) in a parallel classification worker.
+def classifyParallelBand(band):
+    rowStart, rowEnd = band
+    width, height = parallelWorkerState['size']
+    tempProfile, precProfile, modes, engine, decisionTables = parallelWorkerState['settings']
+    rgbArrays = readInputStrip(parallelWorkerState['inputs'], rowStart, rowEnd)
+    isNorthernHemis = getNorthernMask(rowEnd - rowStart, width, rowStart, height)
+    results = classifyRGBArraysForModes(rgbArrays, tempProfile, precProfile, modes, engine, decisionTables, isNorthernHemis)
+    for output, (classIds, classNames) in zip(parallelWorkerState['outputs'], results):
+        output[rowStart:rowEnd] = classIds
+
+# Classifies the input images in bands of rows across a pool of worker processes. The inputs are
+# decoded once, here, into shared memory (except those memory-mapped from .npy files, which each
+# worker maps for itself), and the class-id outputs live in shared memory too, so only band row
+# ranges are sent per task. The profiler records the time for the whole pool as classification.
+def buildClassIdMapsParallel(images, tempProfile, precProfile, modes, engine, decisionTables, stripHeight, jobs, profiler):
+    width, height = getInputSize(images[0])
+    if (stripHeight is None):
+        # A few bands per worker evens out differences in how long bands take
+        stripHeight = -(-height // (jobs * 4))
+    stripHeight = max(1, min(stripHeight, height))
+    segments = []
+    try:
+        inputSources = []
+        for img in images:
+            inputSource = getParallelInputSource(img)
+            if (inputSource is None):
+                inputSource = shareParallelInput(img, stripHeight, segments, profiler)
+            inputSources.append(inputSource)
+        outSegments = [shared_memory.SharedMemory(create=True, size=max(1, width * height)) for mode in modes]
+        segments.extend(outSegments)
+
+        bands = [(rowStart, min(rowStart + stripHeight, height)) for rowStart in range(0, height, stripHeight)]
+        initArgs = (inputSources, [seg.name for seg in outSegments], (width, height), tempProfile, precProfile, modes, engine, decisionTables)
+        with profiler.stage('classify'):
+            with multiprocessing.Pool(jobs, initializer=initParallelWorker, initargs=initArgs) as pool:
+                pool.map(classifyParallelBand, bands, chunksize=1)
+        outputs = [np.array(np.ndarray((height, width), dtype=np.uint8, buffer=seg.buf)) for seg in outSegments]
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+    return [(output, getClassNames(mode)) for output, mode in zip(outputs, modes)]
 
 # Reads in an output profile and checks that all its keys are valid Koppen classes.
 # Also removes the 'Ocean' color from the color table and makes it the ignored color
@@ -455,19 +1377,368 @@ def readAndValidateHoldridgeOutputProfile(fname):
         profile.colorTable.pop('Ocean', None)
     return profile
 
+# Reads in an output profile for the given mode, checking that its keys are valid for the mode.
+def readAndValidateOutputProfile(fname, mode):
+    if (mode == 'koppen'):
+        return readAndValidateKoppenOutputProfile(fname)
+    elif (mode == 'holdridge'):
+        return readAndValidateHoldridgeOutputProfile(fname)
+
+# Returns the default output profile for the given mode. Each call returns a new profile with its
+# own copy of the default color table, so changing it does not change the defaults.
+def getDefaultOutputProfile(mode):
+    if (mode == 'holdridge'):
+        return OutputProfile(dict(hColorTableDefault), defaultOceanColor, defaultUnknownColor)
+    else:
+        return OutputProfile(dict(kColorTableDefault), defaultOceanColor, defaultUnknownColor)
+
+# Returns the default input profile of the given kind ('temp' or 'prec'). Each call returns a new
+# profile with its own copy of the default color table, so changing it does not change the defaults.
+def getDefaultInputProfile(kind):
+    if (kind == 'prec'):
+        return InputProfile(dict(pColorTableDefault), [defaultOceanColor])
+    else:
+        return InputProfile(dict(tColorTableDefault), [defaultOceanColor])
+
+# Names of the four input maps, in the order they are passed around.
+inputMapNames = ('tempns', 'tempnw', 'precns', 'precnw')
+
+# Largest number of pixel coordinates listed for each unmatched color in a validation report.
+maxReportedPixels = 20
+
+# Changed whenever the form of cached profiles or decision tables changes, so old cache entries are not used.
+cacheFormat = '1'
+
+# Returns a hash identifying the contents of an input profile.
+def getInputProfileHash(profile):
+    return hashParts('inputProfile', repr(sorted(profile.colorTable.items())), repr(sorted(profile.ignoreColors)), repr(profile.defaultValue))
+
+# Compiles an input profile for the array-based engines (if NumPy is installed), taking the
+# compiled form from the disk cache if one is given and it has a profile with the same contents.
+def compileInputProfileCached(profile, cache=None):
+    if (np is None) or not (profile.compiledProfile is None):
+        return profile
+    if cache is None:
+        profile.compile()
+    else:
+        key = hashParts('compiledInputProfile', versionNumber, cacheFormat, getInputProfileHash(profile))
+        profile.compiledProfile = cache.getOrBuild(key, profile.compile)
+    return profile
+
+# Reads in an input profile through the disk cache, if one is given. Cached profiles are keyed
+# by the contents of the file and are stored already compiled for the array-based engines.
+def readInputProfileCached(fname, cache=None):
+    if cache is None:
+        return readInputProfile(fname)
+    key = hashParts('inputProfileFile', versionNumber, cacheFormat, hashFile(fname))
+    return cache.getOrBuild(key, lambda: compileInputProfileCached(readInputProfile(fname)))
+
+# Reads in and validates an output profile for a mode through the disk cache, if one is given.
+def readAndValidateOutputProfileCached(fname, mode, cache=None):
+    if cache is None:
+        return readAndValidateOutputProfile(fname, mode)
+    key = hashParts('outputProfileFile', versionNumber, cacheFormat, mode, hashFile(fname))
+    return cache.getOrBuild(key, lambda: readAndValidateOutputProfile(fname, mode))
+
+# Compiles a decision table through the disk cache, if one is given, keyed by the contents of the input profiles.
+def compileDecisionTableCached(tempProfile, precProfile, mode='koppen', cache=None):
+    if cache is None:
+        return compileDecisionTable(tempProfile, precProfile, mode)
+    key = hashParts('decisionTable', versionNumber, cacheFormat, mode, getInputProfileHash(tempProfile), getInputProfileHash(precProfile))
+    return cache.getOrBuild(key, lambda: compileDecisionTable(tempProfile, precProfile, mode))
+
+# Returns an input image file decoded as an IndexedRaster of indices into the colors of an input
+# profile (followed by any colors in the image that the profile does not have), taking it from the
+# disk cache if the same file has already been decoded for a profile with the same contents. The
+# indices take one byte per pixel (two if there are more than 256 colors), a third of the size of
+# the decoded RGB image, and are memory-mapped when read back. Looking up the layer through the
+# profile then only looks up its palette. Value rasters are returned opened as they are, as are
+# layers too large for the cache (with a warning).
+def readInputLayerCached(fname, profile, cache):
+    key = hashParts('inputLayer', versionNumber, cacheFormat, hashFile(fname), getInputProfileHash(profile))
+    paletteKey = hashParts(key, 'palette')
+    indices = cache.getArray(key)
+    palette = cache.getArray(paletteKey)
+    if not ((indices is None) or (palette is None)):
+        return IndexedRaster(indices, np.array(palette))
+    img = openInputImage(fname)
+    if not isinstance(img, Image.Image):
+        return img
+    rgbArray = readInputStrip([img], 0, getInputSize(img)[1])[0]
+    compiled = profile.compile()
+    indices = compiled.lookupIndices(rgbArray).astype(np.intp)
+    palette = np.array(compiled.colors, dtype=np.uint8).reshape(-1, 3)
+    missed = indices == compiled.missIndex
+    if missed.any():
+        missColors, missIndices = np.unique(packRGB(rgbArray[missed]), return_inverse=True)
+        indices[missed] = len(palette) + missIndices.reshape(-1)
+        missPalette = np.stack([(missColors >> 16) & 255, (missColors >> 8) & 255, missColors & 255], axis=1).astype(np.uint8)
+        palette = np.concatenate([palette, missPalette])
+    if (len(palette) > 65536):
+        return img
+    indices = indices.astype(np.uint8 if (len(palette) <= 256) else np.uint16)
+    if not (cache.putArray(key, indices) and cache.putArray(paletteKey, palette)):
+        print('Warning: Input layer ' + os.fsdecode(fname) + ' is too large for the cache, so was not cached.')
+    return IndexedRaster(indices, palette)
+
+# Returns the four input maps with those given as image file names replaced by their cached
+# layers from readInputLayerCached, so that classifying them skips decoding and most of the lookup.
+# The layers of one call are kept in the cache together, even if they fill it.
+def cacheInputLayers(inputMaps, tempProfile, precProfile, cache):
+    requireNumpyFor('Caching input layers')
+    cachedMaps = []
+    with cache.keepingEntries():
+        for source, profile in zip(inputMaps, (tempProfile, tempProfile, precProfile, precProfile)):
+            if isinstance(source, (str, bytes, os.PathLike)) and not os.fsdecode(source).lower().endswith('.npy'):
+                source = readInputLayerCached(source, profile, cache)
+            cachedMaps.append(source)
+    return cachedMaps
+
+# Incremental rendering keeps a state file next to each output, recording a hash of each tile
+# of the inputs it was built from, so a later render only reclassifies tiles whose inputs changed.
+incrementalStateSuffix = '.skccstate'
+defaultTileSize = 256
+
+# Version of the incremental rendering state files; states of other versions are ignored.
+incrementalStateVersion = 2
+
+# Returns a hash identifying the contents of an output profile.
+def getOutputProfileHash(outProfile):
+    return hashParts('outputProfile', repr(sorted(outProfile.colorTable.items())), repr(outProfile.ignoredColor), repr(outProfile.unknownColor))
+
+# Returns the (rowStart, rowEnd, colStart, colEnd) bounds of each tile of a map, in row-major order.
+def getTiles(width, height, tileSize):
+    return [(rowStart, min(rowStart + tileSize, height), colStart, min(colStart + tileSize, width))
+            for rowStart in range(0, height, tileSize) for colStart in range(0, width, tileSize)]
+
+# Returns a hash of each tile's contents across the four input RGB arrays.
+def getTileHashes(rgbArrays, tiles):
+    tileHashes = []
+    for rowStart, rowEnd, colStart, colEnd in tiles:
+        digest = hashlib.blake2b(digest_size=16)
+        for rgbArray in rgbArrays:
+            tile = rgbArray[rowStart:rowEnd, colStart:colEnd]
+            digest.update(np.ascontiguousarray(np.ma.getdata(tile)).tobytes())
+            if np.ma.isMaskedArray(tile):
+                digest.update(np.ma.getmaskarray(tile).tobytes())
+        tileHashes.append(digest.hexdigest())
+    return tileHashes
+
+# Reads the incremental rendering state for an output file, or returns None if there is none.
+def readIncrementalState(outfileName):
+    try:
+        fp = open(outfileName + incrementalStateSuffix, 'r')
+    except OSError:
+        return None
+    try:
+        return json.load(fp)
+    except ValueError:
+        return None
+    finally:
+        fp.close()
+
+def writeIncrementalState(outfileName, state):
+    try:
+        fp = open(outfileName + incrementalStateSuffix, 'w')
+    except OSError:
+        raise SKCCError('Could not write to file ' + outfileName + incrementalStateSuffix)
+    try:
+        json.dump(state, fp)
+    finally:
+        fp.close()
+
+# Returns the tile hashes recorded in the state of a previous incremental render, or None if the
+# state is missing, of another version, for other settings or otherwise not valid.
+def getStateTileHashes(state, settingsHash, tileCount):
+    if not (isinstance(state, dict) and (state.get('version') == incrementalStateVersion) and (state.get('settings') == settingsHash)):
+        return None
+    tileHashes = state.get('tiles')
+    if not (isinstance(tileHashes, list) and (len(tileHashes) == tileCount) and all(isinstance(tileHash, str) for tileHash in tileHashes)):
+        return None
+    return tileHashes
+
+# Renders the output file for each mode, reclassifying only the tiles whose inputs changed since the
+# output was last rendered this way (or every tile, if the output file, profiles, mode, map size or
+# tile size changed, or it was not rendered this way before). The previous output is patched with the
+# reclassified tiles and written back, along with its state file. Requires an array-based engine, and
+# a lossless output format so the previous output can be read back exactly.
+# The inputs are decoded and hashed a row of tiles at a time. If they are all files whose modification
+# times and sizes match those of the last render, they are taken as unchanged without decoding them.
+# Returns the number of tiles reclassified and the total number of tiles.
+def renderIncremental(t1name, t2name, p1name, p2name, tempProfile, precProfile, outProfiles, modes, outfileNames, engine='numpy', decisionTables=None, tileSize=defaultTileSize, profiler=None):
+    if (engine == 'scalar'):
+        raise SKCCError('Incremental rendering requires one of the array-based engines.')
+    requireNumpy(engine)
+    if (len(outProfiles) != len(modes)) or (len(outfileNames) != len(modes)):
+        raise SKCCError('Each mode requires an output profile and an output file.')
+    if profiler is None:
+        profiler = StageProfiler()
+    decisionTables = prepareDecisionTables(tempProfile, precProfile, modes, engine, decisionTables, profiler)
+    with profiler.stage('decode'):
+        images = openInputImages(t1name, t2name, p1name, p2name)
+    width, height = getInputSize(images[0])
+    tiles = getTiles(width, height, tileSize)
+    inputNames = [t1name, t2name, p1name, p2name]
+    inputsSignature = None
+    if all(isinstance(name, (str, bytes, os.PathLike)) for name in inputNames):
+        inputsSignature = [list(entry) for entry in getFilesSignature(inputNames)]
+
+    # Find the tile hashes of each output that can be patched rather than rendered again
+    settingsHashes = []
+    previousTileHashes = []
+    unchanged = not (inputsSignature is None)
+    for mode, outProfile, outfileName in zip(modes, outProfiles, outfileNames):
+        settingsHash = hashParts(versionNumber, mode, getInputProfileHash(tempProfile), getInputProfileHash(precProfile),
+                                 getOutputProfileHash(outProfile), str(width), str(height), str(tileSize))
+        state = readIncrementalState(outfileName)
+        tileHashes = getStateTileHashes(state, settingsHash, len(tiles))
+        if not (tileHashes is None):
+            with profiler.stage('diff'):
+                if not (os.path.isfile(outfileName) and (hashFile(outfileName) == state.get('output'))):
+                    tileHashes = None
+        settingsHashes.append(settingsHash)
+        previousTileHashes.append(tileHashes)
+        unchanged = unchanged and not (tileHashes is None) and (state.get('inputs') == inputsSignature)
+    if unchanged:
+        return 0, len(tiles)
+
+    outputs = []
+    for idx, outfileName in enumerate(outfileNames):
+        output = None
+        if not (previousTileHashes[idx] is None):
+            output = np.array(Image.open(outfileName).convert('RGB'))
+        if (output is None) or (output.shape != (height, width, 3)):
+            output = np.zeros((height, width, 3), dtype=np.uint8)
+            previousTileHashes[idx] = None
+        outputs.append(output)
+
+    tileHashes = []
+    staleTiles = 0
+    for rowStart in range(0, height, tileSize):
+        rowEnd = min(rowStart + tileSize, height)
+        with profiler.stage('decode'):
+            rgbArrays = readInputStrip(images, rowStart, rowEnd)
+        bandTiles = getTiles(width, rowEnd - rowStart, tileSize)
+        with profiler.stage('diff'):
+            bandHashes = getTileHashes(rgbArrays, bandTiles)
+        isNorthernHemis = getNorthernMask(rowEnd - rowStart, width, rowStart, height)
+        for (bandRowStart, bandRowEnd, colStart, colEnd), tileHash in zip(bandTiles, bandHashes):
+            tileIdx = len(tileHashes)
+            tileHashes.append(tileHash)
+            if all(not (oldHashes is None) and (oldHashes[tileIdx] == tileHash) for oldHashes in previousTileHashes):
+                continue
+            staleTiles += 1
+            profiler.addPixels((rowEnd - rowStart) * (colEnd - colStart))
+            tileArrays = [rgbArray[:, colStart:colEnd] for rgbArray in rgbArrays]
+            results = classifyRGBArraysForModes(tileArrays, tempProfile, precProfile, modes, engine, decisionTables,
+                                                isNorthernHemis[:, colStart:colEnd], profiler)
+            with profiler.stage('putdata'):
+                for output, outProfile, (classIds, classNames) in zip(outputs, outProfiles, results):
+                    output[rowStart:rowEnd, colStart:colEnd] = colorizeClassIds(classIds, classNames, outProfile)
+
+    for output, outfileName, settingsHash, oldHashes in zip(outputs, outfileNames, settingsHashes, previousTileHashes):
+        # An output none of whose tiles changed is left as it is
+        if (staleTiles > 0) or (oldHashes is None):
+            with profiler.stage('encode'):
+                outputToFile(outfileName, Image.fromarray(output, 'RGB'))
+        writeIncrementalState(outfileName, {'version': incrementalStateVersion, 'settings': settingsHash, 'output': hashFile(outfileName),
+                                            'inputs': inputsSignature, 'tiles': tileHashes})
+    return staleTiles, len(tiles)
+
+# Returns a signature of the modification times and sizes of a list of files, for noticing changes to them.
+def getFilesSignature(fnames):
+    signature = []
+    for fname in fnames:
+        try:
+            stats = os.stat(fname)
+            signature.append((stats.st_mtime_ns, stats.st_size))
+        except OSError:
+            signature.append(None)
+    return signature
+
+# Calls render() now and again whenever any of the watched files change, checking every interval
+# seconds, until interrupted. Errors from render() are printed and watching continues.
+def watchFiles(fnames, render, interval=1.0, quiet=False):
+    lastSignature = None
+    try:
+        while True:
+            signature = getFilesSignature(fnames)
+            if (signature != lastSignature):
+                # Wait for the files to stop changing (e.g. while an editor is still saving)
+                time.sleep(min(interval, 0.25))
+                if (getFilesSignature(fnames) == signature):
+                    lastSignature = signature
+                    try:
+                        render()
+                    except Exception as e:
+                        print('Error: ' + str(e))
+                    continue
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        if not quiet:
+            print('Stopped watching.')
+
 # Validates that a mode is a valid mode value.
 def validateMode(md):
     if md in modes:
         return md
     else:
-        raise SKCCError('Invalid mode specified: ' + mode) 
+        raise SKCCError('Invalid mode specified: ' + md)
 
-# Begin script
-if __name__ == '__main__':
+# Validates and converts a cache size (in megabytes) given on the command line.
+def validateCacheSize(megabytes):
+    if megabytes.isdigit():
+        return int(megabytes) << 20
+    else:
+        raise SKCCError('Invalid cache size specified: ' + megabytes)
+
+# Validates and converts a strip height (number of rows) given on the command line.
+def validateStripHeight(rows):
+    if rows.isdigit() and (int(rows) > 0):
+        return int(rows)
+    else:
+        raise SKCCError('Invalid strip height specified: ' + rows)
+
+# Validates and converts a number of worker processes given on the command line.
+def validateJobs(jobs):
+    if jobs.isdigit() and (int(jobs) > 0):
+        return int(jobs)
+    else:
+        raise SKCCError('Invalid number of jobs specified: ' + jobs)
+
+# Validates and converts the number of seconds between checks for changed files given on the command line.
+def validateWatchInterval(seconds):
+    try:
+        interval = float(seconds)
+    except ValueError:
+        interval = 0.0
+    if (interval > 0):
+        return interval
+    else:
+        raise SKCCError('Invalid watch interval specified: ' + seconds)
+
+# Validates that an output format is a valid output format value.
+def validateOutputFormat(fmt):
+    if fmt in outputFormats:
+        return fmt
+    else:
+        raise SKCCError('Invalid output format specified: ' + fmt)
+
+# Validates that an engine is a valid engine value.
+def validateEngine(eng):
+    if eng in engines:
+        return eng
+    else:
+        raise SKCCError('Invalid engine specified: ' + eng)
+
+# Runs the script with the given command-line arguments (by default, those skcc.py was run with).
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
     debug = False
     try:
         try:
-            options, xarguments = getopt.getopt(sys.argv[1:], 'hvso:t:u:p:q:v:r:k:dm:', ['help', 'version', 'quiet', 'outfile=', 'tempnw=', 'tempns=', 'precnw=', 'precns=', 'tempprof=', 'precprof=', 'outprof=', 'debug', 'mode='])
+            options, xarguments = getopt.getopt(argv, 'hvso:t:u:p:q:v:r:k:dm:e:j:', ['help', 'version', 'quiet', 'outfile=', 'tempnw=', 'tempns=', 'precnw=', 'precns=', 'tempprof=', 'precprof=', 'outprof=', 'debug', 'mode=', 'engine=', 'strip=', 'jobs=', 'profile=', 'cache=', 'cache-size=', 'cache-layers', 'incremental', 'watch', 'watch-interval=', 'format=', 'stack=', 'write-stack=', 'mask=', 'validate', 'report=', 'highlight=', 'stats=', 'compare-tempnw=', 'compare-tempns=', 'compare-precnw=', 'compare-precns=', 'transitions='])
         except getopt.error:
             optErr()
 
@@ -477,16 +1748,59 @@ if __name__ == '__main__':
         tempFileNameNS = ''
         precFileNameNW = ''
         precFileNameNS = ''
-        outfileName = ''
+        outfileNames = []
+
+        # The four inputs can instead come from a single stack file, and can be written to one
+        stackFileName = ''
+        writeStackFileName = ''
+
+        # Value raster inputs can have their ignored pixels given by a mask
+        maskFileName = ''
+
+        # Class statistics are only gathered if asked for
+        statsFileName = ''
 
-        # Default mode for the script is to do Köppen-Geiger climates
-        mode = 'koppen'
+        # A second scenario, if given, is compared with the first
+        compareFileNames = {}
+        transitionsFileName = ''
+
+        # The inputs can be validated instead of (or before) being classified
+        validateOnly = False
+        reportFileName = ''
+        highlightFileName = ''
+
+        # Default mode for the script is to do Köppen-Geiger climates. Several modes
+        # can be given, each with its own output file and (optionally) output profile.
+        outputModes = []
+        outProfileNames = []
+
+        # Default engine is the per-pixel classifier (or numpy when rendering incrementally or to
+        # paletted or class-id outputs)
+        engine = ''
+
+        # Outputs are full color images unless another format is asked for
+        outputFormat = 'rgb'
+
+        # By default the whole map is classified at once, in a single process
+        stripHeight = None
+        jobs = 1
+
+        # Stage timings are only recorded if asked for
+        profileFileName = ''
+
+        # Parsed profiles and decision tables are cached on disk only if a cache directory is given
+        cacheDirName = os.environ.get('SKCC_CACHE_DIR', '')
+        cacheSize = defaultMaxBytes
+        cacheLayers = False
         
-        # Set up default color profiles
-        tempProfile = InputProfile(tColorTableDefault, [defaultOceanColor])
-        precProfile = InputProfile(pColorTableDefault, [defaultOceanColor])
+        # Default color profiles are used unless profile files are given
+        tempProfileName = ''
+        precProfileName = ''
 
-        outProfile = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+        # Incremental rendering and watching for changed inputs are off by default
+        incremental = False
+        watch = False
+        watchInterval = 1.0
 
         quiet = False
         # Parse options - debug, help, version, and mode flags either must come before or they
@@ -505,15 +1819,15 @@ if __name__ == '__main__':
                 if a[1] == '':
                     optErr()
                 else:
-                    mode = validateMode(a[1])
-                    if (mode == 'holdridge'):
-                        outProfile = OutputProfile(hColorTableDefault, defaultOceanColor, defaultUnknownColor)
+                    outputModes.append(validateMode(a[1]))
+        if not outputModes:
+            outputModes = ['koppen']
         for a in options[:]:
             if a[0] == '-o' or a[0] == '--outfile':
                 if a[1] == '':
                     optErr()
                 else:
-                    outfileName = a[1]
+                    outfileNames.append(a[1])
             if a[0] == '-t' or a[0] == '--tempnw':
                 if a[1] == '':
                     optErr()
@@ -538,34 +1852,263 @@ if __name__ == '__main__':
                 if a[1] == '':
                     optErr()
                 else:
-                    tempProfile = readInputProfile(a[1])
+                    tempProfileName = a[1]
             if a[0] == '-r' or a[0] == '--precprof':
                 if a[1] == '':
                     optErr()
                 else:
-                    precProfile = readInputProfile(a[1])
+                    precProfileName = a[1]
             if a[0] == '-k' or a[0] == '--outprof':
                 if a[1] == '':
                     optErr()
                 else:
-                    # Output profiles differ by mode
-                    if (mode == 'koppen'):
-                        outProfile = readAndValidateKoppenOutputProfile(a[1])
-                    elif (mode == 'holdridge'):
-                        outProfile = readAndValidateHoldridgeOutputProfile(a[1])
+                    outProfileNames.append(a[1])
+            if a[0] == '-e' or a[0] == '--engine':
+                if a[1] == '':
+                    optErr()
+                else:
+                    engine = validateEngine(a[1])
+            if a[0] == '--strip':
+                stripHeight = validateStripHeight(a[1])
+            if a[0] == '-j' or a[0] == '--jobs':
+                jobs = validateJobs(a[1])
+            if a[0] == '--profile':
+                if a[1] == '':
+                    optErr()
+                else:
+                    profileFileName = a[1]
+            if a[0] == '--cache':
+                cacheDirName = a[1]
+            if a[0] == '--cache-size':
+                cacheSize = validateCacheSize(a[1])
+            if a[0] == '--cache-layers':
+                cacheLayers = True
+            if a[0] == '--incremental':
+                incremental = True
+            if a[0] == '--watch':
+                watch = True
+                incremental = True
+            if a[0] == '--watch-interval':
+                watchInterval = validateWatchInterval(a[1])
+            if a[0] == '--format':
+                outputFormat = validateOutputFormat(a[1])
+            if a[0] == '--stack':
+                if a[1] == '':
+                    optErr()
+                else:
+                    stackFileName = a[1]
+            if a[0] == '--mask':
+                if a[1] == '':
+                    optErr()
+                else:
+                    maskFileName = a[1]
+            if a[0] == '--write-stack':
+                if a[1] == '':
+                    optErr()
+                else:
+                    writeStackFileName = a[1]
+            if a[0] == '--stats':
+                if a[1] == '':
+                    optErr()
+                else:
+                    statsFileName = a[1]
+            if a[0] in ('--compare-tempns', '--compare-tempnw', '--compare-precns', '--compare-precnw'):
+                if a[1] == '':
+                    optErr()
+                else:
+                    compareFileNames[a[0][len('--compare-'):]] = a[1]
+            if a[0] == '--transitions':
+                if a[1] == '':
+                    optErr()
+                else:
+                    transitionsFileName = a[1]
+            if a[0] == '--validate':
+                validateOnly = True
+            if a[0] == '--report':
+                if a[1] == '':
+                    optErr()
+                else:
+                    reportFileName = a[1]
+            if a[0] == '--highlight':
+                if a[1] == '':
+                    optErr()
+                else:
+                    highlightFileName = a[1]
             if a[0] == '-s' or a[0] == '--quiet':
                 quiet = True
-        if ((not tempFileNameNS) or (not tempFileNameNW) or (not precFileNameNS) or (not precFileNameNW)):
+        if not engine:
+            engine = 'numpy' if (incremental or (outputFormat != 'rgb') or statsFileName or compareFileNames or not (stripHeight is None) or (jobs != 1)) else 'scalar'
+        if compareFileNames:
+            if (len(compareFileNames) != 4):
+                raise SKCCError('All four input data files of the second scenario must be specified.')
+            if (engine == 'scalar'):
+                raise SKCCError('Comparing scenarios requires one of the array-based engines.')
+            if incremental or (outputFormat != 'rgb') or statsFileName or (jobs != 1):
+                raise SKCCError('Comparing scenarios cannot be combined with incremental rendering, output formats, class statistics or parallel jobs.')
+        elif transitionsFileName:
+            raise SKCCError('A transition matrix can only be written when comparing scenarios.')
+        if statsFileName and (engine == 'scalar'):
+            raise SKCCError('Class statistics require one of the array-based engines.')
+        if statsFileName and incremental:
+            raise SKCCError('Class statistics are not gathered when rendering incrementally.')
+        if (outputFormat != 'rgb') and (engine == 'scalar'):
+            raise SKCCError('Paletted and class-id outputs require one of the array-based engines.')
+        if incremental and (not (stripHeight is None) or (jobs != 1)):
+            raise SKCCError('Incremental rendering works a row of tiles at a time, so cannot be combined with --strip or --jobs.')
+        if (outputFormat != 'rgb') and incremental:
+            raise SKCCError('Incremental rendering only supports RGB output.')
+        if cacheLayers and not cacheDirName:
+            raise SKCCError('Caching input layers requires a cache directory.')
+        if cacheLayers and (engine == 'scalar'):
+            raise SKCCError('Caching input layers requires one of the array-based engines.')
+        if stackFileName:
+            if tempFileNameNS or tempFileNameNW or precFileNameNS or precFileNameNW:
+                raise SKCCError('Input data files cannot be given along with a stack file.')
+        elif ((not tempFileNameNS) or (not tempFileNameNW) or (not precFileNameNS) or (not precFileNameNW)):
             raise SKCCError('One or more required input data files were not specified.')
-        if (not outfileName):
+        if writeStackFileName:
+            if stackFileName:
+                raise SKCCError('A stack file can only be written from input data files.')
+            inputMaps = [tempFileNameNS, tempFileNameNW, precFileNameNS, precFileNameNW]
+            if maskFileName:
+                inputMaps = maskValueRasters(inputMaps, maskFileName)
+            writeInputStack(writeStackFileName, inputMaps[0], inputMaps[1], inputMaps[2], inputMaps[3])
+            if not quiet:
+                print('Wrote input stack to ' + writeStackFileName + ' (' + format(time.time() - startTime, '.2f') + 's).')
+            return
+
+        diskCache = None
+        if cacheDirName:
+            diskCache = DiskCache(cacheDirName, cacheSize)
+
+        # Opens the input maps, from the stack file if one is given, with the mask applied
+        def getInputMaps():
+            if stackFileName:
+                requireNumpyFor('Reading stack files')
+                inputMaps = openInputStack(stackFileName)
+            else:
+                inputMaps = [tempFileNameNS, tempFileNameNW, precFileNameNS, precFileNameNW]
+            if maskFileName:
+                inputMaps = maskValueRasters(inputMaps, maskFileName)
+            return inputMaps
+
+        # Reads the input profiles, or gets the defaults
+        def getInputProfiles():
+            if tempProfileName:
+                tempProfile = readInputProfileCached(tempProfileName, diskCache)
+            else:
+                tempProfile = getDefaultInputProfile('temp')
+            if precProfileName:
+                precProfile = readInputProfileCached(precProfileName, diskCache)
+            else:
+                precProfile = getDefaultInputProfile('prec')
+            if (engine != 'scalar') and not (diskCache is None):
+                tempProfile = compileInputProfileCached(tempProfile, diskCache)
+                precProfile = compileInputProfileCached(precProfile, diskCache)
+            return tempProfile, precProfile
+
+        if validateOnly:
+            tempProfile, precProfile = getInputProfiles()
+            runValidation(getInputMaps(), tempProfile, precProfile, reportFileName or '-', highlightFileName, stripHeight)
+            if not quiet:
+                print('Input data passed validation (' + format(time.time() - startTime, '.2f') + 's).')
+            return
+        if compareFileNames and (len(outputModes) != 1):
+            raise SKCCError('Only one mode can be used when comparing scenarios.')
+        if (len(outputModes) == 1):
+            # With a single mode the last output file and profile given are used
+            outfileNames = outfileNames[-1:]
+            outProfileNames = outProfileNames[-1:]
+        if (not outfileNames):
             raise SKCCError('No output filename specified.')
+        if (len(outfileNames) != len(outputModes)):
+            raise SKCCError('One output filename must be specified for each mode.')
+        if outProfileNames and (len(outProfileNames) != len(outputModes)):
+            raise SKCCError('Either no output profiles or one output profile for each mode must be specified.')
 
-        # Generate the output.
-        outputToFile(outfileName, buildOutput(tempFileNameNS, tempFileNameNW, precFileNameNS, precFileNameNW, tempProfile, precProfile, outProfile, mode))
-        if not quiet:
-            stopTime = time.time()
-            timeDiffRounded = format(stopTime - startTime, '.2f')
-            print('Output climate map to ' + outfileName + ' (' + timeDiffRounded + 's).')
+        # Reads the profiles and renders the output maps. Profiles are re-read on each render when watching.
+        def render(startTime):
+            inputMaps = getInputMaps()
+
+            # Set up color profiles
+            tempProfile, precProfile = getInputProfiles()
+            if reportFileName or highlightFileName:
+                # Check the inputs before starting to classify them
+                runValidation(inputMaps, tempProfile, precProfile, reportFileName, highlightFileName, stripHeight)
+
+            # Output profiles differ by mode
+            if outProfileNames:
+                outProfiles = [readAndValidateOutputProfileCached(fname, mode, diskCache) for fname, mode in zip(outProfileNames, outputModes)]
+            else:
+                outProfiles = [getDefaultOutputProfile(mode) for mode in outputModes]
+
+            decisionTables = None
+            if (engine == 'table'):
+                decisionTables = [compileDecisionTableCached(tempProfile, precProfile, mode, diskCache) for mode in outputModes]
+
+            # Generate the output.
+            profiler = None
+            if profileFileName:
+                profiler = StageProfiler()
+                profiler.info = {'engine': engine, 'modes': outputModes, 'stripHeight': stripHeight, 'jobs': jobs, 'format': outputFormat, 'cacheLayers': cacheLayers}
+            statistics = None
+            if statsFileName:
+                requireNumpyFor('Class statistics')
+                statistics = ClassStatistics()
+            if cacheLayers:
+                if profiler is None:
+                    inputMaps = cacheInputLayers(inputMaps, tempProfile, precProfile, diskCache)
+                else:
+                    with profiler.stage('decode'):
+                        inputMaps = cacheInputLayers(inputMaps, tempProfile, precProfile, diskCache)
+            if compareFileNames:
+                compareMaps = [compareFileNames['tempns'], compareFileNames['tempnw'], compareFileNames['precns'], compareFileNames['precnw']]
+                if maskFileName:
+                    compareMaps = maskValueRasters(compareMaps, maskFileName)
+                if cacheLayers:
+                    compareMaps = cacheInputLayers(compareMaps, tempProfile, precProfile, diskCache)
+                timer = profiler if profiler else StageProfiler()
+                classIds1, classIds2, classNames, transitions = compareScenarios(inputMaps, compareMaps, tempProfile, precProfile, outputModes[0], engine, decisionTables[0] if decisionTables else None, stripHeight, timer)
+                with timer.stage('encode'):
+                    outputToFile(outfileNames[0], getChangeMapImage(classIds1, classIds2, classNames, outProfiles[0]))
+                    writeTransitions(transitionsFileName or getTransitionsFileName(outfileNames[0]), transitions, classNames, outputModes[0])
+            elif (outputFormat != 'rgb'):
+                timer = profiler if profiler else StageProfiler()
+                results = buildClassIdMaps(inputMaps[0], inputMaps[1], inputMaps[2], inputMaps[3], tempProfile, precProfile, outputModes, engine, decisionTables, stripHeight=stripHeight, jobs=jobs, profiler=timer, statistics=statistics)
+                for outfileName, outProfile, mode, (classIds, classNames) in zip(outfileNames, outProfiles, outputModes, results):
+                    with timer.stage('encode'):
+                        writeClassIdMap(outfileName, classIds, classNames, outProfile, mode, outputFormat)
+            elif incremental:
+                renderedTiles, totalTiles = renderIncremental(inputMaps[0], inputMaps[1], inputMaps[2], inputMaps[3], tempProfile, precProfile, outProfiles, outputModes, outfileNames, engine, decisionTables, profiler=profiler)
+            else:
+                outputImgs = buildOutputs(inputMaps[0], inputMaps[1], inputMaps[2], inputMaps[3], tempProfile, precProfile, outProfiles, outputModes, engine, decisionTables, stripHeight=stripHeight, jobs=jobs, profiler=profiler, statistics=statistics)
+                for outfileName, outputImg in zip(outfileNames, outputImgs):
+                    if profiler is None:
+                        outputToFile(outfileName, outputImg)
+                    else:
+                        with profiler.stage('encode'):
+                            outputToFile(outfileName, outputImg)
+            if not (statistics is None):
+                statistics.writeReport(statsFileName)
+            if not (profiler is None):
+                profiler.writeReport(profileFileName)
+            if not quiet:
+                stopTime = time.time()
+                timeDiffRounded = format(stopTime - startTime, '.2f')
+                if compareFileNames:
+                    print('Output change map to ' + outfileNames[0] + ' (' + timeDiffRounded + 's).')
+                elif incremental:
+                    print('Updated ' + str(renderedTiles) + ' of ' + str(totalTiles) + ' tiles of ' + ', '.join(outfileNames) + ' (' + timeDiffRounded + 's).')
+                else:
+                    print('Output climate map to ' + ', '.join(outfileNames) + ' (' + timeDiffRounded + 's).')
+
+        if watch:
+            watchedFileNames = [tempFileNameNS, tempFileNameNW, precFileNameNS, precFileNameNW, stackFileName, maskFileName, tempProfileName, precProfileName] + outProfileNames
+            if not quiet:
+                print('Watching input files for changes (Ctrl-C to stop).')
+            watchFiles([fname for fname in watchedFileNames if fname], lambda: render(time.time()), watchInterval, quiet)
+        else:
+            render(startTime)
     except Exception as e:
         # An error occurred.
         if (debug):
@@ -574,3 +2117,7 @@ if __name__ == '__main__':
         else:
             # Output the error without cluttering things up with the stack trace.
             print('Error: ' + str(e))
+
+# Begin script
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Speculative Köppen-Geiger Climate Classifier - batch runner
+# (c) 2020 Patrick Harvey (see LICENSE.txt)
+
+# Classifies many maps listed in a manifest file in one run, parsing and
+# compiling each distinct profile only once and running jobs concurrently.
+
+import sys, os, getopt, json, csv, time, threading, multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from utils.errors import SKCCError
+from utils.profiling import StageProfiler
+from utils.diskCache import DiskCache, defaultMaxBytes
+import skcc
+
+# Fields a job in a manifest can have; these match the long options of skcc.py.
+jobFields = ('tempns', 'tempnw', 'precns', 'precnw', 'outfile', 'mode', 'engine', 'tempprof', 'precprof', 'outprof', 'strip', 'format')
+
+# Fields holding file paths, which are taken relative to the manifest's directory.
+pathFields = ('tempns', 'tempnw', 'precns', 'precnw', 'outfile', 'tempprof', 'precprof', 'outprof')
+
+# Fields every job must have.
+requiredFields = ('tempns', 'tempnw', 'precns', 'precnw', 'outfile')
+
+def usage():
+    print('''skccbatch.py : Speculative Köppen-Geiger Climate Classifier batch runner
+  Classifies every job listed in a manifest file.
+  Options:
+    -h, --help                     : Displays this message
+    -s, --quiet                    : Silences per-job and summary output
+    -d, --debug                    : Displays stack traces for errors outside of individual jobs
+    -i<fname>, --manifest=<fname>  : Reads the jobs to run from the JSON or CSV file '<fname>'. Required.
+    -r<fname>, --report=<fname>    : Writes a JSON report of each job's status and stage timings to '<fname>'.
+    -j<n>, --jobs=<n>              : Runs up to <n> jobs at once. Defaults to 1. Jobs using the scalar engine run
+                                     in worker processes, and the others in threads of this process.
+    --cache=<dir>                  : Caches parsed profiles and compiled decision tables in the directory '<dir>', as for
+                                     skcc.py. Defaults to the SKCC_CACHE_DIR environment variable.
+    --cache-size=<mb>              : Limits the cache to <mb> megabytes. Defaults to 256.
+  Each job in the manifest has the fields tempns, tempnw, precns, precnw and outfile (required),
+  and optionally mode, engine, tempprof, precprof, outprof, strip and format, as for the skcc.py
+  options of the same names, except that jobs default to the numpy engine (if NumPy is installed)
+  rather than scalar. A JSON manifest is a list of jobs (or an object with a 'jobs' list); a CSV
+  manifest has a header row naming the fields. Paths are relative to the manifest's directory. ''')
+    sys.exit(0)
+
+def optErr():
+    raise SKCCError('Invalid options. Use the \'-h\' or \'--help\' options for usage information.')
+
+# Reads the list of jobs from a JSON or CSV manifest file.
+def readManifest(fname):
+    try:
+        fp = open(fname, 'r', newline='')
+    except OSError:
+        raise SKCCError('Could not open manifest: ' + fname)
+    try:
+        if fname.lower().endswith('.csv'):
+            rows = list(csv.DictReader(fp))
+        else:
+            try:
+                rows = json.load(fp)
+            except ValueError as e:
+                raise SKCCError('Invalid JSON in manifest: ' + str(e))
+            if isinstance(rows, dict):
+                rows = rows.get('jobs', [])
+    finally:
+        fp.close()
+    if not isinstance(rows, list):
+        raise SKCCError('Manifest does not contain a list of jobs: ' + fname)
+
+    baseDir = os.path.dirname(os.path.abspath(fname))
+    jobs = []
+    for row in rows:
+        job = {}
+        if isinstance(row, dict):
+            for field, value in row.items():
+                if not ((value is None) or (value == '')):
+                    job[field] = value
+        for field in pathFields:
+            if (field in job) and isinstance(job[field], str):
+                job[field] = os.path.join(baseDir, job[field])
+        jobs.append(job)
+    return jobs
+
+# Holds the profiles (and decision tables) used by the jobs of a batch, so that each
+# distinct profile file is parsed and compiled only once however many jobs use it.
+# If a DiskCache is given, profiles and decision tables are also shared with other runs through it.
+class ProfileCache:
+    def __init__(self, diskCache=None):
+        self.diskCache = diskCache
+        self.lock = threading.Lock()
+        self.inputProfiles = {}
+        self.outputProfiles = {}
+        self.decisionTables = {}
+
+    # Returns the input profile read from fname, or the default profile of the given
+    # kind ('temp' or 'prec') if fname is None. Profiles are compiled when first read.
+    def getInputProfile(self, fname, kind):
+        key = (kind, fname)
+        with self.lock:
+            if not (key in self.inputProfiles):
+                if not (fname is None):
+                    profile = skcc.readInputProfileCached(fname, self.diskCache)
+                else:
+                    profile = skcc.getDefaultInputProfile(kind)
+                self.inputProfiles[key] = skcc.compileInputProfileCached(profile, self.diskCache)
+            return self.inputProfiles[key]
+
+    # Returns the output profile for a mode read from fname, or the mode's default if fname is None.
+    def getOutputProfile(self, fname, mode):
+        key = (mode, fname)
+        with self.lock:
+            if not (key in self.outputProfiles):
+                if (fname is None):
+                    self.outputProfiles[key] = skcc.getDefaultOutputProfile(mode)
+                else:
+                    self.outputProfiles[key] = skcc.readAndValidateOutputProfileCached(fname, mode, self.diskCache)
+            return self.outputProfiles[key]
+
+    # Returns the decision table for the given input profile files and mode.
+    def getDecisionTable(self, tempName, precName, mode):
+        tempProfile = self.getInputProfile(tempName, 'temp')
+        precProfile = self.getInputProfile(precName, 'prec')
+        key = (tempName, precName, mode)
+        with self.lock:
+            if not (key in self.decisionTables):
+                self.decisionTables[key] = skcc.compileDecisionTableCached(tempProfile, precProfile, mode, self.diskCache)
+            return self.decisionTables[key]
+
+# Checks a job's fields, raising an error for unknown fields or missing required ones.
+def validateJob(job, required=requiredFields):
+    for field in job:
+        if not (field in jobFields):
+            raise SKCCError('Unknown field in job: ' + str(field))
+    for field in required:
+        if not (field in job):
+            raise SKCCError('Job is missing required field: ' + field)
+
+# Returns the engine a job uses: the one it gives, or else the numpy engine if NumPy is installed.
+# Unlike skcc.py, which defaults to the scalar engine, batches default to the much faster numpy engine.
+def getJobEngine(job):
+    return skcc.validateEngine(job.get('engine', 'scalar' if (skcc.np is None) else 'numpy'))
+
+# Returns whether a job uses the scalar engine (False if its engine is invalid, which running it reports).
+def isScalarJob(job):
+    try:
+        return getJobEngine(job) == 'scalar'
+    except SKCCError:
+        return False
+
+# Classifies the input images of a job with its profiles, mode and engine, returning the output image.
+def buildJobOutput(job, profileCache, profiler=None):
+    if profiler is None:
+        profiler = StageProfiler()
+    mode = skcc.validateMode(job.get('mode', 'koppen'))
+    engine = getJobEngine(job)
+    stripHeight = None
+    if ('strip' in job):
+        stripHeight = skcc.validateStripHeight(str(job['strip']))
+    tempProfile = profileCache.getInputProfile(job.get('tempprof'), 'temp')
+    precProfile = profileCache.getInputProfile(job.get('precprof'), 'prec')
+    outProfile = profileCache.getOutputProfile(job.get('outprof'), mode)
+    decisionTable = None
+    if (engine == 'table'):
+        decisionTable = profileCache.getDecisionTable(job.get('tempprof'), job.get('precprof'), mode)
+    outputFormat = skcc.validateOutputFormat(job.get('format', 'rgb'))
+    if (outputFormat == 'rgb'):
+        return skcc.buildOutput(job['tempns'], job['tempnw'], job['precns'], job['precnw'], tempProfile, precProfile, outProfile,
+                                mode, engine, decisionTable=decisionTable, stripHeight=stripHeight, profiler=profiler)
+    elif (outputFormat == 'palette') and (engine != 'scalar'):
+        classIds, classNames = skcc.buildClassIdMaps(job['tempns'], job['tempnw'], job['precns'], job['precnw'], tempProfile, precProfile, [mode],
+                                                     engine, [decisionTable], stripHeight, profiler=profiler)[0]
+        with profiler.stage('putdata'):
+            return skcc.classIdsToPalettedImage(classIds, classNames, outProfile)
+    else:
+        raise SKCCError('Jobs support the rgb and palette output formats, the latter with the array-based engines only.')
+
+# Runs a single job. Returns a report of its status and how long it (and each of its stages)
+# took; errors in the job are recorded in the report rather than raised.
+def runJob(index, job, profileCache):
+    startTime = time.time()
+    profiler = StageProfiler()
+    result = {'index': index, 'outfile': job.get('outfile'), 'status': 'ok', 'error': None}
+    try:
+        validateJob(job)
+        outputImg = buildJobOutput(job, profileCache, profiler)
+        with profiler.stage('encode'):
+            skcc.outputToFile(job['outfile'], outputImg)
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = str(e)
+    result['seconds'] = round(time.time() - startTime, 3)
+    result['stages'] = profiler.getStageTimes()
+    result['pixels'] = profiler.pixels
+    return result
+
+# The profile cache of a worker process running scalar jobs.
+workerProfileCache = None
+
+# Sets up a worker process for scalar jobs, with its own profile cache (sharing the disk cache, if any).
+def initJobWorker(cacheDirName, cacheSize):
+    global workerProfileCache
+    diskCache = None
+    if cacheDirName:
+        diskCache = DiskCache(cacheDirName, cacheSize)
+    workerProfileCache = ProfileCache(diskCache)
+
+# Runs a single job in a worker process.
+def runJobInWorker(index, job):
+    return runJob(index, job, workerProfileCache)
+
+# Runs all the jobs in a list, up to maxJobs at once, and returns the batch report.
+# Jobs run in threads, which suits the array-based engines as NumPy releases the GIL while it
+# works, but the scalar engine holds the GIL throughout; so when running more than one job at
+# once, each scalar job is handed from its thread to a pool of worker processes.
+def runBatch(jobs, maxJobs=1, quiet=True, diskCache=None):
+    startTime = time.time()
+    profileCache = ProfileCache(diskCache)
+    processExecutor = None
+    if (maxJobs > 1) and any(isScalarJob(job) for job in jobs):
+        initArgs = ('', 0) if (diskCache is None) else (diskCache.dirName, diskCache.maxBytes)
+        processExecutor = ProcessPoolExecutor(max_workers=maxJobs, mp_context=multiprocessing.get_context('spawn'),
+                                              initializer=initJobWorker, initargs=initArgs)
+
+    def runAnyJob(index, job):
+        if (processExecutor is None) or not isScalarJob(job):
+            return runJob(index, job, profileCache)
+        try:
+            return processExecutor.submit(runJobInWorker, index, job).result()
+        except Exception as e:
+            return {'index': index, 'outfile': job.get('outfile'), 'status': 'error', 'error': 'Worker process failed: ' + str(e),
+                    'seconds': 0.0, 'stages': {}, 'pixels': 0}
+
+    try:
+        with ThreadPoolExecutor(max_workers=maxJobs) as executor:
+            futures = [executor.submit(runAnyJob, idx, job) for idx, job in enumerate(jobs)]
+            results = []
+            for future in futures:
+                result = future.result()
+                results.append(result)
+                if not quiet:
+                    if (result['status'] == 'ok'):
+                        print('Job ' + str(result['index']) + ': output climate map to ' + str(result['outfile']) + ' (' + format(result['seconds'], '.2f') + 's).')
+                    else:
+                        print('Job ' + str(result['index']) + ': error: ' + result['error'])
+    finally:
+        if not (processExecutor is None):
+            processExecutor.shutdown()
+    succeeded = len([result for result in results if result['status'] == 'ok'])
+    return {'jobs': results, 'succeeded': succeeded, 'failed': len(results) - succeeded,
+            'seconds': round(time.time() - startTime, 3)}
+
+# Writes a batch report to a JSON file.
+def writeReport(fname, report):
+    try:
+        fp = open(fname, 'w')
+    except OSError:
+        raise SKCCError('Could not write to file ' + fname)
+    try:
+        json.dump(report, fp, indent=2)
+    finally:
+        fp.close()
+
+# Begin script
+if __name__ == '__main__':
+    debug = False
+    try:
+        try:
+            options, xarguments = getopt.getopt(sys.argv[1:], 'hsdi:r:j:', ['help', 'quiet', 'debug', 'manifest=', 'report=', 'jobs=', 'cache=', 'cache-size='])
+        except getopt.error:
+            optErr()
+
+        manifestName = ''
+        reportName = ''
+        maxJobs = 1
+        quiet = False
+        cacheDirName = os.environ.get('SKCC_CACHE_DIR', '')
+        cacheSize = defaultMaxBytes
+        for a in options[:]:
+            if a[0] == '-d' or a[0] == '--debug':
+                debug = True
+        for a in options[:]:
+            if a[0] == '-h' or a[0] == '--help':
+                usage()
+        for a in options[:]:
+            if a[0] == '-i' or a[0] == '--manifest':
+                manifestName = a[1]
+            if a[0] == '-r' or a[0] == '--report':
+                reportName = a[1]
+            if a[0] == '-j' or a[0] == '--jobs':
+                maxJobs = skcc.validateJobs(a[1])
+            if a[0] == '-s' or a[0] == '--quiet':
+                quiet = True
+            if a[0] == '--cache':
+                cacheDirName = a[1]
+            if a[0] == '--cache-size':
+                cacheSize = skcc.validateCacheSize(a[1])
+        if (not manifestName):
+            raise SKCCError('No manifest filename specified.')
+
+        diskCache = None
+        if cacheDirName:
+            diskCache = DiskCache(cacheDirName, cacheSize)
+        report = runBatch(readManifest(manifestName), maxJobs, quiet, diskCache)
+        if reportName:
+            writeReport(reportName, report)
+        if not quiet:
+            print('Finished ' + str(len(report['jobs'])) + ' jobs: ' + str(report['succeeded']) + ' succeeded, ' +
+                  str(report['failed']) + ' failed (' + format(report['seconds'], '.2f') + 's).')
+        if (report['failed'] > 0):
+            sys.exit(1)
+    except Exception as e:
+        if (debug):
+            raise
+        else:
+            print('Error: ' + str(e))
+            sys.exit(1)
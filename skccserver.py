@@ -0,0 +1,439 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Speculative Köppen-Geiger Climate Classifier - classification server
+# (c) 2020 Patrick Harvey (see LICENSE.txt)
+
+# Runs as a long-lived process accepting classification jobs over HTTP (on localhost or a
+# Unix socket), keeping parsed and compiled profiles and its worker threads between jobs so
+# that each job pays only for classifying its own map.
+
+import sys, os, stat, getopt, json, io, time, threading, socket, socketserver, multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from utils.errors import SKCCError
+from utils.profiling import StageProfiler
+from utils.diskCache import DiskCache, defaultMaxBytes
+from skccbatch import ProfileCache, validateJob, buildJobOutput, getJobEngine, isScalarJob, initJobWorker
+import skccbatch
+import skcc
+
+defaultHost = '127.0.0.1'
+defaultPort = 8765
+defaultQueueSize = 16
+
+# Largest request body accepted, in bytes. Jobs refer to their images by path, so bodies are small.
+maxRequestBytes = 1 << 20
+
+# Fields a job sent to the server must have; without an outfile, the output image is returned as PNG.
+serverRequiredFields = ('tempns', 'tempnw', 'precns', 'precnw')
+
+# Host names that reach a server listening on a loopback address.
+loopbackHosts = ('127.0.0.1', 'localhost', '::1', '[::1]')
+
+# Error returned for a job that fails other than by being invalid. The details (which can quote
+# the server's own files, such as a profile that failed to parse) are only written to the server's log.
+jobFailedMessage = 'Job failed; see the server log for details.'
+
+def usage():
+    print('''skccserver.py : Speculative Köppen-Geiger Climate Classifier server
+  Accepts classification jobs over HTTP until interrupted.
+  Options:
+    -h, --help                     : Displays this message
+    -s, --quiet                    : Silences startup and per-request output
+    -d, --debug                    : Displays stack traces for errors outside of individual jobs
+    --host=<host>                  : Listens on the address '<host>'. Defaults to 127.0.0.1.
+    --port=<port>                  : Listens on the port <port>. Defaults to 8765.
+    --socket=<fname>               : Listens on the Unix socket '<fname>' instead of a network port.
+    -j<n>, --jobs=<n>              : Runs up to <n> jobs at once. Defaults to 1.
+    --queue=<n>                    : Holds up to <n> jobs waiting to run; further jobs are refused until
+                                     there is room. Defaults to 16.
+    --cache=<dir>                  : Caches parsed profiles and compiled decision tables in the directory '<dir>', as for
+                                     skcc.py. Defaults to the SKCC_CACHE_DIR environment variable.
+    --cache-size=<mb>              : Limits the cache to <mb> megabytes. Defaults to 256.
+    --output-dir=<dir>             : Allows jobs to write their output to files under the directory '<dir>'.
+                                     Without it, jobs cannot name an outfile.
+  Endpoints:
+    POST /classify : Runs the job given as a JSON object (with Content-Type application/json) in the
+                     request body, with the fields of a skccbatch.py job (tempns, tempnw, precns and
+                     precnw are required). If outfile is given (relative to the output directory) the
+                     output is written there and a JSON report returned; otherwise the output image
+                     is returned as PNG. Requests from web pages (with an Origin header) are refused.
+    GET /health    : Reports that the server is running.
+    GET /metrics   : Reports job counts, queue length and time spent as JSON. ''')
+    sys.exit(0)
+
+def optErr():
+    raise SKCCError('Invalid options. Use the \'-h\' or \'--help\' options for usage information.')
+
+# Raised when a job is refused because the queue is full.
+class QueueFullError(SKCCError):
+    pass
+
+# Checks a job's fields and the values of its options, raising an error if it is invalid.
+def validateServerJob(job):
+    validateJob(job, serverRequiredFields)
+    skcc.validateMode(job.get('mode', 'koppen'))
+    getJobEngine(job)
+    if ('strip' in job):
+        skcc.validateStripHeight(str(job['strip']))
+    skcc.validateOutputFormat(job.get('format', 'rgb'))
+
+# Writes a job's output image to outputPath or, if it is None, returns the image encoded as PNG.
+def encodeJobOutput(outputImg, outputPath, profiler):
+    with profiler.stage('encode'):
+        if not (outputPath is None):
+            skcc.outputToFile(outputPath, outputImg)
+            return None
+        buffer = io.BytesIO()
+        outputImg.save(buffer, 'PNG')
+        return buffer.getvalue()
+
+# Builds and encodes a job's output in a worker process (set up by skccbatch.initJobWorker).
+# Returns the job's profiler and, if it has no outputPath, the output image encoded as PNG.
+def buildJobOutputInWorker(job, outputPath):
+    profiler = StageProfiler()
+    outputImg = buildJobOutput(job, skccbatch.workerProfileCache, profiler)
+    return profiler, encodeJobOutput(outputImg, outputPath, profiler)
+
+# Runs jobs on a fixed pool of worker threads sharing one ProfileCache, with at most maxQueue
+# jobs waiting for a worker, and keeps counts of the jobs run for the metrics endpoint.
+# NumPy releases the GIL while it works, but the scalar engine holds it throughout, so scalar
+# jobs are handed from their threads to a pool of as many worker processes, started the first
+# time one is needed. Jobs can only write output files under outputDir, and not at all if it
+# is not given. The errors of failed jobs are printed unless quiet.
+class ClassificationService:
+    def __init__(self, maxJobs=1, maxQueue=defaultQueueSize, diskCache=None, outputDir=None, quiet=True):
+        self.maxJobs = maxJobs
+        self.maxQueue = maxQueue
+        self.outputDir = None if (outputDir is None) else os.path.realpath(outputDir)
+        self.quiet = quiet
+        self.diskCache = diskCache
+        self.profileCache = ProfileCache(diskCache)
+        self.executor = ThreadPoolExecutor(max_workers=maxJobs)
+        self.processExecutor = None
+        self.lock = threading.Lock()
+        self.startTime = time.time()
+        self.counts = {'received': 0, 'succeeded': 0, 'failed': 0, 'rejected': 0}
+        self.queued = 0
+        self.running = 0
+        self.pixels = 0
+        self.jobSeconds = 0.0
+        self.stageSeconds = {}
+
+    # Runs a job on a worker thread, waiting for it to finish. Returns a report of the job and,
+    # if the job has no outfile, the output image encoded as PNG (otherwise None).
+    # Raises QueueFullError if too many jobs are already waiting; a job that fails is reported as failed.
+    def run(self, job):
+        with self.lock:
+            self.counts['received'] += 1
+            if (self.queued + self.running) >= (self.maxJobs + self.maxQueue):
+                self.counts['rejected'] += 1
+                raise QueueFullError('Too many jobs waiting; try again later.')
+            self.queued += 1
+        return self.executor.submit(self.runJob, job).result()
+
+    # Returns the path a job's outfile is written to, raising an error unless it is under the output directory.
+    def getOutputPath(self, outfile):
+        if self.outputDir is None:
+            raise SKCCError('This server does not write output files; start it with --output-dir to allow them.')
+        if not isinstance(outfile, str) or (outfile == ''):
+            raise SKCCError('Invalid outfile: ' + repr(outfile))
+        path = os.path.realpath(os.path.join(self.outputDir, outfile))
+        if (os.path.commonpath([path, self.outputDir]) != self.outputDir) or (path == self.outputDir):
+            raise SKCCError('Output files must be under the output directory: ' + outfile)
+        return path
+
+    # Returns the pool of worker processes for scalar jobs, starting it if need be.
+    def getProcessExecutor(self):
+        with self.lock:
+            if self.processExecutor is None:
+                initArgs = ('', 0) if (self.diskCache is None) else (self.diskCache.dirName, self.diskCache.maxBytes)
+                self.processExecutor = ProcessPoolExecutor(max_workers=self.maxJobs, mp_context=multiprocessing.get_context('spawn'),
+                                                           initializer=initJobWorker, initargs=initArgs)
+            return self.processExecutor
+
+    # Builds and encodes a job's output, in a worker process for scalar jobs. Returns the job's
+    # profiler and, if it has no outputPath, the output image encoded as PNG.
+    def buildOutput(self, job, outputPath, profiler):
+        if not isScalarJob(job):
+            outputImg = buildJobOutput(job, self.profileCache, profiler)
+            return profiler, encodeJobOutput(outputImg, outputPath, profiler)
+        processExecutor = self.getProcessExecutor()
+        try:
+            return processExecutor.submit(buildJobOutputInWorker, job, outputPath).result()
+        except BrokenProcessPool:
+            # A worker process died (e.g. killed for running out of memory); start afresh for the next job
+            with self.lock:
+                if self.processExecutor is processExecutor:
+                    self.processExecutor = None
+            processExecutor.shutdown(wait=False)
+            raise
+
+    def runJob(self, job):
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+        startTime = time.time()
+        profiler = StageProfiler()
+        result = {'outfile': job.get('outfile'), 'status': 'ok', 'error': None}
+        pngData = None
+        try:
+            validateServerJob(job)
+            outputPath = self.getOutputPath(job['outfile']) if ('outfile' in job) else None
+        except SKCCError as e:
+            result['status'] = 'error'
+            result['error'] = str(e)
+        else:
+            try:
+                profiler, pngData = self.buildOutput(job, outputPath, profiler)
+            except Exception as e:
+                if not self.quiet:
+                    print('Job error: ' + (str(e) or type(e).__name__), file=sys.stderr)
+                result['status'] = 'error'
+                result['error'] = jobFailedMessage
+        result['seconds'] = round(time.time() - startTime, 3)
+        result['stages'] = profiler.getStageTimes()
+        result['pixels'] = profiler.pixels
+        with self.lock:
+            self.running -= 1
+            self.counts['succeeded' if (result['status'] == 'ok') else 'failed'] += 1
+            self.pixels += profiler.pixels
+            self.jobSeconds += time.time() - startTime
+            for name, seconds in profiler.stages.items():
+                self.stageSeconds[name] = self.stageSeconds.get(name, 0.0) + seconds
+        return result, pngData
+
+    # Returns the job counts, queue length and time spent so far, for the metrics endpoint.
+    def getMetrics(self):
+        with self.lock:
+            metrics = {'uptimeSeconds': round(time.time() - self.startTime, 3), 'maxJobs': self.maxJobs, 'maxQueue': self.maxQueue,
+                       'queued': self.queued, 'running': self.running, 'pixels': self.pixels,
+                       'jobSeconds': round(self.jobSeconds, 6),
+                       'stageSeconds': dict((name, round(seconds, 6)) for name, seconds in self.stageSeconds.items())}
+            metrics.update(self.counts)
+        return metrics
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            processExecutor = self.processExecutor
+            self.processExecutor = None
+        if not (processExecutor is None):
+            processExecutor.shutdown(wait=True)
+
+# Handles the HTTP requests to a server, whose service attribute is the ClassificationService to use.
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = 'skcc/' + skcc.versionNumber
+    quiet = True
+
+    # Refuses requests sent by web pages (which carry an Origin header) or addressed to another host
+    # name (as when a web page's host name is pointed at this machine). Returns True if refused.
+    def refuseForeignRequest(self):
+        if not (self.headers.get('Origin') is None):
+            self.sendJSON(403, {'status': 'error', 'error': 'Requests from web pages are not accepted.'})
+            return True
+        allowedHosts = self.server.allowedHosts
+        if not (allowedHosts is None) and not (self.headers.get('Host', '').lower() in allowedHosts):
+            self.sendJSON(403, {'status': 'error', 'error': 'Invalid Host header.'})
+            return True
+        return False
+
+    def do_GET(self):
+        if self.refuseForeignRequest():
+            return
+        if (self.path == '/health'):
+            self.sendJSON(200, {'status': 'ok', 'version': skcc.versionNumber})
+        elif (self.path == '/metrics'):
+            self.sendJSON(200, self.server.service.getMetrics())
+        else:
+            self.sendJSON(404, {'status': 'error', 'error': 'Unknown path: ' + self.path})
+
+    def do_POST(self):
+        if self.refuseForeignRequest():
+            return
+        if (self.path != '/classify'):
+            self.sendJSON(404, {'status': 'error', 'error': 'Unknown path: ' + self.path})
+            return
+        if (self.headers.get('Content-Type', '').split(';')[0].strip().lower() != 'application/json'):
+            self.sendJSON(415, {'status': 'error', 'error': 'Requests must have Content-Type application/json.'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', '0'))
+        except ValueError:
+            length = -1
+        if (length < 0) or (length > maxRequestBytes):
+            self.sendJSON(400, {'status': 'error', 'error': 'Invalid request length.'})
+            return
+        try:
+            job = json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError as e:
+            self.sendJSON(400, {'status': 'error', 'error': 'Invalid JSON in request: ' + str(e)})
+            return
+        if not isinstance(job, dict):
+            self.sendJSON(400, {'status': 'error', 'error': 'Request is not a JSON object.'})
+            return
+        try:
+            result, pngData = self.server.service.run(job)
+        except QueueFullError as e:
+            self.sendJSON(503, {'status': 'error', 'error': str(e)})
+            return
+        if (result['status'] != 'ok'):
+            self.sendJSON(400, result)
+        elif pngData is None:
+            self.sendJSON(200, result)
+        else:
+            self.sendBytes(200, 'image/png', pngData)
+
+    def sendJSON(self, code, data):
+        self.sendBytes(code, 'application/json', (json.dumps(data) + '\n').encode('utf-8'))
+
+    def sendBytes(self, code, contentType, data):
+        self.send_response(code)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Unix socket clients have no address to report.
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'local'
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+# Host names a server listening on every interface is reached by: loopback names and this machine's names.
+def getOwnHosts():
+    return loopbackHosts + (socket.gethostname(), socket.getfqdn())
+
+# Returns the values of the Host header accepted by a server listening on host and port.
+def getAllowedHosts(host, port):
+    if host in ('', '0.0.0.0', '::'):
+        hosts = getOwnHosts()
+    elif host in loopbackHosts:
+        hosts = loopbackHosts
+    else:
+        hosts = (host,)
+    allowedHosts = set()
+    for name in hosts:
+        if (':' in name) and not name.startswith('['):
+            name = '[' + name + ']'
+        allowedHosts.add(name.lower() + ':' + str(port))
+        if (port == 80):
+            allowedHosts.add(name.lower())
+    return allowedHosts
+
+# Returns an HTTP server (not yet serving) for a ClassificationService, listening on the Unix socket
+# socketName if given, or else on host and port (port 0 picks a free port). A stale socket left at
+# socketName is replaced, but any other kind of file there is an error.
+def makeServer(service, host=defaultHost, port=defaultPort, socketName='', quiet=True):
+    handler = type('ServiceRequestHandler', (RequestHandler,), {'quiet': quiet})
+    if socketName:
+        if os.path.lexists(socketName):
+            if not stat.S_ISSOCK(os.lstat(socketName).st_mode):
+                raise SKCCError('Not a socket, so not replacing: ' + socketName)
+            os.remove(socketName)
+        server = UnixHTTPServer(socketName, handler)
+        # Only local processes can connect to a Unix socket, whatever host name they use
+        server.allowedHosts = None
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        server.allowedHosts = getAllowedHosts(host, server.server_address[1])
+    server.service = service
+    return server
+
+# Validates and converts a port number given on the command line.
+def validatePort(port):
+    if port.isdigit() and (int(port) < 65536):
+        return int(port)
+    else:
+        raise SKCCError('Invalid port specified: ' + port)
+
+# Validates and converts a queue length given on the command line.
+def validateQueueSize(size):
+    if size.isdigit():
+        return int(size)
+    else:
+        raise SKCCError('Invalid queue size specified: ' + size)
+
+# Begin script
+if __name__ == '__main__':
+    debug = False
+    try:
+        try:
+            options, xarguments = getopt.getopt(sys.argv[1:], 'hsdj:', ['help', 'quiet', 'debug', 'host=', 'port=', 'socket=', 'jobs=', 'queue=', 'cache=', 'cache-size=', 'output-dir='])
+        except getopt.error:
+            optErr()
+
+        host = defaultHost
+        port = defaultPort
+        socketName = ''
+        maxJobs = 1
+        maxQueue = defaultQueueSize
+        quiet = False
+        cacheDirName = os.environ.get('SKCC_CACHE_DIR', '')
+        cacheSize = defaultMaxBytes
+        outputDir = None
+        for a in options[:]:
+            if a[0] == '-d' or a[0] == '--debug':
+                debug = True
+        for a in options[:]:
+            if a[0] == '-h' or a[0] == '--help':
+                usage()
+        for a in options[:]:
+            if a[0] == '--host':
+                host = a[1]
+            if a[0] == '--port':
+                port = validatePort(a[1])
+            if a[0] == '--socket':
+                socketName = a[1]
+            if a[0] == '-j' or a[0] == '--jobs':
+                maxJobs = skcc.validateJobs(a[1])
+            if a[0] == '--queue':
+                maxQueue = validateQueueSize(a[1])
+            if a[0] == '-s' or a[0] == '--quiet':
+                quiet = True
+            if a[0] == '--cache':
+                cacheDirName = a[1]
+            if a[0] == '--cache-size':
+                cacheSize = skcc.validateCacheSize(a[1])
+            if a[0] == '--output-dir':
+                if not os.path.isdir(a[1]):
+                    raise SKCCError('Output directory does not exist: ' + a[1])
+                outputDir = a[1]
+
+        diskCache = None
+        if cacheDirName:
+            diskCache = DiskCache(cacheDirName, cacheSize)
+        service = ClassificationService(maxJobs, maxQueue, diskCache, outputDir, quiet)
+        try:
+            server = makeServer(service, host, port, socketName, quiet)
+        except OSError as e:
+            raise SKCCError('Could not listen on ' + (socketName or (host + ':' + str(port))) + ': ' + str(e))
+        if not quiet:
+            print('Listening on ' + (socketName or ('http://' + host + ':' + str(server.server_address[1]))) + ' (Ctrl-C to stop).')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            service.shutdown()
+            if socketName and os.path.lexists(socketName) and stat.S_ISSOCK(os.lstat(socketName).st_mode):
+                os.remove(socketName)
+    except Exception as e:
+        # An error occurred.
+        if (debug):
+            # Output the error with stack trace if debug flag is on.
+            raise
+        else:
+            # Output the error without cluttering things up with the stack trace.
+            print('Error: ' + str(e))
+            sys.exit(1)
@@ -0,0 +1,228 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+# skccbench.py - Benchmarks of skcc.py throughput and memory use on synthetic worlds.
+# (c) 2020 Patrick Harvey [see LICENSE.txt]
+
+import sys, os, getopt, json, multiprocessing, tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from worldgen import writeWorld
+from skcc import buildOutput, tColorTableDefault, pColorTableDefault, defaultOceanColor, getDefaultOutputProfile
+from ioHandling.inputHandler import InputProfile
+from utils.profiling import StageProfiler
+
+defaultWidths = [1024, 2048, 4096, 8192, 16384]
+defaultModes = ['koppen', 'holdridge']
+defaultEngines = ['scalar', 'numpy', 'memo', 'table']
+
+# Widest map the scalar engine is benchmarked on unless told otherwise, as it takes several
+# microseconds per pixel (over ten minutes a case at 16384 wide).
+defaultScalarMaxWidth = 2048
+
+# Fraction by which a case may be slower (or use more memory) than the baseline before it is reported as a regression.
+defaultTolerance = 0.25
+
+def getTestDirPath(fname):
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), fname))
+
+def usage():
+    print('''skccbench.py : Benchmarks skcc.py on synthetic worlds
+  Options:
+    -h, --help                  : Displays this message
+    -w<list>, --widths=<list>   : Comma-separated map widths to benchmark (maps are half as tall).
+                                  Defaults to 1024,2048,4096,8192,16384.
+    -m<list>, --modes=<list>    : Comma-separated modes to benchmark. Defaults to koppen,holdridge.
+    -e<list>, --engines=<list>  : Comma-separated engines to benchmark. Defaults to scalar,numpy,memo,table.
+    --scalar-max-width=<n>      : Benchmarks the scalar engine only on maps up to <n> pixels wide, as it is very
+                                  slow on large maps. Defaults to 2048; 0 for no limit.
+    -n<n>, --repeat=<n>         : Runs each case <n> times and keeps the fastest. Defaults to 1.
+    --ocean=<fraction>          : Fraction of each synthetic world that is ocean. Defaults to 0.7.
+    --cache=<dir>               : Directory for the generated input images. Defaults to a temporary directory.
+    -b<fname>, --baseline=<fname> : Baseline results to compare against. Defaults to benchmark-baseline.json
+                                    in the test directory.
+    --save-baseline             : Saves the results as the new baseline instead of comparing against it.
+                                  Without a baseline to compare against, the benchmark fails.
+    -o<fname>, --output=<fname> : Also writes the results as JSON to '<fname>' (including those so far, if the
+                                  benchmark is interrupted).
+    -t<x>, --tolerance=<x>      : Fraction slower (or larger in memory) than the baseline that counts as a
+                                  regression. Defaults to 0.25. ''')
+    sys.exit(0)
+
+# Runs one benchmark case. Called in a fresh worker process per case, so that the
+# peak memory use measured is that of the case alone.
+def runCase(fileNames, mode, engine):
+    tempProfile = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProfile = InputProfile(pColorTableDefault, [defaultOceanColor])
+    profiler = StageProfiler()
+    buildOutput(fileNames[0], fileNames[1], fileNames[2], fileNames[3], tempProfile, precProfile,
+                getDefaultOutputProfile(mode), mode, engine, profiler=profiler)
+    return profiler.getReport()
+
+# Returns the key identifying a benchmark case in results and baselines.
+def getCaseKey(mode, engine, width, height):
+    return mode + '/' + engine + '/' + str(width) + 'x' + str(height)
+
+# Runs every combination of width, mode and engine (the scalar engine only up to scalarMaxWidth wide,
+# if given), adding the results to a dictionary by case key as each case finishes. A case whose worker
+# process fails (e.g. when it runs out of memory) is recorded as failed, with its error, and the
+# benchmark moves on to the next case.
+def runBenchmarks(widths, modes, engines, repeat, oceanFraction, cacheDir, results, scalarMaxWidth=None):
+    context = multiprocessing.get_context('spawn')
+    for width in widths:
+        height = width // 2
+        fileNames = writeWorld(cacheDir, width, height, 0, oceanFraction)
+        for mode in modes:
+            for engine in engines:
+                key = getCaseKey(mode, engine, width, height)
+                if (engine == 'scalar') and scalarMaxWidth and (width > scalarMaxWidth):
+                    print(key + ': skipped (see --scalar-max-width)')
+                    continue
+                best = None
+                try:
+                    for run in range(repeat):
+                        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                            report = executor.submit(runCase, fileNames, mode, engine).result()
+                        if (best is None) or (report['totalSeconds'] < best['totalSeconds']):
+                            best = report
+                except Exception as e:
+                    results[key] = {'failed': True, 'error': str(e) or type(e).__name__}
+                    print(key + ': failed: ' + results[key]['error'])
+                    continue
+                results[key] = {'seconds': best['totalSeconds'], 'pixelsPerSecond': best['pixelsPerSecond'],
+                                'peakRSSBytes': best['peakRSSBytes'], 'stages': best['stages']}
+                print(key + ': ' + format(best['pixelsPerSecond'] / 1e6, '.2f') + ' Mpx/s, ' +
+                      format(best['totalSeconds'], '.2f') + 's, peak ' + formatBytes(best['peakRSSBytes']))
+    return results
+
+# Returns the keys of the failed cases in a dictionary of results.
+def getFailedCases(results):
+    return [key for key, result in results.items() if result.get('failed')]
+
+def formatBytes(count):
+    if count is None:
+        return 'unknown'
+    return format(count / float(1 << 20), '.0f') + 'MiB'
+
+# Compares results against a baseline, returning a list of regression messages and a list of
+# the cases the baseline has no results for.
+def compareToBaseline(results, baseline, tolerance):
+    regressions = []
+    missing = []
+    for key, result in results.items():
+        if result.get('failed'):
+            continue
+        if not (key in baseline):
+            missing.append(key)
+            continue
+        base = baseline[key]
+        if result['pixelsPerSecond'] < (base['pixelsPerSecond'] * (1.0 - tolerance)):
+            regressions.append(key + ': throughput ' + format(result['pixelsPerSecond'] / 1e6, '.2f') + ' Mpx/s, baseline ' +
+                               format(base['pixelsPerSecond'] / 1e6, '.2f') + ' Mpx/s')
+        if not ((result['peakRSSBytes'] is None) or (base.get('peakRSSBytes') is None)) and \
+           (result['peakRSSBytes'] > (base['peakRSSBytes'] * (1.0 + tolerance))):
+            regressions.append(key + ': peak memory ' + formatBytes(result['peakRSSBytes']) + ', baseline ' + formatBytes(base['peakRSSBytes']))
+    return regressions, missing
+
+def readJSON(fname):
+    fp = open(fname, 'r')
+    try:
+        return json.load(fp)
+    finally:
+        fp.close()
+
+def writeJSON(fname, data):
+    fp = open(fname, 'w')
+    try:
+        json.dump(data, fp, indent=2, sort_keys=True)
+    finally:
+        fp.close()
+
+def parseList(text, convert=str):
+    return [convert(item.strip()) for item in text.split(',') if item.strip()]
+
+if __name__ == '__main__':
+    try:
+        options, xarguments = getopt.getopt(sys.argv[1:], 'hw:m:e:n:b:o:t:', ['help', 'widths=', 'modes=', 'engines=', 'repeat=', 'ocean=',
+                                                                          'cache=', 'baseline=', 'save-baseline', 'output=', 'tolerance=',
+                                                                          'scalar-max-width='])
+    except getopt.error:
+        print('Error: Bad arguments to benchmark script')
+        sys.exit(1)
+
+    widths = defaultWidths
+    modes = defaultModes
+    engines = defaultEngines
+    repeat = 1
+    oceanFraction = 0.7
+    cacheDir = os.path.join(tempfile.gettempdir(), 'skccbench')
+    baselineName = getTestDirPath('benchmark-baseline.json')
+    saveBaseline = False
+    outputName = ''
+    tolerance = defaultTolerance
+    scalarMaxWidth = defaultScalarMaxWidth
+    for a in options[:]:
+        if a[0] == '-h' or a[0] == '--help':
+            usage()
+        if a[0] == '-w' or a[0] == '--widths':
+            widths = parseList(a[1], int)
+        if a[0] == '-m' or a[0] == '--modes':
+            modes = parseList(a[1])
+        if a[0] == '-e' or a[0] == '--engines':
+            engines = parseList(a[1])
+        if a[0] == '-n' or a[0] == '--repeat':
+            repeat = max(1, int(a[1]))
+        if a[0] == '--ocean':
+            oceanFraction = float(a[1])
+        if a[0] == '--cache':
+            cacheDir = a[1]
+        if a[0] == '-b' or a[0] == '--baseline':
+            baselineName = a[1]
+        if a[0] == '--save-baseline':
+            saveBaseline = True
+        if a[0] == '-o' or a[0] == '--output':
+            outputName = a[1]
+        if a[0] == '-t' or a[0] == '--tolerance':
+            tolerance = float(a[1])
+        if a[0] == '--scalar-max-width':
+            scalarMaxWidth = int(a[1])
+
+    # Results so far are written out even if the benchmark is interrupted
+    results = {}
+    finished = False
+    try:
+        runBenchmarks(widths, modes, engines, repeat, oceanFraction, cacheDir, results, scalarMaxWidth)
+        finished = True
+    finally:
+        if outputName:
+            writeJSON(outputName, results)
+        if saveBaseline:
+            baseline = readJSON(baselineName) if os.path.exists(baselineName) else {}
+            baseline.update((key, result) for key, result in results.items() if not result.get('failed'))
+            writeJSON(baselineName, baseline)
+            print('Saved baseline to ' + baselineName + ('' if finished else ' (from the cases finished so far)'))
+
+    failed = getFailedCases(results)
+    if failed:
+        print('Failed cases: ' + ', '.join(failed))
+    if saveBaseline:
+        sys.exit(1 if failed else 0)
+    elif os.path.exists(baselineName):
+        regressions, missing = compareToBaseline(results, readJSON(baselineName), tolerance)
+        if missing:
+            print('Warning: The baseline has no results for ' + ', '.join(missing) + '; rerun with --save-baseline to add them.')
+        if regressions:
+            print('Regressions against baseline:')
+            for message in regressions:
+                print('  ' + message)
+            sys.exit(1)
+        print('No regressions against baseline.')
+        if failed:
+            sys.exit(1)
+    else:
+        # Baselines depend on the machine, so none is shipped; one has to be recorded before comparing
+        print('Error: No baseline found at ' + baselineName + ', so nothing was compared. Baselines are machine-specific: '
+              'run with --save-baseline on this machine to record one (or give one with --baseline), then rerun to compare.')
+        sys.exit(1)
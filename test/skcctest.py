@@ -4,15 +4,32 @@
 # skcctest.py - Script and tests for testing functionality of skcc.py.
 # (c) 2019 Patrick Harvey [see LICENSE.txt]
 
-import sys, os, getopt
+import sys, os, getopt, json, shutil, io, threading, urllib.request, urllib.error
+from PIL import Image
+import numpy as np
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from imgtest import ImgTest, compareImages, deleteFiles, runTests
-from skcc import outputToFile, buildOutput, tColorTableDefault, defaultOceanColor, pColorTableDefault, kColorTableDefault, readAndValidateKoppenOutputProfile, defaultUnknownColor, hColorTableDefault
+from skcc import outputToFile, buildOutput, buildOutputs, tColorTableDefault, defaultOceanColor, pColorTableDefault, kColorTableDefault, readAndValidateKoppenOutputProfile, defaultUnknownColor, hColorTableDefault, compileDecisionTable
 from ioHandling.inputHandler import readInputProfile, InputProfile
 from ioHandling.outputHandler import readOutputProfile, OutputProfile
 from utils.errors import SKCCError
+from skccbatch import readManifest, runBatch
+from correct_colors import correct_colors
+from utils.profiling import StageProfiler
+from utils.diskCache import DiskCache
+from skcc import readInputProfileCached, readAndValidateOutputProfileCached, compileDecisionTableCached, renderIncremental, incrementalStateSuffix
+from correct_colors import readInputProfile as readCorrectionColors
+from skccserver import ClassificationService, makeServer, jobFailedMessage
+from skcc import classifyMaps, classIdsToImage, getDefaultInputProfile, getDefaultOutputProfile, main, getLegendFileName, writeInputStack, maskValueRasters
+from skcc import cacheInputLayers, validateInputs, buildClassIdMaps, getParallelInputSource
+from utils.classStatistics import ClassStatistics
+from skcc import compareScenarios, getChangeMapImage, defaultUnchangedColor, getTransitionsFileName
+from ioHandling.rasterHandler import getNorthernMask
+from ioHandling.rasterHandler import openInputStack
+from concurrent.futures import ThreadPoolExecutor
+import classifiers.decisionTable as decisionTableModule
 
 def getTestDirPath(fname):
     return os.path.abspath(os.path.join(os.path.dirname(__file__), fname))
@@ -310,6 +327,1057 @@ def test14Clean():
     deleteFiles(dPaths)    
 
 
+def test15Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+
+    outputPath = getTestDirPath('test15-out.png')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+
+    comparePath = getTestDirPath('ProfiaOutputDefault.png')
+
+    outputToFile(outputPath, buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, engine='numpy'))
+
+    return compareImages(outputPath, comparePath)
+
+def test15Clean():
+    outputPath = getTestDirPath('test15-out.png')
+    dPaths = [outputPath]
+    deleteFiles(dPaths)
+
+def test16Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = readAndValidateKoppenOutputProfile(getParentDirPath('defaultOutputProfile'))
+
+    outputPath = getTestDirPath('test16-out.png')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getBoxesInputsSwappedPrecipitations()
+
+    comparePath = getTestDirPath('BoxesOutputSwapped.png')
+
+    outputToFile(outputPath, buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, engine='numpy'))
+
+    return compareImages(outputPath, comparePath)
+
+def test16Clean():
+    outputPath = getTestDirPath('test16-out.png')
+    dPaths = [outputPath]
+    deleteFiles(dPaths)
+
+def test17Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = readInputProfile(getParentDirPath('altPrecProfile'))
+    outProf = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+
+    outputPath = getTestDirPath('test17-out.png')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getBallInputs()
+
+    comparePath = getTestDirPath('BallOutput.png')
+
+    outputToFile(outputPath, buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, engine='numpy'))
+
+    return compareImages(outputPath, comparePath)
+
+def test17Clean():
+    outputPath = getTestDirPath('test17-out.png')
+    dPaths = [outputPath]
+    deleteFiles(dPaths)
+
+def test18Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputsBadPixel()
+
+    correctError = False
+    try:
+        buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, engine='numpy')
+    except SKCCError as e:
+        if (str(e) == 'Invalid color in input data (did not match input profile): (255, 0, 0)'):
+            correctError = True
+        else:
+            raise
+    return correctError
+
+def test18Clean():
+    pass
+
+def test19Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(hColorTableDefault, defaultOceanColor, defaultUnknownColor)
+
+    outputPath = getTestDirPath('test19-out.png')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+
+    comparePath = getTestDirPath('ProfiaHoldridgeOutput.png')
+
+    outputToFile(outputPath, buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, 'holdridge', 'numpy'))
+
+    return compareImages(outputPath, comparePath)
+
+def test19Clean():
+    outputPath = getTestDirPath('test19-out.png')
+    dPaths = [outputPath]
+    deleteFiles(dPaths)
+
+def test20Fn():
+    tempTable = dict(tColorTableDefault)
+    tempTable.pop((160, 0, 65))
+    tempTable.pop((50, 135, 190))
+    tempProf = InputProfile(tempTable, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+
+    correctError = False
+    try:
+        buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, engine='numpy')
+    except SKCCError as e:
+        if (str(e) == 'Invalid colors in input data (did not match input profile): (50, 135, 190), (160, 0, 65)'):
+            correctError = True
+        else:
+            raise
+    return correctError
+
+def test20Clean():
+    pass
+
+def test21Fn():
+    defaultProf = readInputProfile(getParentDirPath('altPrecProfile')).compile()
+    oceanProf = readInputProfile(getTestDirPath('testDefaultOceanTempProfile')).compile()
+    strictProf = InputProfile(tColorTableDefault, [defaultOceanColor]).compile()
+    rgbArray = np.array([[(220, 221, 247), (1, 2, 3), defaultOceanColor, (160, 0, 65)]], dtype=np.uint8)
+
+    values, ignored, unknown = defaultProf.lookup(rgbArray)
+    defaultCorrect = (values[0, 0] == 300) and (values[0, 1] == 17.5) and (list(ignored[0]) == [False, False, True, False]) and not unknown.any()
+    values, ignored, unknown = oceanProf.lookup(rgbArray)
+    oceanCorrect = (list(ignored[0]) == [True, True, True, False]) and (values[0, 3] == 38) and not unknown.any()
+    values, ignored, unknown = strictProf.lookup(rgbArray)
+    strictCorrect = (list(unknown[0]) == [True, True, False, False]) and (list(ignored[0]) == [False, False, True, False])
+    return defaultCorrect and oceanCorrect and strictCorrect
+
+def test21Clean():
+    pass
+
+def test22Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = readAndValidateKoppenOutputProfile(getParentDirPath('altOutputProfile'))
+
+    outputPath = getTestDirPath('test22-out.png')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+
+    comparePath = getTestDirPath('ProfiaOutputAlt.png')
+
+    outputToFile(outputPath, buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, engine='memo'))
+
+    return compareImages(outputPath, comparePath)
+
+def test22Clean():
+    outputPath = getTestDirPath('test22-out.png')
+    dPaths = [outputPath]
+    deleteFiles(dPaths)
+
+def test23Fn():
+    tempProf = readInputProfile(getTestDirPath('testDefaultOceanTempProfile'))
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+
+    outputPath = getTestDirPath('test23-out.png')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputsOceanDefault()
+
+    comparePath = getTestDirPath('ProfiaOutputDefault.png')
+
+    outputToFile(outputPath, buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, engine='memo'))
+
+    return compareImages(outputPath, comparePath)
+
+def test23Clean():
+    outputPath = getTestDirPath('test23-out.png')
+    dPaths = [outputPath]
+    deleteFiles(dPaths)
+
+def test24Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(hColorTableDefault, defaultOceanColor, defaultUnknownColor)
+
+    outputPath = getTestDirPath('test24-out.png')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+
+    comparePath = getTestDirPath('ProfiaHoldridgeOutput.png')
+
+    outputToFile(outputPath, buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, 'holdridge', 'memo'))
+
+    return compareImages(outputPath, comparePath)
+
+def test24Clean():
+    outputPath = getTestDirPath('test24-out.png')
+    dPaths = [outputPath]
+    deleteFiles(dPaths)
+
+def test25Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+    decisionTable = compileDecisionTable(tempProf, precProf, 'koppen')
+
+    outputPath = getTestDirPath('test25-out.png')
+    outputPath2 = getTestDirPath('test25-out2.png')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+    tempnsPath2, tempnwPath2, precnsPath2, precnwPath2 = getProfiaInputsPrecipOcean()
+
+    comparePath = getTestDirPath('ProfiaOutputDefault.png')
+    comparePath2 = getTestDirPath('ProfiaOutputPrecipOcean.png')
+
+    outputToFile(outputPath, buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, engine='table', decisionTable=decisionTable))
+    outputToFile(outputPath2, buildOutput(tempnsPath2, tempnwPath2, precnsPath2, precnwPath2, tempProf, precProf, outProf, engine='table', decisionTable=decisionTable))
+
+    return compareImages(outputPath, comparePath) and compareImages(outputPath2, comparePath2)
+
+def test25Clean():
+    outputPath = getTestDirPath('test25-out.png')
+    outputPath2 = getTestDirPath('test25-out2.png')
+    dPaths = [outputPath, outputPath2]
+    deleteFiles(dPaths)
+
+def test26Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(hColorTableDefault, defaultOceanColor, defaultUnknownColor)
+
+    outputPath = getTestDirPath('test26-out.png')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+
+    comparePath = getTestDirPath('ProfiaHoldridgeOutput.png')
+
+    outputToFile(outputPath, buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, 'holdridge', 'table'))
+
+    return compareImages(outputPath, comparePath)
+
+def test26Clean():
+    outputPath = getTestDirPath('test26-out.png')
+    dPaths = [outputPath]
+    deleteFiles(dPaths)
+
+def test27Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputsBadPixel()
+
+    correctError = False
+    try:
+        buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, engine='table')
+    except SKCCError as e:
+        if (str(e) == 'Invalid color in input data (did not match input profile): (255, 0, 0)'):
+            correctError = True
+        else:
+            raise
+    return correctError
+
+def test27Clean():
+    pass
+
+def test28Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = readAndValidateKoppenOutputProfile(getParentDirPath('defaultOutputProfile'))
+
+    outputPath = getTestDirPath('test28-out.png')
+    outputPath2 = getTestDirPath('test28-out2.png')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getBoxesInputs()
+
+    comparePath = getTestDirPath('BoxesOutputDefault.png')
+
+    # Strip heights that do not divide the map height, so one strip straddles the hemisphere split
+    outputToFile(outputPath, buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, engine='numpy', stripHeight=7))
+    outputToFile(outputPath2, buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, engine='table', stripHeight=45))
+
+    return compareImages(outputPath, comparePath) and compareImages(outputPath2, comparePath)
+
+def test28Clean():
+    outputPath = getTestDirPath('test28-out.png')
+    outputPath2 = getTestDirPath('test28-out2.png')
+    dPaths = [outputPath, outputPath2]
+    deleteFiles(dPaths)
+
+def test29Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+
+    outputPath = getTestDirPath('test29-out.png')
+    outputPath2 = getTestDirPath('test29-out2.png')
+    outputPath3 = getTestDirPath('test29-out3.png')
+    outputPath4 = getTestDirPath('test29-out4.png')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+
+    comparePath = getTestDirPath('ProfiaOutputDefault.png')
+
+    outputToFile(outputPath, buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, engine='numpy', jobs=2))
+    outputToFile(outputPath2, buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, engine='memo', stripHeight=13, jobs=3))
+
+    # From the command line, processing in strips or in parallel switches to the numpy engine unless another is given
+    main(['-u', tempnsPath, '-t', tempnwPath, '-q', precnsPath, '-p', precnwPath, '-o', outputPath3, '--strip=13', '-s'])
+    main(['-u', tempnsPath, '-t', tempnwPath, '-q', precnsPath, '-p', precnwPath, '-o', outputPath4, '-j', '2', '-s'])
+
+    # Workers memory-map stacks and cached layers themselves; other inputs are decoded once into shared memory
+    cacheDir = getTestDirPath('test29-cache')
+    stackPath = getTestDirPath('test29-stack.npy')
+    writeInputStack(stackPath, tempnsPath, tempnwPath, precnsPath, precnwPath)
+    expectedIds = classifyMaps(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf)[0]
+    inputArrays = [np.asarray(Image.open(fname).convert('RGB')) for fname in (tempnsPath, tempnwPath, precnsPath, precnwPath)]
+    inputMapSets = [openInputStack(stackPath), inputArrays]
+    for run in range(2):
+        inputMapSets.append(cacheInputLayers([tempnsPath, tempnwPath, precnsPath, precnwPath], tempProf, precProf, DiskCache(cacheDir)))
+    sourcesOk = [getParallelInputSource(img)[0] for img in inputMapSets[0] + inputMapSets[3]] == (['npy'] * 4) + (['indexed'] * 4) and \
+        all(getParallelInputSource(img) is None for img in inputArrays + inputMapSets[2])
+    idsOk = all(np.array_equal(buildClassIdMaps(*inputMaps, tempProf, precProf, ['koppen'], 'numpy', jobs=3)[0][0], expectedIds) for inputMaps in inputMapSets)
+
+    return compareImages(outputPath, comparePath) and compareImages(outputPath2, comparePath) and compareImages(outputPath3, comparePath) and \
+        compareImages(outputPath4, comparePath) and sourcesOk and idsOk
+
+def test29Clean():
+    outputPath = getTestDirPath('test29-out.png')
+    outputPath2 = getTestDirPath('test29-out2.png')
+    outputPath3 = getTestDirPath('test29-out3.png')
+    outputPath4 = getTestDirPath('test29-out4.png')
+    dPaths = [outputPath, outputPath2, outputPath3, outputPath4, getTestDirPath('test29-stack.npy')]
+    deleteFiles(dPaths)
+    shutil.rmtree(getTestDirPath('test29-cache'), ignore_errors=True)
+
+def test30Fn():
+    manifestPath = getTestDirPath('test30-manifest.json')
+    fp = open(manifestPath, 'w')
+    json.dump({'jobs': [{'tempns': 'ProfiaTempJul.png', 'tempnw': 'ProfiaTempJan.png', 'precns': 'ProfiaPrecJul.png', 'precnw': 'ProfiaPrecJan.png',
+                         'outfile': 'test30-out.png', 'engine': 'table'},
+                        {'tempns': 'ProfiaTempJul.png', 'tempnw': 'ProfiaTempJan.png', 'precns': 'ProfiaPrecJulBadPixel.png', 'precnw': 'ProfiaPrecJan.png',
+                         'outfile': 'test30-bad.png'},
+                        {'tempns': 'ProfiaTempJul.png', 'tempnw': 'ProfiaTempJan.png', 'precns': 'ProfiaPrecJul.png', 'precnw': 'ProfiaPrecJan.png',
+                         'outfile': 'test30-out2.png', 'mode': 'holdridge', 'strip': 20},
+                        {'tempns': 'ProfiaTempJul.png', 'tempnw': 'ProfiaTempJan.png', 'precns': 'ProfiaPrecJul.png', 'precnw': 'ProfiaPrecJan.png',
+                         'outfile': 'test30-out3.png', 'engine': 'scalar'},
+                        {'tempns': 'ProfiaTempJul.png', 'tempnw': 'ProfiaTempJan.png', 'precns': 'ProfiaPrecJulBadPixel.png', 'precnw': 'ProfiaPrecJan.png',
+                         'outfile': 'test30-bad2.png', 'engine': 'scalar'}]}, fp)
+    fp.close()
+
+    report = runBatch(readManifest(manifestPath), 2)
+
+    # The scalar jobs run in worker processes, and report in the same way
+    statusOk = [job['status'] for job in report['jobs']] == ['ok', 'error', 'ok', 'ok', 'error']
+    errorOk = report['jobs'][1]['error'] == report['jobs'][4]['error'] == 'Invalid color in input data (did not match input profile): (255, 0, 0)'
+    countsOk = (report['succeeded'] == 3) and (report['failed'] == 2)
+    return statusOk and errorOk and countsOk and not os.path.exists(getTestDirPath('test30-bad.png')) and \
+        not os.path.exists(getTestDirPath('test30-bad2.png')) and ('classify' in report['jobs'][3]['stages']) and \
+        compareImages(getTestDirPath('test30-out.png'), getTestDirPath('ProfiaOutputDefault.png')) and \
+        compareImages(getTestDirPath('test30-out2.png'), getTestDirPath('ProfiaHoldridgeOutput.png')) and \
+        compareImages(getTestDirPath('test30-out3.png'), getTestDirPath('ProfiaOutputDefault.png'))
+
+def test30Clean():
+    dPaths = [getTestDirPath('test30-manifest.json'), getTestDirPath('test30-out.png'), getTestDirPath('test30-out2.png'), getTestDirPath('test30-out3.png')]
+    deleteFiles(dPaths)
+
+def test31Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProfs = [readAndValidateKoppenOutputProfile(getParentDirPath('altOutputProfile')), OutputProfile(hColorTableDefault, defaultOceanColor, defaultUnknownColor)]
+
+    outputPaths = [getTestDirPath('test31-out1.png'), getTestDirPath('test31-out2.png'), getTestDirPath('test31-out3.png'), getTestDirPath('test31-out4.png')]
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+
+    comparePaths = [getTestDirPath('ProfiaOutputAlt.png'), getTestDirPath('ProfiaHoldridgeOutput.png')] * 2
+
+    outputImgs = buildOutputs(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProfs, ['koppen', 'holdridge'])
+    outputImgs += buildOutputs(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProfs, ['koppen', 'holdridge'], engine='numpy', stripHeight=17)
+    for outputPath, outputImg in zip(outputPaths, outputImgs):
+        outputToFile(outputPath, outputImg)
+
+    return (len(outputImgs) == 4) and all(compareImages(outputPath, comparePath) for outputPath, comparePath in zip(outputPaths, comparePaths))
+
+def test31Clean():
+    dPaths = [getTestDirPath('test31-out1.png'), getTestDirPath('test31-out2.png'), getTestDirPath('test31-out3.png'), getTestDirPath('test31-out4.png')]
+    deleteFiles(dPaths)
+
+def test32Fn():
+    colors = readCorrectionColors(getParentDirPath('defaultPrecProfile'))
+
+    outputPath = getTestDirPath('test32-out.png')
+
+    comparePath = getTestDirPath('ProfiaPrecJul.png')
+
+    outputImg, snappedCount, fixedCount = correct_colors(Image.open(getTestDirPath('ProfiaPrecJulBadPixel.png')), colors, 'x')
+    outputToFile(outputPath, outputImg)
+
+    return (snappedCount == 0) and (fixedCount == 1) and np.array_equal(np.asarray(Image.open(outputPath).convert('RGB')), np.asarray(Image.open(comparePath).convert('RGB')))
+
+def test32Clean():
+    outputPath = getTestDirPath('test32-out.png')
+    dPaths = [outputPath]
+    deleteFiles(dPaths)
+
+def test33Fn():
+    colors = readCorrectionColors(getParentDirPath('defaultPrecProfile'))
+
+    # Shift every land pixel's color slightly, as if by lossy compression
+    original = np.array(Image.open(getTestDirPath('ProfiaPrecJul.png')).convert('RGBA'))
+    drifted = original.copy()
+    land = np.any(original[:, :, 0:3] != np.array(defaultOceanColor, dtype=np.uint8), axis=2)
+    drifted[land, 0] = np.where(drifted[land, 0] > 127, drifted[land, 0] - 3, drifted[land, 0] + 3)
+    drifted[:, :, 3] = 200
+
+    outputImg, snappedCount, fixedCount = correct_colors(Image.fromarray(drifted, 'RGBA'), colors, 'x', 'palette')
+    outputImg2, snappedCount2, fixedCount2 = correct_colors(Image.fromarray(drifted, 'RGBA'), colors, 'x', 'both', 2.0)
+
+    output = np.asarray(outputImg)
+    output2 = np.asarray(outputImg2)
+    snapOk = (snappedCount == land.sum()) and (fixedCount == 0) and np.array_equal(output[:, :, 0:3], original[:, :, 0:3]) and (output[:, :, 3] == 200).all()
+    bothOk = (snappedCount2 == 0) and (fixedCount2 == land.sum()) and (outputImg2.mode == 'RGBA')
+    return snapOk and bothOk
+
+def test33Clean():
+    pass
+
+def test34Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+
+    outputPath = getTestDirPath('test34-out.png')
+    reportPath = getTestDirPath('test34-profile.json')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+
+    comparePath = getTestDirPath('ProfiaOutputDefault.png')
+
+    scalarProfiler = StageProfiler()
+    buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, profiler=scalarProfiler)
+    arrayProfiler = StageProfiler()
+    outputImg = buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, engine='numpy', stripHeight=50, profiler=arrayProfiler)
+    with arrayProfiler.stage('encode'):
+        outputToFile(outputPath, outputImg)
+    arrayProfiler.writeReport(reportPath)
+
+    fp = open(reportPath, 'r')
+    report = json.load(fp)
+    fp.close()
+
+    # The scalar conversion is timed as the pixels are classified, without counting it twice
+    scalarTimes = scalarProfiler.getStageTimes()
+    scalarOk = (list(scalarTimes.keys()) == ['decode', 'rgbConversion', 'classify', 'putdata']) and (scalarTimes['rgbConversion'] > 0) and \
+        all(seconds > 0 for seconds in scalarTimes.values()) and (sum(scalarTimes.values()) <= scalarProfiler.getReport()['totalSeconds'])
+    arrayOk = list(report['stages'].keys()) == ['decode', 'lookup', 'classify', 'putdata', 'encode']
+    pixelsOk = (scalarProfiler.pixels == outputImg.size[0] * outputImg.size[1]) and (report['pixels'] == scalarProfiler.pixels) and (report['pixelsPerSecond'] > 0)
+    return scalarOk and arrayOk and pixelsOk and compareImages(outputPath, comparePath)
+
+def test34Clean():
+    dPaths = [getTestDirPath('test34-out.png'), getTestDirPath('test34-profile.json')]
+    deleteFiles(dPaths)
+
+def test35Fn():
+    cacheDir = getTestDirPath('test35-cache')
+    cache = DiskCache(cacheDir)
+    outputPath = getTestDirPath('test35-out.png')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+
+    comparePath = getTestDirPath('ProfiaOutputAlt.png')
+
+    # The first pass fills the cache and the second is served from it
+    for attempt in range(2):
+        tempProf = readInputProfileCached(getParentDirPath('defaultTempProfile'), cache)
+        precProf = readInputProfileCached(getParentDirPath('defaultPrecProfile'), cache)
+        outProf = readAndValidateOutputProfileCached(getParentDirPath('altOutputProfile'), 'koppen', cache)
+        table = compileDecisionTableCached(tempProf, precProf, 'koppen', cache)
+        cachedCount = len(os.listdir(cacheDir))
+        outputToFile(outputPath, buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, outProf, engine='table', decisionTable=table))
+        if (cachedCount != 4) or (tempProf.compiledProfile is None) or not compareImages(outputPath, comparePath):
+            return False
+
+    # A damaged entry is rebuilt, and shrinking the size bound evicts entries
+    entryName = sorted(os.listdir(cacheDir))[0]
+    fp = open(os.path.join(cacheDir, entryName), 'wb')
+    fp.write(b'damaged')
+    fp.close()
+    tempProf = readInputProfileCached(getParentDirPath('defaultTempProfile'), cache)
+    precProf = readInputProfileCached(getParentDirPath('defaultPrecProfile'), cache)
+    outProf = readAndValidateOutputProfileCached(getParentDirPath('altOutputProfile'), 'koppen', cache)
+    table = compileDecisionTableCached(tempProf, precProf, 'koppen', cache)
+    rebuiltOk = (len(os.listdir(cacheDir)) == 4) and (os.path.getsize(os.path.join(cacheDir, entryName)) > len(b'damaged'))
+    smallCache = DiskCache(cacheDir, 1)
+    smallCache.evict()
+    return rebuiltOk and (len(os.listdir(cacheDir)) == 0)
+
+def test35Clean():
+    outputPath = getTestDirPath('test35-out.png')
+    dPaths = [outputPath]
+    deleteFiles(dPaths)
+    shutil.rmtree(getTestDirPath('test35-cache'), ignore_errors=True)
+
+def test36Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+
+    outputPath = getTestDirPath('test36-out.png')
+    comparePath = getTestDirPath('test36-compare.png')
+    precnsCopyPath = getTestDirPath('test36-precns.png')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+    shutil.copyfile(precnsPath, precnsCopyPath)
+
+    # The first render classifies every tile, and rendering again with unchanged inputs classifies none
+    counts = [renderIncremental(tempnsPath, tempnwPath, precnsCopyPath, precnwPath, tempProf, precProf, [outProf], ['koppen'], [outputPath], 'numpy', tileSize=32)
+              for attempt in range(2)]
+    if (counts != [(32, 32), (0, 32)]) or not compareImages(outputPath, getTestDirPath('ProfiaOutputDefault.png')):
+        return False
+
+    # Changing one land pixel reclassifies only its tile, giving the same map as a full render
+    precArray = np.array(Image.open(precnsCopyPath).convert('RGB'))
+    rows, cols = np.nonzero(np.any(precArray != defaultOceanColor, axis=2))
+    row, col = rows[len(rows) // 2], cols[len(cols) // 2]
+    precColors = sorted(pColorTableDefault.keys())
+    precArray[row, col] = [color for color in precColors if color != tuple(precArray[row, col])][0]
+    Image.fromarray(precArray, 'RGB').save(precnsCopyPath)
+    count = renderIncremental(tempnsPath, tempnwPath, precnsCopyPath, precnwPath, tempProf, precProf, [outProf], ['koppen'], [outputPath], 'numpy', tileSize=32)
+    outputToFile(comparePath, buildOutput(tempnsPath, tempnwPath, precnsCopyPath, precnwPath, tempProf, precProf, outProf))
+    if (count != (1, 32)) or not compareImages(outputPath, comparePath):
+        return False
+
+    # Touching an input without changing it rehashes its tiles but reclassifies none
+    os.utime(precnsCopyPath, ns=(os.stat(precnsCopyPath).st_atime_ns, os.stat(precnsCopyPath).st_mtime_ns + 1000000000))
+    count = renderIncremental(tempnsPath, tempnwPath, precnsCopyPath, precnwPath, tempProf, precProf, [outProf], ['koppen'], [outputPath], 'numpy', tileSize=32)
+    if (count != (0, 32)) or not compareImages(outputPath, comparePath):
+        return False
+
+    # A state file that is damaged or from another version is ignored, rendering everything again
+    for state in ({'settings': 'unknown'}, {'version': 1, 'tiles': []}, [1, 2, 3]):
+        fp = open(outputPath + incrementalStateSuffix, 'w')
+        json.dump(state, fp)
+        fp.close()
+        count = renderIncremental(tempnsPath, tempnwPath, precnsCopyPath, precnwPath, tempProf, precProf, [outProf], ['koppen'], [outputPath], 'numpy', tileSize=32)
+        if (count != (32, 32)) or not compareImages(outputPath, comparePath):
+            return False
+
+    # Strips and parallel jobs do not apply to incremental rendering, so are refused
+    try:
+        main(['-u', tempnsPath, '-t', tempnwPath, '-q', precnsCopyPath, '-p', precnwPath, '-o', outputPath, '--incremental', '--strip=16', '-s', '-d'])
+        return False
+    except SKCCError:
+        pass
+
+    # A different output profile invalidates the previous output
+    altProf = readAndValidateKoppenOutputProfile(getParentDirPath('altOutputProfile'))
+    return renderIncremental(tempnsPath, tempnwPath, precnsCopyPath, precnwPath, tempProf, precProf, [altProf], ['koppen'], [outputPath], 'memo', tileSize=32) == (32, 32)
+
+def test36Clean():
+    outputPath = getTestDirPath('test36-out.png')
+    dPaths = [outputPath, outputPath + incrementalStateSuffix, getTestDirPath('test36-compare.png'), getTestDirPath('test36-precns.png')]
+    deleteFiles(dPaths)
+
+def test37Fn():
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+    outputPath = getTestDirPath('test37-out.png')
+    job = {'tempns': tempnsPath, 'tempnw': tempnwPath, 'precns': precnsPath, 'precnw': precnwPath}
+
+    service = ClassificationService(2, outputDir=getTestDirPath('.'))
+    server = makeServer(service, port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    baseURL = 'http://127.0.0.1:' + str(server.server_address[1])
+
+    def post(data, headers={'Content-Type': 'application/json'}):
+        request = urllib.request.Request(baseURL + '/classify', json.dumps(data).encode('utf-8'), headers)
+        try:
+            response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read().decode('utf-8'))
+        return response.status, response.read()
+
+    try:
+        health = json.loads(urllib.request.urlopen(baseURL + '/health').read().decode('utf-8'))
+        # Scalar jobs run in worker processes
+        code, pngData = post(dict(job, engine='scalar'))
+        Image.open(io.BytesIO(pngData)).save(outputPath)
+        bytesOk = (code == 200) and compareImages(outputPath, getTestDirPath('ProfiaOutputDefault.png'))
+        holdridgeJob = dict(job, mode='holdridge', engine='table', outfile='test37-out.png')
+        code, body = post(holdridgeJob)
+        fileOk = (code == 200) and (json.loads(body.decode('utf-8'))['status'] == 'ok') and \
+            compareImages(outputPath, getTestDirPath('ProfiaHoldridgeOutput.png'))
+        code, body = post(dict(job, precns=getTestDirPath('ProfiaPrecJulBadPixel.png')))
+        errorOk = (code == 400) and (body['error'] == jobFailedMessage)
+        # Only errors in the job itself are returned; others (which can quote the server's files) are not
+        code, body = post(dict(job, tempprof=os.path.abspath(__file__)))
+        errorOk = errorOk and (code == 400) and (body['error'] == jobFailedMessage)
+        code, body = post(dict(job, engine='scalar', precns=getTestDirPath('ProfiaPrecJulBadPixel.png')))
+        errorOk = errorOk and (code == 400) and (body['error'] == jobFailedMessage)
+        code, body = post(dict(job, mode='bogus'))
+        errorOk = errorOk and (code == 400) and (body['error'] == 'Invalid mode specified: bogus')
+
+        # Output files outside the output directory, and requests that web pages could send, are refused
+        code, body = post(dict(job, outfile=os.path.join('..', 'test37-escaped.png')))
+        refusedOk = (code == 400) and not os.path.exists(getParentDirPath('test37-escaped.png'))
+        code, body = post(job, {'Content-Type': 'text/plain'})
+        refusedOk = refusedOk and (code == 415)
+        code, body = post(job, {'Content-Type': 'application/json', 'Origin': 'http://example.com'})
+        refusedOk = refusedOk and (code == 403)
+        code, body = post(job, {'Content-Type': 'application/json', 'Host': 'example.com:' + str(server.server_address[1])})
+        refusedOk = refusedOk and (code == 403)
+        metrics = json.loads(urllib.request.urlopen(baseURL + '/metrics').read().decode('utf-8'))
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.shutdown()
+        thread.join()
+    metricsOk = (metrics['received'] == 7) and (metrics['succeeded'] == 2) and (metrics['failed'] == 5) and (metrics['running'] == 0)
+
+    # Only a socket is replaced when listening on a Unix socket
+    socketRefused = False
+    try:
+        makeServer(service, socketName=outputPath)
+    except SKCCError:
+        socketRefused = os.path.exists(outputPath)
+    return (health['status'] == 'ok') and bytesOk and fileOk and errorOk and refusedOk and metricsOk and socketRefused
+
+def test37Clean():
+    outputPath = getTestDirPath('test37-out.png')
+    dPaths = [outputPath]
+    deleteFiles(dPaths)
+
+def test38Fn():
+    outputPath = getTestDirPath('test38-out.png')
+    outputPath2 = getTestDirPath('test38-out2.png')
+    outputPath3 = getTestDirPath('test38-out3.png')
+    comparePath = getTestDirPath('ProfiaOutputDefault.png')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+    images = [Image.open(fname).convert('RGB') for fname in (tempnsPath, tempnwPath, precnsPath, precnwPath)]
+    arrays = [np.array(img) for img in images]
+
+    # Changing a default profile does not change the defaults used by later calls
+    changedProf = getDefaultOutputProfile('koppen')
+    changedProf.colorTable['Af'] = (1, 2, 3)
+    getDefaultInputProfile('temp').colorTable.clear()
+    defaultsOk = (kColorTableDefault['Af'] != (1, 2, 3)) and (len(tColorTableDefault) > 0)
+
+    # Arrays are classified from several threads at once with shared profiles
+    tempProf = getDefaultInputProfile('temp')
+    precProf = getDefaultInputProfile('prec')
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda engine: classifyMaps(arrays[0], arrays[1], arrays[2], arrays[3], tempProf, precProf, engine=engine),
+                                    ['numpy', 'memo', 'table', 'numpy']))
+    classIds, classNames = results[0]
+    threadsOk = all(np.array_equal(ids, classIds) and (names == classNames) for ids, names in results[1:])
+    outputToFile(outputPath, classIdsToImage(classIds, classNames, getDefaultOutputProfile('koppen')))
+
+    # PIL images work with any engine, and the command line can be run in-process
+    outputToFile(outputPath2, buildOutput(images[0], images[1], images[2], images[3], tempProf, precProf, getDefaultOutputProfile('koppen')))
+    main(['-u', tempnsPath, '-t', tempnwPath, '-q', precnsPath, '-p', precnwPath, '-o', outputPath3, '-s'])
+    return defaultsOk and threadsOk and compareImages(outputPath, comparePath) and compareImages(outputPath2, comparePath) and \
+        compareImages(outputPath3, comparePath)
+
+def test38Clean():
+    dPaths = [getTestDirPath('test38-out.png'), getTestDirPath('test38-out2.png'), getTestDirPath('test38-out3.png')]
+    deleteFiles(dPaths)
+
+def test39Fn():
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+    palettePath = getTestDirPath('test39-out.png')
+    classesPath = getTestDirPath('test39-out.npy')
+    classesPath2 = getTestDirPath('test39-out2.tif')
+    inputArgs = ['-u', tempnsPath, '-t', tempnwPath, '-q', precnsPath, '-p', precnwPath, '-s']
+
+    main(inputArgs + ['-o', palettePath, '--format=palette', '-e', 'table'])
+    paletteImg = Image.open(palettePath)
+    paletteOk = (paletteImg.mode == 'P') and np.array_equal(np.array(paletteImg.convert('RGB')),
+                                                            np.array(Image.open(getTestDirPath('ProfiaOutputDefault.png')).convert('RGB')))
+
+    # Coloring the class ids by the legend gives the same map as the RGB output
+    main(inputArgs + ['-m', 'holdridge', '-o', classesPath, '-m', 'koppen', '-o', classesPath2, '--format=classes', '-j', '2'])
+    classesOk = True
+    for path, comparePath in ((classesPath, 'ProfiaHoldridgeOutput.png'), (classesPath2, 'ProfiaOutputDefault.png')):
+        classIds = np.load(path) if path.endswith('.npy') else np.array(Image.open(path))
+        fp = open(getLegendFileName(path), 'r')
+        legend = json.load(fp)
+        fp.close()
+        colors = np.array([entry['color'] for entry in legend['classes']], dtype=np.uint8)
+        classesOk = classesOk and (classIds.dtype == np.uint8) and \
+            np.array_equal(colors[classIds], np.array(Image.open(getTestDirPath(comparePath)).convert('RGB')))
+    return paletteOk and classesOk
+
+def test39Clean():
+    dPaths = [getTestDirPath('test39-out.png'), getTestDirPath('test39-out.npy'), getTestDirPath('test39-out.legend.json'),
+              getTestDirPath('test39-out2.tif'), getTestDirPath('test39-out2.legend.json')]
+    deleteFiles(dPaths)
+
+def test40Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+
+    stackPath = getTestDirPath('test40-stack.npy')
+    layerPaths = [getTestDirPath('test40-layer' + str(idx) + '.npy') for idx in range(4)]
+    outputPath = getTestDirPath('test40-out.png')
+    outputPath2 = getTestDirPath('test40-out2.png')
+    outputPath3 = getTestDirPath('test40-out3.png')
+    comparePath = getTestDirPath('ProfiaOutputDefault.png')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+
+    # A stack file is read memory-mapped and classified in strips, in this process or in workers
+    writeInputStack(stackPath, tempnsPath, tempnwPath, precnsPath, precnwPath, stripHeight=50)
+    layers = openInputStack(stackPath)
+    mappedOk = all(isinstance(layer, np.memmap) for layer in layers)
+    outputToFile(outputPath, buildOutput(layers[0], layers[1], layers[2], layers[3], tempProf, precProf, outProf, engine='numpy', stripHeight=30))
+    main(['--stack=' + stackPath, '-o', outputPath2, '-e', 'table', '-j', '2', '-s'])
+    del layers
+
+    # Separate .npy files of RGBA pixels work with any engine
+    for layerPath, inputPath in zip(layerPaths, (tempnsPath, tempnwPath, precnsPath, precnwPath)):
+        np.save(layerPath, np.array(Image.open(inputPath).convert('RGBA')))
+    outputToFile(outputPath3, buildOutput(layerPaths[0], layerPaths[1], layerPaths[2], layerPaths[3], tempProf, precProf, outProf))
+    return mappedOk and compareImages(outputPath, comparePath) and compareImages(outputPath2, comparePath) and compareImages(outputPath3, comparePath)
+
+def test40Clean():
+    dPaths = [getTestDirPath('test40-stack.npy'), getTestDirPath('test40-out.png'), getTestDirPath('test40-out2.png'), getTestDirPath('test40-out3.png')]
+    dPaths.extend(getTestDirPath('test40-layer' + str(idx) + '.npy') for idx in range(4))
+    deleteFiles(dPaths)
+
+def test41Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+    valuePaths = [getTestDirPath('test41-tempns.tif'), getTestDirPath('test41-tempnw.npy'), getTestDirPath('test41-precns.npy'), getTestDirPath('test41-precnw.npy')]
+    maskPath = getTestDirPath('test41-mask.png')
+    stackPath = getTestDirPath('test41-stack.npy')
+    outputPaths = [getTestDirPath('test41-out' + str(idx) + '.png') for idx in range(4)]
+    comparePath = getTestDirPath('ProfiaOutputDefault.png')
+
+    # Convert the color inputs to value rasters through the input profiles, with ocean as NaN
+    # in the temperatures and given by a mask for the precipitations
+    oceanMask = None
+    for inputPath, valuePath, profile in zip((tempnsPath, tempnwPath, precnsPath, precnwPath), valuePaths, (tempProf, tempProf, precProf, precProf)):
+        values, ignored, unknown = profile.compile().lookup(np.array(Image.open(inputPath).convert('RGB')))
+        oceanMask = ignored if (oceanMask is None) else (oceanMask | ignored)
+        if (profile is tempProf):
+            values[ignored] = np.nan
+        if valuePath.endswith('.tif'):
+            Image.fromarray(values.astype(np.float32), 'F').save(valuePath)
+        else:
+            np.save(valuePath, values)
+    Image.fromarray(oceanMask.astype(np.uint8) * 255, 'L').save(maskPath)
+
+    maskedMaps = maskValueRasters(valuePaths, maskPath)
+    outputToFile(outputPaths[0], buildOutput(maskedMaps[0], maskedMaps[1], maskedMaps[2], maskedMaps[3], tempProf, precProf, outProf, engine='numpy', stripHeight=40))
+    outputToFile(outputPaths[1], buildOutput(maskedMaps[0], maskedMaps[1], maskedMaps[2], maskedMaps[3], tempProf, precProf, outProf, engine='memo', jobs=2))
+    main(['-u', valuePaths[0], '-t', valuePaths[1], '-q', valuePaths[2], '-p', valuePaths[3], '--mask=' + maskPath, '-o', outputPaths[2], '-e', 'numpy', '-s'])
+
+    # A stack of value rasters keeps ignored pixels as NaN
+    writeInputStack(stackPath, maskedMaps[0], maskedMaps[1], maskedMaps[2], maskedMaps[3])
+    main(['--stack=' + stackPath, '-o', outputPaths[3], '-e', 'table', '-s'])
+
+    # The per-pixel engine cannot use value rasters
+    try:
+        buildOutput(valuePaths[0], valuePaths[1], valuePaths[2], valuePaths[3], tempProf, precProf, outProf)
+        return False
+    except SKCCError as e:
+        if (str(e) != 'Value raster inputs require one of the array-based engines.'):
+            return False
+    return all(compareImages(outputPath, comparePath) for outputPath in outputPaths)
+
+def test41Clean():
+    dPaths = [getTestDirPath('test41-tempns.tif'), getTestDirPath('test41-tempnw.npy'), getTestDirPath('test41-precns.npy'), getTestDirPath('test41-precnw.npy'),
+              getTestDirPath('test41-mask.png'), getTestDirPath('test41-stack.npy')]
+    dPaths.extend(getTestDirPath('test41-out' + str(idx) + '.png') for idx in range(4))
+    deleteFiles(dPaths)
+
+# Saves a copy of an image as an indexed-color (mode 'P') image with the same colors.
+def saveAsIndexedColor(inputPath, outputPath):
+    rgbArray = np.array(Image.open(inputPath).convert('RGB'))
+    colors, indices = np.unique(rgbArray.reshape(-1, 3), axis=0, return_inverse=True)
+    img = Image.fromarray(indices.reshape(rgbArray.shape[0:2]).astype(np.uint8), 'P')
+    img.putpalette(colors.ravel().tolist())
+    img.save(outputPath)
+
+def test42Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+
+    inputPaths = list(getProfiaInputs()) + [getTestDirPath('ProfiaPrecJulBadPixel.png')]
+    indexedPaths = [getTestDirPath('test42-in' + str(idx) + '.png') for idx in range(5)]
+    outputPaths = [getTestDirPath('test42-out' + str(idx) + '.png') for idx in range(4)]
+    comparePath = getTestDirPath('ProfiaOutputDefault.png')
+    for inputPath, indexedPath in zip(inputPaths, indexedPaths):
+        saveAsIndexedColor(inputPath, indexedPath)
+    if (Image.open(indexedPaths[0]).mode != 'P'):
+        return False
+
+    outputToFile(outputPaths[0], buildOutput(indexedPaths[0], indexedPaths[1], indexedPaths[2], indexedPaths[3], tempProf, precProf, outProf))
+    outputToFile(outputPaths[1], buildOutput(indexedPaths[0], indexedPaths[1], indexedPaths[2], indexedPaths[3], tempProf, precProf, outProf, engine='numpy', stripHeight=50))
+    outputToFile(outputPaths[2], buildOutput(indexedPaths[0], indexedPaths[1], indexedPaths[2], indexedPaths[3], tempProf, precProf, outProf, engine='memo'))
+    outputToFile(outputPaths[3], buildOutput(indexedPaths[0], indexedPaths[1], indexedPaths[2], indexedPaths[3], tempProf, precProf, outProf, engine='table', jobs=2))
+
+    # Unmatched palette colors are reported as for RGB images
+    errorsOk = True
+    for engine in ('numpy', 'memo', 'table'):
+        try:
+            buildOutput(indexedPaths[0], indexedPaths[1], indexedPaths[4], indexedPaths[3], tempProf, precProf, outProf, engine=engine)
+            errorsOk = False
+        except SKCCError as e:
+            errorsOk = errorsOk and (str(e) == 'Invalid color in input data (did not match input profile): (255, 0, 0)')
+    return errorsOk and all(compareImages(outputPath, comparePath) for outputPath in outputPaths)
+
+def test42Clean():
+    dPaths = [getTestDirPath('test42-in' + str(idx) + '.png') for idx in range(5)]
+    dPaths.extend(getTestDirPath('test42-out' + str(idx) + '.png') for idx in range(4))
+    deleteFiles(dPaths)
+
+# Returns the number of cached input layers in a cache directory (each stored as its indices and palette).
+def countLayerEntries(cacheDir):
+    return len([name for name in os.listdir(cacheDir) if name.endswith('.npy')]) // 2
+
+def test43Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+
+    cacheDir = getTestDirPath('test43-cache')
+    cache = DiskCache(cacheDir)
+    outputPaths = [getTestDirPath('test43-out' + str(idx) + '.png') for idx in range(3)]
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+    badPrecPath = getTestDirPath('ProfiaPrecJulBadPixel.png')
+
+    # The first run fills the cache with one layer per input, and later runs (in another mode) read them back
+    main(['-u', tempnsPath, '-t', tempnwPath, '-q', precnsPath, '-p', precnwPath, '-o', outputPaths[0], '-e', 'numpy', '--cache=' + cacheDir, '--cache-layers', '-s'])
+    if (countLayerEntries(cacheDir) != 4):
+        return False
+    main(['-u', tempnsPath, '-t', tempnwPath, '-q', precnsPath, '-p', precnwPath, '-o', outputPaths[1], '-e', 'table', '-m', 'holdridge', '--cache=' + cacheDir, '--cache-layers', '-s'])
+    cachedMaps = cacheInputLayers([tempnsPath, tempnwPath, precnsPath, precnwPath], tempProf, precProf, cache)
+    if not all(isinstance(layer.indices, np.memmap) and (layer.indices.dtype == np.uint8) for layer in cachedMaps) or (countLayerEntries(cacheDir) != 4):
+        return False
+    outputToFile(outputPaths[2], buildOutput(cachedMaps[0], cachedMaps[1], cachedMaps[2], cachedMaps[3], tempProf, precProf, outProf, engine='memo', jobs=2))
+
+    # Layers keep colors missing from the profile, so the error is reported as usual
+    errorOk = False
+    try:
+        cachedMaps = cacheInputLayers([tempnsPath, tempnwPath, badPrecPath, precnwPath], tempProf, precProf, cache)
+        buildOutput(cachedMaps[0], cachedMaps[1], cachedMaps[2], cachedMaps[3], tempProf, precProf, outProf, engine='numpy')
+    except SKCCError as e:
+        errorOk = (str(e) == 'Invalid color in input data (did not match input profile): (255, 0, 0)') and (countLayerEntries(cacheDir) == 5)
+
+    # The layers of one run stay cached together even if they fill the cache, and a layer larger
+    # than the whole cache is not cached
+    shutil.rmtree(cacheDir)
+    cacheInputLayers([tempnsPath, tempnwPath, precnsPath, precnwPath], tempProf, precProf, DiskCache(cacheDir, 40000))
+    keptOk = countLayerEntries(cacheDir) == 4
+    shutil.rmtree(cacheDir)
+    cachedMaps = cacheInputLayers([tempnsPath, tempnwPath, precnsPath, precnwPath], tempProf, precProf, DiskCache(cacheDir, 1000))
+    outputToFile(outputPaths[2], buildOutput(cachedMaps[0], cachedMaps[1], cachedMaps[2], cachedMaps[3], tempProf, precProf, outProf, engine='numpy'))
+    skippedOk = not os.path.exists(cacheDir) or (countLayerEntries(cacheDir) == 0)
+    return errorOk and keptOk and skippedOk and compareImages(outputPaths[0], getTestDirPath('ProfiaOutputDefault.png')) and \
+        compareImages(outputPaths[1], getTestDirPath('ProfiaHoldridgeOutput.png')) and compareImages(outputPaths[2], getTestDirPath('ProfiaOutputDefault.png'))
+
+def test43Clean():
+    dPaths = [getTestDirPath('test43-out' + str(idx) + '.png') for idx in range(3)]
+    deleteFiles(dPaths)
+    shutil.rmtree(getTestDirPath('test43-cache'), ignore_errors=True)
+
+def test44Fn():
+    tempTable = dict(tColorTableDefault)
+    tempTable.pop((160, 0, 65))
+    tempTable.pop((50, 135, 190))
+    tempProf = InputProfile(tempTable, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+    reportPath = getTestDirPath('test44-report.json')
+    highlightPath = getTestDirPath('test44-highlight.png')
+    croppedPath = getTestDirPath('test44-cropped.png')
+    outputPath = getTestDirPath('test44-out.png')
+
+    # Every pixel of each unmatched color is counted, whether the map is checked whole or in strips
+    report, highlightMask = validateInputs(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, highlight=True)
+    if (validateInputs(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, stripHeight=7) != report) or report['valid']:
+        return False
+    rgbArrays = [np.asarray(Image.open(path).convert('RGB')) for path in (tempnsPath, tempnwPath, precnsPath, precnwPath)]
+    land = np.all([np.any(rgbArray != defaultOceanColor, axis=2) for rgbArray in rgbArrays], axis=0)
+    expectedMask = np.zeros(land.shape, dtype=bool)
+    reportedColors = [set(tuple(colorReport['color']) for colorReport in layerReport['unknownColors']) for layerReport in report['inputs']]
+    if ((reportedColors[0] | reportedColors[1]) != {(50, 135, 190), (160, 0, 65)}) or reportedColors[2] or reportedColors[3]:
+        return False
+    for rgbArray, layerReport in zip(rgbArrays, report['inputs']):
+        for colorReport in layerReport['unknownColors']:
+            ys, xs = np.nonzero(np.all(rgbArray == colorReport['color'], axis=2) & land)
+            expectedMask[ys, xs] = True
+            if (colorReport['count'] != len(ys)) or (colorReport['pixels'][0] != [int(xs[0]), int(ys[0])]) or \
+               (colorReport['boundingBox'] != [int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1]):
+                return False
+    if not np.array_equal(highlightMask, expectedMask):
+        return False
+
+    # From the command line, a failed check stops the run before any output is written
+    main(['-u', tempnsPath, '-t', tempnwPath, '-q', getTestDirPath('ProfiaPrecJulBadPixel.png'), '-p', precnwPath, '-o', outputPath,
+          '--report=' + reportPath, '--highlight=' + highlightPath, '-s'])
+    fp = open(reportPath, 'r')
+    cliReport = json.load(fp)
+    fp.close()
+    highlightPixels = np.argwhere(np.asarray(Image.open(highlightPath)))
+    if os.path.exists(outputPath) or (cliReport['inputs'][2]['unknownColors'][0]['pixels'] != [[152, 41]]) or (highlightPixels.tolist() != [[41, 152]]):
+        return False
+
+    # Inputs of different sizes are reported rather than cut down to the smallest
+    Image.open(precnwPath).crop((0, 0, 200, 100)).save(croppedPath)
+    report = validateInputs(tempnsPath, tempnwPath, precnsPath, croppedPath, tempProf, precProf)
+    main(['-u', tempnsPath, '-t', tempnwPath, '-q', precnsPath, '-p', precnwPath, '-o', outputPath, '--report=' + reportPath, '-s'])
+    return (not report['sameSize']) and (report['inputs'][3]['size'] == [200, 100]) and (len(report['errors']) == 2) and \
+        compareImages(outputPath, getTestDirPath('ProfiaOutputDefault.png'))
+
+def test44Clean():
+    dPaths = [getTestDirPath(fname) for fname in ('test44-report.json', 'test44-highlight.png', 'test44-cropped.png', 'test44-out.png')]
+    deleteFiles(dPaths)
+
+def test45Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProfs = [OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor), OutputProfile(hColorTableDefault, defaultOceanColor, defaultUnknownColor)]
+    csvPath = getTestDirPath('test45-stats.csv')
+    outputPath = getTestDirPath('test45-out.png')
+
+    # An odd-sized map, so that the hemispheres divide partway along a row
+    inputArrays = [np.asarray(Image.open(path).convert('RGB'))[:127, :255] for path in getProfiaInputs()]
+    statistics = ClassStatistics()
+    buildOutputs(inputArrays[0], inputArrays[1], inputArrays[2], inputArrays[3], tempProf, precProf, outProfs, ['koppen', 'holdridge'], 'numpy', stripHeight=10, statistics=statistics)
+    parallelStatistics = ClassStatistics()
+    buildOutputs(inputArrays[0], inputArrays[1], inputArrays[2], inputArrays[3], tempProf, precProf, outProfs, ['koppen', 'holdridge'], 'table', jobs=2, statistics=parallelStatistics)
+    report = statistics.getReport()
+    if (parallelStatistics.getReport() != report):
+        return False
+
+    # The counts match those taken directly from the class-id maps
+    northern = getNorthernMask(127, 255)
+    weights = np.cos(np.radians(90.0 - ((np.arange(127) + 0.5) * (180.0 / 127)))).reshape(-1, 1) * np.ones((1, 255))
+    for mode, modeReport in zip(['koppen', 'holdridge'], report['modes']):
+        classIds, classNames = classifyMaps(inputArrays[0], inputArrays[1], inputArrays[2], inputArrays[3], tempProf, precProf, mode)
+        classified = weights[classIds > 0].sum()
+        for classId, classReport in enumerate(modeReport['classes'], 1):
+            inClass = classIds == classId
+            if (classReport['class'] != classNames[classId - 1]) or (classReport['pixels'] != int(inClass.sum())) or \
+               (classReport['northernPixels'] != int((inClass & northern).sum())) or (classReport['southernPixels'] != int((inClass & ~northern).sum())) or \
+               (abs(classReport['areaFraction'] - (weights[inClass].sum() / classified)) > 1e-6):
+                return False
+        if (modeReport['ignoredPixels'] != int((classIds == 0).sum())) or (modeReport['northernClassifiedPixels'] != int(((classIds > 0) & northern).sum())):
+            return False
+
+    # Classes sharing an output color are counted separately, and the scalar engine cannot count classes
+    main(['-u', getProfiaInputs()[0], '-t', getProfiaInputs()[1], '-q', getProfiaInputs()[2], '-p', getProfiaInputs()[3], '-o', outputPath, '--stats=' + csvPath, '-s'])
+    fp = open(csvPath, 'r')
+    rows = fp.read().splitlines()
+    fp.close()
+    scalarRefused = False
+    try:
+        buildOutput(inputArrays[0], inputArrays[1], inputArrays[2], inputArrays[3], tempProf, precProf, outProfs[0], statistics=ClassStatistics())
+    except SKCCError:
+        scalarRefused = True
+    return scalarRefused and (rows[0].split(',')[:3] == ['mode', 'class', 'pixels']) and (rows[2].startswith('koppen,As,')) and \
+        (rows[3].startswith('koppen,Aw,')) and compareImages(outputPath, getTestDirPath('ProfiaOutputDefault.png'))
+
+def test45Clean():
+    dPaths = [getTestDirPath('test45-stats.csv'), getTestDirPath('test45-out.png')]
+    deleteFiles(dPaths)
+
+def test46Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    outProf = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+    outputPath = getTestDirPath('test46-out.png')
+    csvPath = getTestDirPath('test46-transitions.csv')
+
+    # The second scenario swaps the summer and winter temperatures, changing many classes
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+    scenario1 = [tempnsPath, tempnwPath, precnsPath, precnwPath]
+    scenario2 = [tempnwPath, tempnsPath, precnsPath, precnwPath]
+    classIds1, classIds2, classNames, transitions = compareScenarios(scenario1, scenario2, tempProf, precProf, 'koppen', 'numpy', stripHeight=10)
+    for engine in ('memo', 'table'):
+        results = compareScenarios(scenario1, scenario2, tempProf, precProf, 'koppen', engine)
+        if not np.array_equal(results[3], transitions):
+            return False
+
+    # Each scenario matches classifying it on its own, and the matrix counts the pairs of classes
+    expectedIds1 = classifyMaps(*scenario1, tempProfile=tempProf, precProfile=precProf)[0]
+    expectedIds2 = classifyMaps(*scenario2, tempProfile=tempProf, precProfile=precProf)[0]
+    expectedTransitions = np.zeros(transitions.shape, dtype=np.int64)
+    np.add.at(expectedTransitions, (expectedIds1.ravel(), expectedIds2.ravel()), 1)
+    changed = expectedIds1 != expectedIds2
+    if not (np.array_equal(classIds1, expectedIds1) and np.array_equal(classIds2, expectedIds2) and np.array_equal(transitions, expectedTransitions)) or not changed.any():
+        return False
+
+    # The change map shows changed pixels in their new class color and the others in grey (or the ignored color)
+    changeMap = np.asarray(getChangeMapImage(classIds1, classIds2, classNames, outProf))
+    newColors = np.asarray(classIdsToImage(classIds2, classNames, outProf))
+    unchangedLand = ~changed & (classIds2 != 0)
+    if not (np.array_equal(changeMap[changed], newColors[changed]) and np.all(changeMap[unchangedLand] == defaultUnchangedColor) and
+            np.all(changeMap[~changed & (classIds2 == 0)] == defaultOceanColor)):
+        return False
+
+    # From the command line, the matrix is written alongside the change map unless a file is given for it
+    main(['-u', tempnsPath, '-t', tempnwPath, '-q', precnsPath, '-p', precnwPath, '--compare-tempns=' + tempnwPath, '--compare-tempnw=' + tempnsPath,
+          '--compare-precns=' + precnsPath, '--compare-precnw=' + precnwPath, '-o', outputPath, '-s'])
+    fp = open(getTransitionsFileName(outputPath), 'r')
+    report = json.load(fp)
+    fp.close()
+    main(['-u', tempnsPath, '-t', tempnwPath, '-q', precnsPath, '-p', precnwPath, '--compare-tempns=' + tempnwPath, '--compare-tempnw=' + tempnsPath,
+          '--compare-precns=' + precnsPath, '--compare-precnw=' + precnwPath, '-o', outputPath, '--transitions=' + csvPath, '-e', 'table', '-s'])
+    fp = open(csvPath, 'r')
+    rows = fp.read().splitlines()
+    fp.close()
+    return (report['matrix'] == transitions.tolist()) and (report['changedPixels'] == int(changed.sum())) and \
+        (rows[1].split(',') == ['Ignored'] + [str(count) for count in transitions[0]]) and np.array_equal(np.asarray(Image.open(outputPath)), changeMap)
+
+def test46Clean():
+    outputPath = getTestDirPath('test46-out.png')
+    dPaths = [outputPath, getTransitionsFileName(outputPath), getTestDirPath('test46-transitions.csv')]
+    deleteFiles(dPaths)
+
+def test47Fn():
+    tempProf = InputProfile(tColorTableDefault, [defaultOceanColor])
+    precProf = InputProfile(pColorTableDefault, [defaultOceanColor])
+    koppenProf = OutputProfile(kColorTableDefault, defaultOceanColor, defaultUnknownColor)
+    holdridgeProf = OutputProfile(hColorTableDefault, defaultOceanColor, defaultUnknownColor)
+    outputPath = getTestDirPath('test47-out.png')
+    outputPath2 = getTestDirPath('test47-out2.png')
+    tempnsPath, tempnwPath, precnsPath, precnwPath = getProfiaInputs()
+
+    # Tables built in small chunks match those built in one go
+    table = compileDecisionTable(tempProf, precProf, 'koppen')
+    chunkEntries = decisionTableModule.tableChunkEntries
+    decisionTableModule.tableChunkEntries = 1000
+    try:
+        chunkedTable = compileDecisionTable(tempProf, precProf, 'koppen')
+    finally:
+        decisionTableModule.tableChunkEntries = chunkEntries
+    if not np.array_equal(table.classTable, chunkedTable.classTable):
+        return False
+
+    # Profiles with too many combinations for a table fall back to the memo engine
+    maxEntries = decisionTableModule.maxTableEntries
+    decisionTableModule.maxTableEntries = 1000
+    try:
+        outputToFile(outputPath, buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, koppenProf, 'koppen', engine='table'))
+        outputToFile(outputPath2, buildOutput(tempnsPath, tempnwPath, precnsPath, precnwPath, tempProf, precProf, holdridgeProf, 'holdridge', engine='table'))
+    finally:
+        decisionTableModule.maxTableEntries = maxEntries
+
+    return compareImages(outputPath, getTestDirPath('ProfiaOutputDefault.png')) and compareImages(outputPath2, getTestDirPath('ProfiaHoldridgeOutput.png'))
+
+def test47Clean():
+    outputPath = getTestDirPath('test47-out.png')
+    outputPath2 = getTestDirPath('test47-out2.png')
+    dPaths = [outputPath, outputPath2]
+    deleteFiles(dPaths)
+
 def runAll(doCleanup):
     tests = []
     tests.append(ImgTest('All default profiles - Profia test', test1Fn, test1Clean))
@@ -326,6 +1394,39 @@ def runAll(doCleanup):
     tests.append(ImgTest('Test for bugfix of ocean detection condition for pixels that are ocean when others have land', test12Fn, test12Clean))
     tests.append(ImgTest('Test for fix of custom output profile reading missing the Ocean keyword', test13Fn, test13Clean))
     tests.append(ImgTest('Test complementing the Ocean keyword fix to check that the Ignored keyword has the same effect', test14Fn, test14Clean))
+    tests.append(ImgTest('Numpy engine - all default profiles - Profia test', test15Fn, test15Clean))
+    tests.append(ImgTest('Numpy engine - all default profiles - Boxes test (swapped summer/winter precipitation)', test16Fn, test16Clean))
+    tests.append(ImgTest('Numpy engine - input profiles with (Default) colors - Ball test', test17Fn, test17Clean))
+    tests.append(ImgTest('Numpy engine - correct error is thrown for invalid pixel colors in input data', test18Fn, test18Clean))
+    tests.append(ImgTest('Numpy engine - all default profiles - Holdridge mode Profia test', test19Fn, test19Clean))
+    tests.append(ImgTest('Numpy engine - all unmatched input colors are reported in one error', test20Fn, test20Clean))
+    tests.append(ImgTest('Compiled input profiles respect (Default) values and ignored colors', test21Fn, test21Clean))
+    tests.append(ImgTest('Memo engine - alternate output profile - Profia test', test22Fn, test22Clean))
+    tests.append(ImgTest('Memo engine - input profiles that (Default) to ocean - Profia test', test23Fn, test23Clean))
+    tests.append(ImgTest('Memo engine - all default profiles - Holdridge mode Profia test', test24Fn, test24Clean))
+    tests.append(ImgTest('Table engine - one decision table reused for two maps - Profia test', test25Fn, test25Clean))
+    tests.append(ImgTest('Table engine - all default profiles - Holdridge mode Profia test', test26Fn, test26Clean))
+    tests.append(ImgTest('Table engine - correct error is thrown for invalid pixel colors in input data', test27Fn, test27Clean))
+    tests.append(ImgTest('Strip processing - all default profiles - Boxes test', test28Fn, test28Clean))
+    tests.append(ImgTest('Parallel processing - all default profiles - Profia test', test29Fn, test29Clean))
+    tests.append(ImgTest('Batch runner - one failing job does not stop the others - Profia test', test30Fn, test30Clean))
+    tests.append(ImgTest('Multiple modes in one pass - Koppen and Holdridge - Profia test', test31Fn, test31Clean))
+    tests.append(ImgTest('Color correction script repairs an invalid pixel from its neighbors - Profia test', test32Fn, test32Clean))
+    tests.append(ImgTest('Color correction script snaps drifted colors to the nearest profile colors - Profia test', test33Fn, test33Clean))
+    tests.append(ImgTest('Stage profiling records each stage of building the output - Profia test', test34Fn, test34Clean))
+    tests.append(ImgTest('Disk cache of parsed profiles and decision tables is reused across reads - Profia test', test35Fn, test35Clean))
+    tests.append(ImgTest('Incremental rendering reclassifies only tiles whose inputs changed - Profia test', test36Fn, test36Clean))
+    tests.append(ImgTest('Classification server returns output images and reports errors and metrics - Profia test', test37Fn, test37Clean))
+    tests.append(ImgTest('In-memory API classifies arrays and images from several threads without changing defaults - Profia test', test38Fn, test38Clean))
+    tests.append(ImgTest('Paletted and class-id outputs match the RGB output - Profia test', test39Fn, test39Clean))
+    tests.append(ImgTest('Memory-mapped stack and .npy inputs give the same map as images - Profia test', test40Fn, test40Clean))
+    tests.append(ImgTest('Value raster inputs with NaN and mask layers give the same map as colors - Profia test', test41Fn, test41Clean))
+    tests.append(ImgTest('Indexed-color inputs are classified by palette index with every engine - Profia test', test42Fn, test42Clean))
+    tests.append(ImgTest('Cached input layers are reused across runs and modes - Profia test', test43Fn, test43Clean))
+    tests.append(ImgTest('Validation reports every unmatched color and size mismatch before classifying - Profia test', test44Fn, test44Clean))
+    tests.append(ImgTest('Class statistics count each class by hemisphere and weighted area - Profia test', test45Fn, test45Clean))
+    tests.append(ImgTest('Scenario comparison builds the change map and class transition matrix in one pass - Profia test', test46Fn, test46Clean))
+    tests.append(ImgTest('Decision tables are built in chunks and fall back to the memo engine when too large - Profia test', test47Fn, test47Clean))
     runTests(tests, doCleanup)
 
 if __name__ == '__main__':
@@ -0,0 +1,90 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+# worldgen.py - Generates synthetic worlds (the four skcc input images) for benchmarking.
+# (c) 2020 Patrick Harvey [see LICENSE.txt]
+
+import sys, os
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from skcc import tColorTableDefault, pColorTableDefault, defaultOceanColor
+
+# Returns smooth noise in [0, 1] of the given size, built from several octaves of random
+# grids scaled up with bicubic interpolation. The noise wraps neither axis.
+def smoothNoise(width, height, rng, octaves=5, baseCells=6):
+    total = np.zeros((height, width), dtype=np.float32)
+    weight = 1.0
+    weights = 0.0
+    for octave in range(octaves):
+        cellsX = baseCells * (2 ** octave)
+        cellsY = max(2, cellsX // 2)
+        grid = rng.random((cellsY, cellsX), dtype=np.float32)
+        layer = np.asarray(Image.fromarray(grid, 'F').resize((width, height), Image.BICUBIC))
+        total += layer * weight
+        weights += weight
+        weight *= 0.5
+    total /= weights
+    low, high = total.min(), total.max()
+    return (total - low) / max(high - low, 1e-6)
+
+# Returns an (height, width, 3) image array with each value replaced by the color
+# of the nearest value in a default input color table.
+def quantizeToPalette(values, colorTable):
+    colors = sorted(colorTable.keys(), key=lambda color: colorTable[color])
+    levels = np.array([colorTable[color] for color in colors], dtype=np.float32)
+    midpoints = (levels[1:] + levels[:-1]) / 2.0
+    return np.array(colors, dtype=np.uint8)[np.searchsorted(midpoints, values)]
+
+# Generates the (summer temperature, winter temperature, summer precipitation, winter precipitation)
+# input arrays (northern-hemisphere summer/winter, as skcc expects) of a synthetic world using the
+# default input profile colors. Temperature falls off with latitude, with seasonal swings that grow
+# towards the poles and inland; precipitation peaks at the equator and mid-latitudes and is low in the
+# subtropics and polar regions. About oceanFraction of the map is ocean.
+def generateWorld(width, height, seed=0, oceanFraction=0.7):
+    rng = np.random.default_rng(seed)
+    lat = np.linspace(90.0, -90.0, height, dtype=np.float32).reshape(height, 1)
+    absLat = np.abs(lat)
+    northern = lat > 0
+
+    elevation = smoothNoise(width, height, rng)
+    land = elevation > np.quantile(elevation, oceanFraction)
+    continentality = smoothNoise(width, height, rng, octaves=3)
+    tempNoise = smoothNoise(width, height, rng)
+    precNoise = smoothNoise(width, height, rng)
+    seasonality = smoothNoise(width, height, rng, octaves=3)
+
+    meanTemp = 27.0 - (52.0 * ((absLat / 90.0) ** 1.5)) + (8.0 * (tempNoise - 0.5)) - (10.0 * np.maximum(elevation - 0.85, 0.0) / 0.15)
+    swing = 2.0 + (30.0 * (absLat / 90.0) * (0.4 + continentality))
+    tempSummer = meanTemp + (swing / 2.0)
+    tempWinter = meanTemp - (swing / 2.0)
+
+    meanPrec = (160.0 * np.exp(-((absLat / 12.0) ** 2))) + (70.0 * np.exp(-(((absLat - 50.0) / 14.0) ** 2))) + 8.0
+    meanPrec = meanPrec * np.exp(1.6 * (precNoise - 0.5))
+    summerShare = 0.2 + (0.6 * seasonality)
+    precSummer = meanPrec * 2.0 * summerShare
+    precWinter = meanPrec * 2.0 * (1.0 - summerShare)
+
+    layers = [np.where(northern, tempSummer, tempWinter), np.where(northern, tempWinter, tempSummer),
+              np.where(northern, precSummer, precWinter), np.where(northern, precWinter, precSummer)]
+    tables = [tColorTableDefault, tColorTableDefault, pColorTableDefault, pColorTableDefault]
+    rgbArrays = []
+    for layer, table in zip(layers, tables):
+        rgbArray = quantizeToPalette(layer, table)
+        rgbArray[~land] = defaultOceanColor
+        rgbArrays.append(rgbArray)
+    return rgbArrays
+
+# Writes a synthetic world to PNG files in directory dirName (reusing them if already there),
+# returning the (tempns, tempnw, precns, precnw) file names.
+def writeWorld(dirName, width, height, seed=0, oceanFraction=0.7):
+    baseName = 'world-' + str(width) + 'x' + str(height) + '-' + str(seed) + '-' + str(oceanFraction)
+    fileNames = [os.path.join(dirName, baseName + '-' + layer + '.png') for layer in ('tempns', 'tempnw', 'precns', 'precnw')]
+    if not all(os.path.exists(fname) for fname in fileNames):
+        if not os.path.isdir(dirName):
+            os.makedirs(dirName)
+        for fname, rgbArray in zip(fileNames, generateWorld(width, height, seed, oceanFraction)):
+            Image.fromarray(rgbArray, 'RGB').save(fname)
+    return fileNames
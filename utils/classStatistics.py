@@ -0,0 +1,137 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+# classStatistics.py
+# (c) 2020 Patrick Harvey (see LICENSE.txt)
+
+# Per-class pixel counts and areas of classified maps, counted from the class-id arrays as they
+# are classified (so each class is counted separately, even where classes share an output color).
+
+import csv, json
+import numpy as np
+from utils.errors import SKCCError
+
+# Rows of a class-id array counted at once, to bound the memory used for counting.
+countRows = 256
+
+# Returns the cosine of the latitude at the center of each row of an equirectangular map
+# (running from 90 degrees north at the top to 90 degrees south at the bottom), which is
+# proportional to the area each pixel of that row covers.
+def getRowAreaWeights(height):
+    latitudes = 90.0 - ((np.arange(height) + 0.5) * (180.0 / height))
+    return np.cos(np.radians(latitudes))
+
+# Returns an (N, K) array counting the pixels of each of K class ids in each of the N rows of a class-id array.
+def countClassIdsByRow(classIds, classCount):
+    height = classIds.shape[0]
+    rowCounts = np.zeros((height, classCount), dtype=np.int64)
+    for rowStart in range(0, height, countRows):
+        rowEnd = min(rowStart + countRows, height)
+        rowIds = classIds[rowStart:rowEnd].astype(np.intp) + (np.arange(rowEnd - rowStart, dtype=np.intp) * classCount).reshape(-1, 1)
+        rowCounts[rowStart:rowEnd] = np.bincount(rowIds.ravel(), minlength=(rowEnd - rowStart) * classCount).reshape(-1, classCount)
+    return rowCounts
+
+# Divides, giving zero rather than NaN where there is nothing to divide.
+def getFractions(counts, total):
+    if (total == 0):
+        return np.zeros_like(counts, dtype=np.float64)
+    return counts / float(total)
+
+# Accumulates the pixels of each class in the class-id maps (as built by skcc.buildClassIdMaps)
+# of one or more modes, which can be added a strip of rows at a time. The northern hemisphere is
+# the first half of the pixels in image order, as the classifiers take it, and areas are weighted
+# by the cosine of latitude, as for equirectangular maps.
+class ClassStatistics:
+    def __init__(self):
+        self.maps = {}
+        self.modes = []
+
+    # Counts the classes in a class-id array, where id 0 marks ignored pixels and id i the class
+    # classNames[i-1]. For a strip of rows, rowStart is the strip's first row and totalHeight the height of the map.
+    def addClassIds(self, mode, classIds, classNames, rowStart=0, totalHeight=None):
+        height, width = classIds.shape
+        if totalHeight is None:
+            totalHeight = height
+        entry = self.maps.get(mode)
+        if entry is None:
+            entry = {'classNames': list(classNames), 'width': width, 'height': totalHeight,
+                     'rowCounts': np.zeros((totalHeight, len(classNames) + 1), dtype=np.int64),
+                     'cutCounts': np.zeros(len(classNames) + 1, dtype=np.int64)}
+            self.maps[mode] = entry
+            self.modes.append(mode)
+        elif (entry['width'] != width) or (entry['height'] != totalHeight) or (entry['classNames'] != list(classNames)):
+            raise SKCCError('Class statistics for ' + mode + ' mode were already gathered from a different map.')
+        classCount = len(classNames) + 1
+        entry['rowCounts'][rowStart:rowStart + height] += countClassIdsByRow(classIds, classCount)
+
+        # The hemispheres can divide partway along a row, whose northern part is counted on its own
+        cutRow, cutCol = divmod(((totalHeight * width) + 1) // 2, width)
+        if (rowStart <= cutRow < (rowStart + height)):
+            entry['cutCounts'] += np.bincount(classIds[cutRow - rowStart, :cutCol], minlength=classCount)
+
+    # Returns the statistics for each mode as a dictionary suitable for writing out as JSON.
+    # Fractions are of the classified (not ignored) pixels, and area fractions of the classified
+    # area, of the whole map or of one hemisphere.
+    def getReport(self):
+        report = {'modes': []}
+        for mode in self.modes:
+            entry = self.maps[mode]
+            rowCounts = entry['rowCounts']
+            width, height = entry['width'], entry['height']
+            cutRow = (((height * width) + 1) // 2) // width
+            weights = getRowAreaWeights(height)
+
+            northernCounts = rowCounts[:cutRow].sum(axis=0) + entry['cutCounts']
+            counts = rowCounts.sum(axis=0)
+            southernCounts = counts - northernCounts
+            northernAreas = weights[:cutRow].dot(rowCounts[:cutRow])
+            if (cutRow < height):
+                northernAreas = northernAreas + (weights[cutRow] * entry['cutCounts'])
+            areas = weights.dot(rowCounts)
+            southernAreas = areas - northernAreas
+
+            # Id 0 (ignored pixels) is left out of the totals that fractions are taken of
+            fractions = getFractions(counts[1:], counts[1:].sum())
+            areaFractions = getFractions(areas[1:], areas[1:].sum())
+            northernAreaFractions = getFractions(northernAreas[1:], northernAreas[1:].sum())
+            southernAreaFractions = getFractions(southernAreas[1:], southernAreas[1:].sum())
+            classes = []
+            for idx, name in enumerate(entry['classNames']):
+                classes.append({'class': name, 'pixels': int(counts[idx + 1]), 'fraction': round(float(fractions[idx]), 6),
+                                'areaFraction': round(float(areaFractions[idx]), 6),
+                                'northernPixels': int(northernCounts[idx + 1]), 'southernPixels': int(southernCounts[idx + 1]),
+                                'northernAreaFraction': round(float(northernAreaFractions[idx]), 6),
+                                'southernAreaFraction': round(float(southernAreaFractions[idx]), 6)})
+            report['modes'].append({'mode': mode, 'width': width, 'height': height, 'pixels': int(counts.sum()),
+                                    'ignoredPixels': int(counts[0]), 'classifiedPixels': int(counts[1:].sum()),
+                                    'northernClassifiedPixels': int(northernCounts[1:].sum()),
+                                    'southernClassifiedPixels': int(southernCounts[1:].sum()),
+                                    'northernAreaFraction': round(float(getFractions(northernAreas[1:].sum(), areas[1:].sum())), 6),
+                                    'classes': classes})
+        return report
+
+    # Writes the statistics to the file fname: as CSV (one row per mode and class) if its name ends
+    # in .csv, and otherwise as JSON ('-' for JSON on standard output).
+    def writeReport(self, fname):
+        report = self.getReport()
+        if (fname == '-'):
+            print(json.dumps(report, indent=2))
+            return
+        try:
+            fp = open(fname, 'w', newline='')
+        except OSError:
+            raise SKCCError('Could not write to file ' + fname)
+        try:
+            if fname.lower().endswith('.csv'):
+                fields = ['mode', 'class', 'pixels', 'fraction', 'areaFraction', 'northernPixels', 'southernPixels', 'northernAreaFraction', 'southernAreaFraction']
+                writer = csv.DictWriter(fp, fields)
+                writer.writeheader()
+                for modeReport in report['modes']:
+                    for classReport in modeReport['classes']:
+                        row = {'mode': modeReport['mode']}
+                        row.update(classReport)
+                        writer.writerow(row)
+            else:
+                fp.write(json.dumps(report, indent=2) + '\n')
+        finally:
+            fp.close()
@@ -0,0 +1,193 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+# diskCache.py
+# (c) 2020 Patrick Harvey (see LICENSE.txt)
+
+# A cache of pickled objects (and NumPy arrays) on disk, keyed by content hashes, that can be shared
+# between runs and processes. Entries are written atomically, so concurrent readers only ever see
+# whole entries, and the least recently used entries are removed once the cache grows too large.
+# The cache directory must only be writable by trusted users, as entries are unpickled.
+
+import os, pickle, hashlib, tempfile, threading
+from contextlib import contextmanager
+
+# Default bound on the total size of the cache files.
+defaultMaxBytes = 256 << 20
+
+cacheSuffix = '.pkl'
+arraySuffix = '.npy'
+
+# Returns a hex digest identifying the given parts (strings or bytes) together.
+def hashParts(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(str(len(part)).encode('ascii') + b':' + part)
+    return digest.hexdigest()
+
+# Returns a hex digest of the contents of a file.
+def hashFile(fname):
+    digest = hashlib.sha256()
+    fp = open(fname, 'rb')
+    try:
+        for block in iter(lambda: fp.read(1 << 16), b''):
+            digest.update(block)
+    finally:
+        fp.close()
+    return digest.hexdigest()
+
+class DiskCache:
+    def __init__(self, dirName, maxBytes=defaultMaxBytes):
+        self.dirName = dirName
+        self.maxBytes = maxBytes
+        self.keepLock = threading.Lock()
+        self.keepDepth = 0
+        self.keptPaths = set()
+
+    # Keeps the entries read or written within the block from being evicted until it ends, so that
+    # entries needed together (such as the input layers of one run) do not push each other out.
+    @contextmanager
+    def keepingEntries(self):
+        with self.keepLock:
+            self.keepDepth += 1
+        try:
+            yield
+        finally:
+            with self.keepLock:
+                self.keepDepth -= 1
+                if (self.keepDepth == 0):
+                    self.keptPaths.clear()
+
+    def markUsed(self, path):
+        with self.keepLock:
+            if self.keepDepth:
+                self.keptPaths.add(path)
+
+    def getPath(self, key, suffix=cacheSuffix):
+        return os.path.join(self.dirName, key + suffix)
+
+    # Returns the object stored under key, or None if there is none (or it cannot be read).
+    def get(self, key):
+        path = self.getPath(key)
+        try:
+            fp = open(path, 'rb')
+        except OSError:
+            return None
+        try:
+            value = pickle.load(fp)
+        except Exception:
+            # A damaged entry is treated as missing and removed
+            fp.close()
+            self.remove(path)
+            return None
+        fp.close()
+        try:
+            # Mark the entry as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        self.markUsed(path)
+        return value
+
+    # Stores an object under key. Failing to write the cache is not an error; the object is just not cached.
+    def put(self, key, value):
+        try:
+            if not os.path.isdir(self.dirName):
+                os.makedirs(self.dirName, exist_ok=True)
+            handle, tempPath = tempfile.mkstemp(dir=self.dirName, suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'wb') as fp:
+                    pickle.dump(value, fp, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tempPath, self.getPath(key))
+                self.markUsed(self.getPath(key))
+            except BaseException:
+                self.remove(tempPath)
+                raise
+        except OSError:
+            return
+        self.evict()
+
+    # Returns the array stored under key, memory-mapped from the cache file, or None if there is none.
+    # Arrays are stored as .npy files rather than pickled. Requires NumPy.
+    def getArray(self, key):
+        import numpy as np
+        path = self.getPath(key, arraySuffix)
+        try:
+            value = np.load(path, mmap_mode='r', allow_pickle=False)
+        except OSError:
+            return None
+        except ValueError:
+            self.remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.markUsed(path)
+        return value
+
+    # Stores an array under key as a .npy file, returning whether it was stored. Failing to write the
+    # cache is not an error, and arrays larger than the whole cache are not stored.
+    def putArray(self, key, value):
+        import numpy as np
+        if (value.nbytes > self.maxBytes):
+            return False
+        try:
+            if not os.path.isdir(self.dirName):
+                os.makedirs(self.dirName, exist_ok=True)
+            handle, tempPath = tempfile.mkstemp(dir=self.dirName, suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'wb') as fp:
+                    np.save(fp, value, allow_pickle=False)
+                os.replace(tempPath, self.getPath(key, arraySuffix))
+                self.markUsed(self.getPath(key, arraySuffix))
+            except BaseException:
+                self.remove(tempPath)
+                raise
+        except OSError:
+            return False
+        self.evict()
+        return True
+
+    # Returns the object stored under key, building and storing it with builder() if it is not cached.
+    def getOrBuild(self, key, builder):
+        value = self.get(key)
+        if value is None:
+            value = builder()
+            self.put(key, value)
+        return value
+
+    # Removes the least recently used entries until the cache is within its size bound, other than
+    # those being kept by keepingEntries.
+    def evict(self):
+        entries = []
+        try:
+            names = os.listdir(self.dirName)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(cacheSuffix) or name.endswith(arraySuffix):
+                path = os.path.join(self.dirName, name)
+                try:
+                    stats = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stats.st_mtime, stats.st_size, path))
+        totalBytes = sum(entry[1] for entry in entries)
+        with self.keepLock:
+            keptPaths = set(self.keptPaths)
+        for mtime, size, path in sorted(entries):
+            if (totalBytes <= self.maxBytes):
+                break
+            if path in keptPaths:
+                continue
+            self.remove(path)
+            totalBytes -= size
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,101 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+
+# profiling.py
+# (c) 2020 Patrick Harvey (see LICENSE.txt)
+
+# Timing of the stages of building an output map, for finding which stage dominates.
+
+import sys, time, json
+from contextlib import contextmanager
+from utils.errors import SKCCError
+
+# The resource module is not available on all platforms (e.g. Windows).
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Returns the peak resident set size in bytes of this process (or of the largest of its finished
+# worker processes, if children is True), or None if it cannot be measured.
+def getPeakRSS(children=False):
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
+
+# Accumulates the time spent in each named stage (stages that run more than once,
+# e.g. once per strip, are summed) along with the number of pixels processed.
+class StageProfiler:
+    def __init__(self):
+        self.startTime = time.perf_counter()
+        self.stages = {}
+        self.pixels = 0
+        self.info = {}
+        # Time spent producing items timed by timeItems, which is left out of the stage consuming them
+        self.itemSeconds = 0.0
+
+    @contextmanager
+    def stage(self, name):
+        stageStart = time.perf_counter()
+        itemStart = self.itemSeconds
+        try:
+            yield
+        finally:
+            itemSeconds = self.itemSeconds - itemStart
+            self.stages[name] = self.stages.get(name, 0.0) + ((time.perf_counter() - stageStart) - itemSeconds)
+
+    # Yields the items of an iterable, counting the time spent producing each one towards the named
+    # stage rather than the stage consuming them. This times a stage computed lazily, item by item,
+    # without having to keep all its results.
+    def timeItems(self, name, items):
+        self.stages.setdefault(name, 0.0)
+        iterator = iter(items)
+        while True:
+            itemStart = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                itemSeconds = time.perf_counter() - itemStart
+                self.stages[name] += itemSeconds
+                self.itemSeconds += itemSeconds
+            yield item
+
+    def addPixels(self, count):
+        self.pixels += count
+
+    # Returns the seconds spent in each stage, in the order the stages were first run.
+    def getStageTimes(self):
+        return dict((name, round(seconds, 6)) for name, seconds in self.stages.items())
+
+    # Returns the timings as a dictionary suitable for writing out as JSON.
+    def getReport(self):
+        totalSeconds = time.perf_counter() - self.startTime
+        report = dict(self.info)
+        report['stages'] = self.getStageTimes()
+        report['totalSeconds'] = round(totalSeconds, 6)
+        report['pixels'] = self.pixels
+        report['pixelsPerSecond'] = round(self.pixels / totalSeconds, 1) if (totalSeconds > 0) else None
+        report['peakRSSBytes'] = getPeakRSS()
+        report['peakWorkerRSSBytes'] = getPeakRSS(children=True)
+        return report
+
+    # Writes the timings as JSON to the file fname, or to standard output if fname is '-'.
+    def writeReport(self, fname):
+        text = json.dumps(self.getReport(), indent=2)
+        if (fname == '-'):
+            print(text)
+            return
+        try:
+            fp = open(fname, 'w')
+        except OSError:
+            raise SKCCError('Could not write to file ' + fname)
+        try:
+            fp.write(text + '\n')
+        finally:
+            fp.close()